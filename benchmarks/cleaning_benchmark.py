@@ -0,0 +1,133 @@
+"""
+Per-row cost of cleaning a /requestData result: the old row-by-row
+_tuneData loop against the columnar utils.cleanColumns.
+
+Run from the repo root in the development environment (see README),
+with the app.yaml env_variables set or loaded from app.yaml:
+
+    python benchmarks/cleaning_benchmark.py [rows]
+"""
+from datetime import datetime, timedelta
+import gc
+from os import environ, getenv
+import sys
+from time import perf_counter
+import numpy as np
+import pytz
+import yaml
+
+with open('app.yaml') as f:
+    for k, v in yaml.safe_load(f)['env_variables'].items():
+        environ.setdefault(k, str(v))
+
+from tetrad import utils
+from tetrad.api_consts import *
+from tetrad.registry import RegistrySnapshot
+
+
+# Twelve monthly factors over 2020, like the production CSV
+FACTOR_START = datetime(2020, 1, 1, tzinfo=pytz.utc)
+FACTORS = [
+    ((FACTOR_START + timedelta(days=30 * i)).timestamp(),
+     (FACTOR_START + timedelta(days=30 * (i + 1))).timestamp(),
+     0.5 + 0.02 * i,
+     1.0 - 0.1 * i)
+    for i in range(12)
+]
+
+
+def makeRows(n, seed=0):
+    rng = np.random.default_rng(seed)
+    offsets = np.sort(rng.uniform(0, 360 * 86400, n))
+    pm = rng.uniform(0, 60, n)
+    pm[rng.random(n) < 0.01] = PM_BAD_FLAG
+    pm[rng.random(n) < 0.01] = 900
+    temp = rng.uniform(-5, 35, n)
+    temp[rng.random(n) < 0.01] = TEMP_BAD_FLAG
+    hum = rng.uniform(5, 95, n)
+    hum[rng.random(n) < 0.01] = HUM_BAD_FLAG
+    return [
+        {
+            FIELD_MAP["DEVICEID"]:    f"{i % 500:012X}",
+            FIELD_MAP["TIMESTAMP"]:   FACTOR_START + timedelta(seconds=float(o)),
+            FIELD_MAP["PM2_5"]:       float(p),
+            FIELD_MAP["TEMPERATURE"]: float(t),
+            FIELD_MAP["HUMIDITY"]:    float(h),
+        }
+        for i, (o, p, t, h) in enumerate(zip(offsets, pm, temp, hum))
+    ]
+
+
+def rowClean(data):
+    """The row-by-row loop _tuneData ran, with numeric flags and a linear factor scan"""
+    pm, temp, hum, ts = FIELD_MAP["PM2_5"], FIELD_MAP["TEMPERATURE"], FIELD_MAP["HUMIDITY"], FIELD_MAP["TIMESTAMP"]
+    for datum in data:
+        if (datum[pm] == float(getenv("PM_BAD_FLAG"))) or (datum[pm] >= float(getenv("PM_BAD_THRESH"))):
+            datum[pm] = None
+        else:
+            t = datum[ts].timestamp()
+            for start, end, slope, intercept in FACTORS:
+                if start <= t < end:
+                    datum[pm] = max(0, datum[pm] * slope + intercept)
+                    break
+        if datum[temp] == float(getenv("TEMP_BAD_FLAG")):
+            datum[temp] = None
+        if datum[hum] == float(getenv("HUM_BAD_FLAG")):
+            datum[hum] = None
+    return [datum for datum in data if all(v is not None for v in datum.values())]
+
+
+def columnClean(columns):
+    return utils.cleanColumns(columns, ["PM2_5", "TEMPERATURE", "HUMIDITY"], removeNulls=True)
+
+
+def timed(fn, makeArg, repeat=3):
+    """Best of `repeat` runs of fn(makeArg()), and the last result"""
+    best = float('inf')
+    for _ in range(repeat):
+        arg = makeArg()
+        # Like timeit, keep the collector from charging one run for another's garbage
+        gc.collect()
+        gc.disable()
+        try:
+            t0 = perf_counter()
+            out = fn(arg)
+            best = min(best, perf_counter() - t0)
+        finally:
+            gc.enable()
+    return best, out
+
+
+def main(n):
+    snapshot = utils.REGISTRY.current
+    utils.REGISTRY.current = RegistrySnapshot(
+        {**snapshot.versions, 'correction_factors': 'benchmark'},
+        {**snapshot.data, 'correction_factors': utils.CorrectionFactors(FACTORS)},
+    )
+
+    rows = makeRows(n)
+    names = list(rows[0])
+    columns = {name: [r[name] for r in rows] for name in names}
+
+    # As the Storage Read API hands them over: floats and timestamps 
+    # as NumPy arrays (datetime64, not datetime objects)
+    arrow_columns = {name: np.array(col) if isinstance(col[0], float) else col for name, col in columns.items()}
+    arrow_columns[FIELD_MAP["TIMESTAMP"]] = np.array(
+        [t.replace(tzinfo=None) for t in columns[FIELD_MAP["TIMESTAMP"]]], dtype='datetime64[us]')
+
+    t_rows, cleaned_rows = timed(rowClean, lambda: [dict(r) for r in rows])
+    t_cols, cleaned_cols = timed(columnClean, lambda: dict(columns))
+    t_arrow, _ = timed(columnClean, lambda: dict(arrow_columns))
+
+    # Same rows survive, with the same values
+    assert len(cleaned_rows) == len(cleaned_cols[FIELD_MAP["PM2_5"]])
+    assert np.allclose([r[FIELD_MAP["PM2_5"]] for r in cleaned_rows], cleaned_cols[FIELD_MAP["PM2_5"]])
+
+    print(f"{n} rows, {len(cleaned_rows)} kept")
+    print(f"  row-by-row: {t_rows * 1e3:9.1f} ms  {t_rows / n * 1e9:7.0f} ns/row")
+    print(f"  columnar:   {t_cols * 1e3:9.1f} ms  {t_cols / n * 1e9:7.0f} ns/row  (datetime timestamps, REST pages)")
+    print(f"  columnar:   {t_arrow * 1e3:9.1f} ms  {t_arrow / n * 1e9:7.0f} ns/row  (datetime64 timestamps, Arrow batches)")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
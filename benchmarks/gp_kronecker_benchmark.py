@@ -0,0 +1,118 @@
+"""
+Time and peak memory of a time-structured gaussian_model fit and
+prediction: the old path, which formed the (T*S)x(T*S) space-time
+eigenvectors kron(Vt, Vs) and the test kernel kron(Kt, Ks), against
+the current one, which keeps the temporal and spatial factors apart
+and applies the temporal eigenvectors Vt with an FFT.
+Small cases run both and check they agree; the larger ones, at the
+sensor counts and 8-minute bins of a real estimate, only run the
+current path and report what the old one would have needed for the
+eigenvectors alone. Each path runs in a fresh interpreter, so its peak
+RSS is its own.
+
+Run from the repo root in the development environment (see README),
+with the app.yaml env_variables set or loaded from app.yaml:
+
+    python benchmarks/gp_kronecker_benchmark.py
+"""
+import json
+from os import environ
+import subprocess
+import sys
+import numpy as np
+import yaml
+
+with open('app.yaml') as f:
+    for k, v in yaml.safe_load(f)['env_variables'].items():
+        environ.setdefault(k, str(v))
+
+
+# (sensors S, time bins T, query locations, query times, compare with the old path)
+CASES = [
+    (40, 45, 100, 1, True),
+    (60, 90, 100, 3, True),
+    (100, 90, 400, 1, True),
+    (150, 180, 500, 1, False),
+    (150, 360, 500, 1, False),
+    (300, 360, 2500, 1, False),
+    # A week of 8-minute bins
+    (150, 1260, 500, 1, False),
+]
+
+# Imports tetrad.gaussian_model on its own: tetrad/__init__ starts the whole app
+CHILD = """
+import json, resource, sys, time, types
+import numpy as np
+import torch
+sys.modules['tetrad'] = types.ModuleType('tetrad')
+sys.modules['tetrad'].__path__ = ['tetrad']
+from tetrad import gaussian_model as gm
+
+S, T, S_test, T_test, old = json.loads(sys.argv[1])
+rng = np.random.default_rng(0)
+# UTM-like meters over a ~30 km region, elevations in meters, 8-minute bins in hours
+space = np.column_stack([rng.uniform(0, 30000, S), rng.uniform(0, 30000, S), rng.uniform(1300, 1600, S)])
+times = (np.arange(T) * 8 / 60).reshape(-1, 1)
+data = rng.uniform(0, 40, (S, T))
+test_space = torch.tensor(np.column_stack([rng.uniform(0, 30000, S_test), rng.uniform(0, 30000, S_test), rng.uniform(1300, 1600, S_test)]))
+test_times = torch.tensor(times[T // 2:T // 2 + T_test])
+
+
+def legacy(model):
+    # What update() and forward() did before, from the same factors
+    with torch.no_grad():
+        # The circulant eigenvectors depend only on the number of bins
+        _, eigen_vector_t = gm.symCirculantMatrixEigen(np.zeros(T))
+        eigen_vector_st = gm.kronecker(torch.from_numpy(eigen_vector_t), model.eigen_vector_s)
+        test_spatial_kernel = (
+            model.SE_kernel(test_space[:, 0:2], model.space_coordinates[:, 0:2], torch.exp(model.log_latlon_length_scale)) *
+            model.SE_kernel(test_space[:, 2:3], model.space_coordinates[:, 2:3], torch.exp(model.log_elevation_length_scale))
+        )
+        test_temporal_kernel = model.SE_kernel(test_times, model.time_coordinates, torch.exp(model.log_time_length_scale))
+        test_st_kernel = model.log_signal_variance.exp() * gm.kronecker(test_temporal_kernel, test_spatial_kernel)
+        sigma_diag = model.eigen_value_st_plus_noise_inverse.view(-1, 1) * (eigen_vector_st.t() @ model.stData.t().reshape(-1, 1))
+        yPred = (test_st_kernel @ eigen_vector_st) @ sigma_diag
+        test_times_eigen = test_st_kernel @ eigen_vector_st
+        yVar = model.log_signal_variance.exp() - torch.einsum(
+            "ij,ji->i", test_times_eigen, model.eigen_value_st_plus_noise_inverse.view(-1, 1) * test_times_eigen.t())
+        return yPred.view(T_test, S_test).t(), yVar.view(T_test, S_test).t()
+
+
+t0 = time.perf_counter()
+model = gm.gaussian_model(space, times, data, latlon_length_scale=4300., elevation_length_scale=30.,
+                          time_length_scale=0.25, noise_variance=36., signal_variance=400.)
+yPred, yVar = legacy(model) if old else model(test_space, test_times)
+print(json.dumps({
+    'seconds': time.perf_counter() - t0,
+    'peak_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'yPred': yPred.tolist(),
+    'yVar': yVar.tolist(),
+}))
+"""
+
+
+def run(case, old):
+    child = subprocess.run([sys.executable, '-c', CHILD, json.dumps(case + [old])], capture_output=True, text=True)
+    if child.returncode != 0:
+        sys.exit(child.stderr)
+    return json.loads(child.stdout.strip().splitlines()[-1])
+
+
+def main():
+    print(f"{'S':>5} {'T':>5} {'S* x T*':>9}  {'current':>20}  {'old':>20}  {'kron(Vt, Vs) alone':>18}")
+    for S, T, S_test, T_test, compare in CASES:
+        case = [S, T, S_test, T_test]
+        current = run(case, False)
+        old = run(case, True) if compare else None
+        if old:
+            # Same estimates and variances as before
+            assert np.allclose(current['yPred'], old['yPred'], rtol=1e-6, atol=1e-6)
+            assert np.allclose(current['yVar'], old['yVar'], rtol=1e-6, atol=1e-6)
+
+        timing = lambda r: f"{r['seconds'] * 1e3:7.0f} ms {r['peak_mb']:7.0f} MB" if r else "not run"
+        print(f"{S:5d} {T:5d} {f'{S_test} x {T_test}':>9}  {timing(current):>20}  {timing(old):>20}  "
+              f"{8 * (S * T) ** 2 / 2**20:15.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Cold start cost of the reference data: how long importing tetrad.utils
+takes, how long the first utils.regions() call waits, and how long the
+background refresh takes to swap in the region info from GCS. Each run
+is a fresh interpreter, like a new App Engine instance.
+
+Run from the repo root in the development environment (see README),
+with GCS credentials, the app.yaml env_variables set or loaded from
+app.yaml, and the region info snapshot copied into model_files:
+
+    python benchmarks/startup_benchmark.py [runs]
+"""
+import json
+from os import environ, path
+import subprocess
+import sys
+import yaml
+
+with open('app.yaml') as f:
+    for k, v in yaml.safe_load(f)['env_variables'].items():
+        environ.setdefault(k, str(v))
+
+# Seconds a run may wait for the GCS region info before it's a failure
+REFRESH_TIMEOUT = 60
+
+
+# Imports tetrad.utils on its own: tetrad/__init__ starts the whole app
+CHILD = """
+import json, sys, time, types
+timeout = float(sys.argv[1])
+t0 = time.perf_counter()
+sys.modules['tetrad'] = types.ModuleType('tetrad')
+sys.modules['tetrad'].__path__ = ['tetrad']
+from tetrad import utils
+t1 = time.perf_counter()
+utils.regions()
+t2 = time.perf_counter()
+utils.REGISTRY.start()
+deadline = time.perf_counter() + timeout
+while not str(utils.REGISTRY.current.versions.get('regions')).isdigit():
+    if time.perf_counter() > deadline:
+        sys.exit(f"GCS region info not loaded after {timeout:.0f} s (regions version "
+                 f"{utils.REGISTRY.current.versions.get('regions')})")
+    time.sleep(0.005)
+t3 = time.perf_counter()
+print(json.dumps({'import': t1 - t0, 'first_use': t2 - t1, 'refreshed': t3 - t0}))
+"""
+
+
+def run():
+    child = subprocess.run([sys.executable, '-c', CHILD, str(REFRESH_TIMEOUT)], capture_output=True, text=True)
+    if child.returncode:
+        sys.exit(f"Run failed:\n{child.stderr}")
+    return json.loads(child.stdout)
+
+
+def main(runs):
+    # Without the snapshot, first use would time the GCS fetch instead
+    snapshot = environ['REGION_INFO_SNAPSHOT_FILENAME']
+    if not path.exists(snapshot):
+        sys.exit(f"No region info snapshot at {snapshot}; copy it from GCS first (see README)")
+
+    results = [run() for _ in range(runs)]
+    for key, label in [('import', 'import tetrad.utils'), ('first_use', 'first regions()'), ('refreshed', 'GCS region info in')]:
+        times = sorted(r[key] for r in results)
+        print(f"  {label:20s} median {times[len(times) // 2] * 1e3:7.1f} ms  min {times[0] * 1e3:7.1f} ms")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,16 @@
+# Import tetrad modules on their own: tetrad/__init__ starts the whole
+# app (clients, background threads). The app.yaml env_variables stand in
+# for the deployed environment.
+from os import environ
+from pathlib import Path
+import sys
+import types
+import yaml
+
+ROOT = Path(__file__).resolve().parent.parent
+
+with open(ROOT / 'app.yaml') as f:
+    for k, v in yaml.safe_load(f)['env_variables'].items():
+        environ.setdefault(k, str(v))
+
+sys.modules.setdefault('tetrad', types.ModuleType('tetrad')).__path__ = [str(ROOT / 'tetrad')]
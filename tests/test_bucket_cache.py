@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+import pytz
+from tetrad.api_consts import *
+from tetrad.bucket_cache import HourBucketCache
+from tetrad.result_cache import CachedRows
+
+
+TS = FIELD_MAP["TIMESTAMP"]
+HOUR_START = datetime(2021, 1, 1, 10, tzinfo=pytz.utc)
+
+
+def fetchFrom(readings):
+    """fetch() over `readings` (timestamps), one CachedRows per window"""
+    def fetch(windows):
+        return [
+            CachedRows(None, [[{TS: t} for t in sorted(readings) if lo <= t < hi]])
+            for lo, hi in windows
+        ]
+    return fetch
+
+
+def test_total_rows_counts_only_the_window():
+    # Readings early and late in the hour, none in the middle
+    readings = [HOUR_START + timedelta(minutes=m) for m in (1, 2, 58, 59)]
+    rows = HourBucketCache().rows(
+        ["all"], ["PM2_5"], HOUR_START + timedelta(minutes=20), HOUR_START + timedelta(minutes=40),
+        fetch=fetchFrom(readings))
+    assert rows.total_rows == 0
+    assert [row for page in rows.pages for row in page] == []
+
+
+def test_total_rows_matches_the_trimmed_rows():
+    readings = [HOUR_START + timedelta(minutes=m) for m in range(0, 180, 10)]
+    start, end = HOUR_START + timedelta(minutes=25), HOUR_START + timedelta(minutes=145)
+    rows = HourBucketCache().rows(["all"], ["PM2_5"], start, end, fetch=fetchFrom(readings))
+    kept = [row[TS] for page in rows.pages for row in page]
+    assert kept == [t for t in readings if start <= t <= end]
+    assert rows.total_rows == len(kept)
+
+
+def test_non_utc_window_uses_utc_hours():
+    # 10:00 UTC is 15:30 at +05:30, half way through a local hour
+    ist = pytz.FixedOffset(330)
+    readings = [HOUR_START + timedelta(minutes=m) for m in range(0, 360, 10)]
+    start = (HOUR_START + timedelta(minutes=25)).astimezone(ist)
+    end = (HOUR_START + timedelta(hours=5, minutes=35)).astimezone(ist)
+    cache = HourBucketCache()
+    rows = cache.rows(["all"], ["PM2_5"], start, end, fetch=fetchFrom(readings))
+    kept = [row[TS] for page in rows.pages for row in page]
+    assert kept == [t for t in readings if start <= t <= end]
+    assert rows.total_rows == len(kept) == 31
+
+    # The closed hours were cached with their rows, not empty
+    again = cache.rows(["all"], ["PM2_5"], start.astimezone(pytz.utc), end.astimezone(pytz.utc),
+                       fetch=fetchFrom(readings))
+    assert again.cache_status == 'HIT'
+    assert [row[TS] for page in again.pages for row in page] == kept
+
+
+def test_new_registry_version_refetches():
+    readings = [HOUR_START + timedelta(minutes=m) for m in range(0, 60, 10)]
+    start, end = HOUR_START, HOUR_START + timedelta(minutes=59)
+    cache = HourBucketCache()
+    list(cache.rows(["allgps"], ["PM2_5"], start, end, fetch=fetchFrom(readings), version='v1').pages)
+    assert not cache.missingWindows(["allgps"], ["PM2_5"], start, end, 'v1')
+    assert cache.missingWindows(["allgps"], ["PM2_5"], start, end, 'v2') == [(HOUR_START, HOUR_START + timedelta(hours=1))]
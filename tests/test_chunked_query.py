@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytest
+import pytz
+from tetrad import chunked_query
+from tetrad.api_consts import *
+
+
+START = datetime(2021, 1, 1, 13, 30, tzinfo=pytz.utc)
+
+
+def test_chunk_size_grows_with_the_range():
+    assert chunked_query.chunkSize(START, START + timedelta(hours=CHUNK_MIN_RANGE_HOURS)) is None
+    assert chunked_query.chunkSize(START, START + timedelta(hours=CHUNK_MIN_RANGE_HOURS + 1)) == timedelta(days=1)
+    assert chunked_query.chunkSize(START, START + timedelta(days=CHUNK_WEEKS_AFTER_DAYS)) == timedelta(days=1)
+    assert chunked_query.chunkSize(START, START + timedelta(days=CHUNK_WEEKS_AFTER_DAYS + 1)) == timedelta(weeks=1)
+
+
+def test_short_ranges_are_one_chunk():
+    assert chunked_query.timeChunks(START, START + timedelta(hours=2), None) == [(START, START + timedelta(hours=2), True)]
+
+
+@pytest.mark.parametrize("end", [START + timedelta(days=3, hours=4), datetime(2021, 1, 4, tzinfo=pytz.utc)])
+def test_day_chunks_start_at_utc_midnight(end):
+    chunks = chunked_query.timeChunks(START, end, timedelta(days=1))
+    # Contiguous, covering exactly [START, end]
+    assert chunks[0][0] == START and chunks[-1][1] == end
+    assert all(a[1] == b[0] for a, b in zip(chunks, chunks[1:]))
+    # Only the last one includes its end
+    assert [inclusive for _, _, inclusive in chunks] == [False] * (len(chunks) - 1) + [True]
+    assert all(lo.astimezone(pytz.utc).time() == datetime.min.time() for lo, _, _ in chunks[1:])
+    assert chunks[0][1] == datetime(2021, 1, 2, tzinfo=pytz.utc)
+
+
+def test_chunks_align_whatever_the_start_timezone():
+    mountain = pytz.timezone('US/Mountain')
+    start = mountain.localize(datetime(2021, 1, 1, 20))
+    chunks = chunked_query.timeChunks(start, start + timedelta(days=2), timedelta(days=1))
+    # 20:00 MST is 03:00 UTC the next day, so the first chunk ends at the following UTC midnight
+    assert chunks[0][1] == datetime(2021, 1, 3, tzinfo=pytz.utc)
+    assert [hi.astimezone(pytz.utc).hour for _, hi, _ in chunks[:-1]] == [0, 0]
+
+
+def test_week_chunks_are_on_epoch_week_boundaries():
+    chunks = chunked_query.timeChunks(START, START + timedelta(days=30), timedelta(weeks=1))
+    for lo, _, _ in chunks[1:]:
+        assert (lo - chunked_query.EPOCH) % timedelta(weeks=1) == timedelta(0)
+
+
+def test_chunked_rows_keep_chunk_order():
+    def iterator(pages):
+        return SimpleNamespace(schema=['schema'], total_rows=sum(map(len, pages)), pages=pages)
+
+    rows = chunked_query.ChunkedRows([iterator([[1, 2], [3]]), iterator([]), iterator([[4]])])
+    assert rows.schema == ['schema'] and rows.total_rows == 4
+    assert list(rows) == [1, 2, 3, 4]
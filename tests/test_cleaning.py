@@ -0,0 +1,195 @@
+import copy
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import numpy as np
+import pytest
+import pytz
+from tetrad import utils, stream_utils
+from tetrad.api_consts import *
+from tetrad.registry import RegistrySnapshot
+
+
+PM = FIELD_MAP["PM2_5"]
+TS = FIELD_MAP["TIMESTAMP"]
+ID = FIELD_MAP["DEVICEID"]
+TEMP = FIELD_MAP["TEMPERATURE"]
+HUM = FIELD_MAP["HUMIDITY"]
+START = datetime(2021, 1, 1, tzinfo=pytz.utc)
+
+
+def useFactors(monkeypatch, slope, intercept):
+    snapshot = RegistrySnapshot(
+        {'correction_factors': 'test'},
+        {'correction_factors': utils.CorrectionFactors([(START.timestamp(), START.timestamp() + 86400, slope, intercept)])},
+    )
+    monkeypatch.setattr(utils.REGISTRY, 'current', snapshot, raising=False)
+
+
+class FakeRows:
+    """Just enough of a RowIterator for CleanedRows"""
+
+    class Field:
+        def __init__(self, name):
+            self.name = name
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.schema = [self.Field(name) for name in columns]
+        self.total_rows = len(next(iter(columns.values())))
+
+    def columnPages(self):
+        yield dict(self.columns)
+
+
+def test_raw_readings_are_masked():
+    columns = utils.cleanColumns({PM: [12, 499, 720, PM_BAD_FLAG]}, ["PM2_5"], correct=False)
+    assert np.array_equal(columns[PM], [12, 499, np.nan, np.nan], equal_nan=True)
+
+
+def test_counts_above_threshold_are_kept():
+    # Aggregates were masked in SQL: a busy device can count more than PM_BAD_THRESH readings
+    counts = [12, 499, 720, 1440]
+    columns = utils.cleanColumns({PM: counts}, ["PM2_5"], correct=False, mask=False)
+    assert columns[PM].tolist() == counts
+
+
+def test_aggregates_are_corrected_but_not_masked(monkeypatch):
+    useFactors(monkeypatch, 0.5, 1.0)
+    rows = stream_utils.CleanedRows(FakeRows({TS: [START] * 2, PM: [10., 800.]}), ["PM2_5"], mask=False)
+    columns = next(rows.columnPages())
+    assert columns[PM].tolist() == [6., 401.]
+
+
+@pytest.fixture
+def legacy(monkeypatch):
+    """
+    The per-row cleaning that cleanColumns and removeInvalidSensors
+    replaced, with two correction factor periods that are also loaded
+    into the registry. The bad flags are compared as numbers (the old
+    code compared them with the env strings).
+    """
+    factors = [
+        {'start_date': START, 'end_date': START + timedelta(days=2), '3003_slope': 0.5, '3003_intercept': 2.},
+        {'start_date': START + timedelta(days=2), 'end_date': START + timedelta(days=3), '3003_slope': 0.8, '3003_intercept': -1.},
+    ]
+    snapshot = RegistrySnapshot({'correction_factors': 'test'}, {'correction_factors': utils.CorrectionFactors([
+        (f['start_date'].timestamp(), f['end_date'].timestamp(), f['3003_slope'], f['3003_intercept']) for f in factors
+    ])})
+    monkeypatch.setattr(utils.REGISTRY, 'current', snapshot, raising=False)
+
+    def applyCorrectionFactor(timestamp, value):
+        for factor in factors:
+            if factor['start_date'] <= timestamp < factor['end_date']:
+                return max(0, value * factor['3003_slope'] + factor['3003_intercept'])
+        return value
+
+    def tuneAllFields(data, fields, removeNulls=False):
+        pm25_key = PM if "PM2_5" in fields else None
+        temp_key = TEMP if "TEMPERATURE" in fields else None
+        hum_key = HUM if "HUMIDITY" in fields else None
+        for datum in data:
+            if pm25_key:
+                if datum[pm25_key] == PM_BAD_FLAG or datum[pm25_key] >= PM_BAD_THRESH:
+                    datum[pm25_key] = None
+                else:
+                    datum[pm25_key] = applyCorrectionFactor(datum[TS], datum[pm25_key])
+            if temp_key and datum[temp_key] == TEMP_BAD_FLAG:
+                datum[temp_key] = None
+            if hum_key and datum[hum_key] == HUM_BAD_FLAG:
+                datum[hum_key] = None
+        if removeNulls is True:
+            data = [datum for datum in data if all(datum.values())]
+        elif removeNulls:
+            data = [datum for datum in data if all(datum[FIELD_MAP[field]] for field in removeNulls)]
+        return data
+
+    def removeInvalidSensors(sensor_data):
+        epoch = pytz.timezone('US/Mountain').localize(datetime(1970, 1, 1))
+        dayCounts, dayReadings = {}, {}
+        for datum in sensor_data:
+            key = ((datum[TS] - epoch).days, datum[ID])
+            dayCounts[key] = dayCounts.get(key, 0) + 1
+            dayReadings[key] = dayReadings.get(key, 0) + datum[PM]
+        keysToRemove = set()
+        for day, device in (key for key in dayCounts if dayReadings[key] / dayCounts[key] > 350):
+            keysToRemove |= {(day - 1, device), (day, device), (day + 1, device)}
+        return [datum for datum in sensor_data if ((datum[TS] - epoch).days, datum[ID]) not in keysToRemove]
+
+    return SimpleNamespace(tuneAllFields=tuneAllFields, removeInvalidSensors=removeInvalidSensors)
+
+
+def randomRows(rng, n):
+    """
+    Readings over four days, half of them within an hour of midnight
+    MST, with bad flags, over-threshold PM2.5 and null temperatures
+    and humidities. No zeros: the old null test was truthiness.
+    """
+    rows = []
+    for _ in range(n):
+        day = int(rng.integers(0, 4))
+        if rng.random() < 0.5:
+            offset = timedelta(hours=7, seconds=int(rng.integers(-3600, 3600)))
+        else:
+            offset = timedelta(seconds=int(rng.integers(0, 86400)))
+        rows.append({
+            ID: f"D{rng.integers(0, 5)}",
+            TS: START + timedelta(days=day) + offset,
+            PM: float(rng.choice([PM_BAD_FLAG, PM_BAD_THRESH, rng.uniform(1, 700)], p=[0.1, 0.05, 0.85])),
+            TEMP: rng.choice([TEMP_BAD_FLAG, None, float(rng.uniform(1, 40))], p=[0.1, 0.1, 0.8]),
+            HUM: rng.choice([HUM_BAD_FLAG, None, float(rng.uniform(1, 90))], p=[0.1, 0.1, 0.8]),
+        })
+    return rows
+
+
+def sameRows(actual, expected):
+    assert len(actual) == len(expected)
+    for a, e in zip(actual, expected):
+        assert a.keys() == e.keys()
+        for name in e:
+            if isinstance(e[name], float):
+                assert a[name] == pytest.approx(e[name])
+            else:
+                assert a[name] == e[name]
+
+
+@pytest.mark.parametrize("removeNulls", [False, True, ["PM2_5"], ["TEMPERATURE", "HUMIDITY"]])
+def test_clean_columns_matches_the_per_row_cleaning(legacy, removeNulls):
+    rng = np.random.default_rng(5)
+    fields = ["PM2_5", "TEMPERATURE", "HUMIDITY"]
+    for _ in range(10):
+        rows = randomRows(rng, 60)
+        expected = legacy.tuneAllFields(copy.deepcopy(rows), fields, removeNulls=removeNulls)
+        columns = utils.cleanColumns({name: [row[name] for row in rows] for name in rows[0]}, fields,
+                                     removeNulls=removeNulls)
+        sameRows(utils.columnsToDicts(columns), expected)
+
+
+def test_remove_invalid_sensors_matches_the_per_row_days(legacy):
+    rng = np.random.default_rng(6)
+    for _ in range(20):
+        rows = randomRows(rng, 80)
+        for row in rows:
+            row[PM] = float(rng.uniform(1, 100))
+        # Half an hour before midnight MST on the second day: one device-day
+        # far over the limit, so the days either side of it go too
+        rows.append({**rows[0], ID: "D1", TS: START + timedelta(days=1, hours=6, minutes=30), PM: 20000.})
+        expected = legacy.removeInvalidSensors(rows)
+        assert len(expected) < len(rows)
+        assert utils.removeInvalidSensors(list(rows)) == expected
+
+
+def test_invalid_sensor_days():
+    day = 86400
+    # Midnight MST on some day, in epoch seconds
+    midnight = utils.INVALID_SENSOR_DAY_OFFSET + 18628 * day
+    seconds = np.array([midnight - 1, midnight + 10, midnight + 20, midnight + day + 10, midnight + 3 * day,
+                        midnight + 10])
+    devices = np.array([0, 0, 0, 0, 0, 1])
+    # Device 0 is over the limit on the middle day; its null there doesn't count
+    pm25 = np.array([10., 400., np.nan, 10., 10., 20.])
+    drop = utils.invalidSensorDays(seconds, devices, pm25)
+    # The day before and after go too, but not two days on, nor another device's day
+    assert drop.tolist() == [True, True, True, True, False, False]
+
+    # An average exactly at the limit is kept
+    assert not utils.invalidSensorDays(seconds[:2], devices[:2], np.array([350., 350.])).any()
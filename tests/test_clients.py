@@ -0,0 +1,78 @@
+import threading
+import time
+import pytest
+from tetrad import clients
+
+
+@pytest.fixture(autouse=True)
+def freshClients(monkeypatch):
+    monkeypatch.setattr(clients, '_clients', {})
+    monkeypatch.setattr(clients, 'TIMINGS', {})
+
+
+def test_created_once_on_first_use():
+    made = []
+
+    @clients.shared
+    def fake():
+        made.append(object())
+        return made[-1]
+
+    assert made == []
+    assert fake() is fake() is made[0]
+    assert len(made) == 1 and 'fake' in clients.TIMINGS
+
+
+def test_concurrent_first_calls_create_one_client():
+    made, barrier, got = [], threading.Barrier(8), []
+
+    @clients.shared
+    def slow():
+        made.append(1)
+        time.sleep(0.05)
+        return object()
+
+    def call():
+        barrier.wait()
+        got.append(slow())
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(made) == 1 and all(client is got[0] for client in got)
+
+
+def test_failures_are_retried():
+    attempts = []
+
+    @clients.shared
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("no credentials")
+        return "client"
+
+    with pytest.raises(RuntimeError):
+        flaky()
+    assert flaky() == "client" and len(attempts) == 2
+
+
+def test_warm_up_creates_clients_in_the_background(monkeypatch):
+    done = threading.Event()
+
+    @clients.shared
+    def broken():
+        raise RuntimeError("no credentials")
+
+    @clients.shared
+    def warm():
+        done.set()
+        return "client"
+
+    monkeypatch.setattr(clients, 'broken', broken, raising=False)
+    monkeypatch.setattr(clients, 'warm', warm, raising=False)
+    # A client that fails to warm up doesn't stop the others
+    clients.warmUp(['broken', 'warm'])
+    assert done.wait(5)
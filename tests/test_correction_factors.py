@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+import numpy as np
+import pytz
+from tetrad import utils
+
+
+START = datetime(2021, 1, 1, tzinfo=pytz.utc)
+
+
+def perRowCorrection(factors, timestamp, value):
+    """The per-row lookup CorrectionFactors replaced: first factor (in file order) whose interval holds the row"""
+    for factor in factors:
+        if factor['start_date'] <= timestamp < factor['end_date']:
+            return max(0, value * factor['3003_slope'] + factor['3003_intercept'])
+    return value
+
+
+def randomFactors(rng, n):
+    # Overlapping, unordered periods on hour boundaries, some of them sharing edges
+    factors = []
+    for _ in range(n):
+        start = START + timedelta(hours=int(rng.integers(0, 200)))
+        factors.append({
+            'start_date': start,
+            'end_date': start + timedelta(hours=int(rng.integers(1, 72))),
+            '3003_slope': float(rng.uniform(0.3, 1.5)),
+            '3003_intercept': float(rng.uniform(-5, 5)),
+        })
+    return factors
+
+
+def test_compiled_factors_match_the_per_row_lookup():
+    rng = np.random.default_rng(11)
+    for _ in range(20):
+        factors = randomFactors(rng, int(rng.integers(1, 8)))
+        compiled = utils.CorrectionFactors([
+            (f['start_date'].timestamp(), f['end_date'].timestamp(), f['3003_slope'], f['3003_intercept'])
+            for f in factors
+        ])
+        # Random instants, every period edge, and times before and after all of them
+        timestamps = [START + timedelta(seconds=int(s)) for s in rng.integers(-86400, 300 * 3600, 200)]
+        timestamps += [f[edge] for f in factors for edge in ('start_date', 'end_date')]
+        values = rng.uniform(0, 100, len(timestamps))
+
+        expected = [perRowCorrection(factors, t, v) for t, v in zip(timestamps, values)]
+        assert np.allclose(compiled.apply(utils.epochSeconds(timestamps), values), expected)
+
+
+def test_nulls_stay_null():
+    compiled = utils.CorrectionFactors([(START.timestamp(), START.timestamp() + 3600, 0.5, -10.)])
+    corrected = compiled.apply(utils.epochSeconds([START, START]), [np.nan, 4.])
+    assert np.isnan(corrected[0]) and corrected[1] == 0
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytz
+from tetrad.api_consts import *
+from tetrad.device_registry import DeviceRegistry
+
+
+ID = FIELD_MAP["DEVICEID"]
+
+
+class FakeBigQuery:
+    """Answers each deviceLocationsQuery with the next batch of rows, recording its parameters"""
+
+    def __init__(self, *batches):
+        self.batches = list(batches)
+        self.params = []
+
+    def query(self, sql, job_config):
+        self.params.append({p.name: p.value for p in job_config.query_parameters})
+        rows = self.batches.pop(0)
+        return SimpleNamespace(result=lambda: rows)
+
+
+def located(device, lat_lo, lat_hi, lon_lo, lon_hi):
+    return {ID: device, 'lat_lo': lat_lo, 'lat_hi': lat_hi, 'lon_lo': lon_lo, 'lon_hi': lon_hi,
+            'lat': lat_hi, 'lon': lon_hi, 'last_seen': None, 'nickname': None}
+
+
+SLC = {'lat_hi': 40.9, 'lat_lo': 40.5, 'lon_hi': -111.7, 'lon_lo': -112.1}
+
+
+def test_default_lookback_is_a_week():
+    assert DEVICE_REGISTRY_LOOKBACK_DAYS == 7
+    bq = FakeBigQuery([])
+    before = datetime.now(pytz.utc)
+    registry = DeviceRegistry(bq_client=bq)
+    registry.refresh()
+    since = bq.params[0]['since']
+    assert before - timedelta(days=7) <= since <= datetime.now(pytz.utc) - timedelta(days=7)
+    assert registry.index.since == since
+
+
+def test_refreshes_are_incremental():
+    bq = FakeBigQuery(
+        [located("A", 40.6, 40.7, -111.9, -111.8), located("B", 35.0, 35.1, -85.3, -85.2)],
+        [located("A", 40.75, 40.8, -111.95, -111.9)],
+    )
+    registry = DeviceRegistry(bq_client=bq)
+    registry.refresh()
+    first = registry.index
+    registry.refresh()
+
+    # The second refresh only asks for rows since the settled part of the first
+    assert bq.params[1]['since'] == first.until
+    assert first.until <= bq.params[0]['until'] - registry.settle
+    # and widens the extents of the devices it saw again
+    devices = registry.index.devices
+    assert (devices["A"]['lat_lo'], devices["A"]['lat_hi'], devices["A"]['lon_lo']) == (40.6, 40.8, -111.95)
+    assert devices["B"]['lat_lo'] == 35.0
+    assert registry.index.since == first.since
+
+
+def test_locate():
+    registry = DeviceRegistry(bq_client=FakeBigQuery([
+        located("A", 40.6, 40.7, -111.9, -111.8),
+        located("B", 35.0, 35.1, -85.3, -85.2),
+        # A mobile sensor spanning both
+        located("C", 35.0, 40.8, -111.9, -85.2),
+        located("D", -16.6, -16.5, 179.95, 179.99),
+    ]))
+    registry.refresh()
+    index = registry.index
+
+    assert registry.locate(index.since, bbox=SLC) == (["A", "C"], index.until)
+    assert registry.locate(index.since, radius=5, center={'lat': 35.05, 'lon': -85.25}) == (["B", "C"], index.until)
+    # Circles across the antimeridian find devices on the other side
+    assert registry.locate(index.since, radius=10, center={'lat': -16.55, 'lon': -179.99})[0] == ["D"]
+
+    # Windows starting before the registry's lookback, and lists too long to help, aren't prefiltered
+    assert registry.locate(index.since - timedelta(seconds=1), bbox=SLC) is None
+    registry.max_ids = 1
+    assert registry.locate(index.since, bbox=SLC) is None
+    assert DeviceRegistry().locate(index.since, bbox=SLC) is None
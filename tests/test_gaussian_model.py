@@ -0,0 +1,155 @@
+import numpy as np
+import pytest
+import scipy.linalg
+import torch
+from tetrad import gaussian_model as gm
+
+
+S, T = 20, 16
+
+
+def makeModel(S=S, T=T, seed=0):
+    # UTM-like meters over a ~30 km region, elevations in meters, 8-minute bins in hours
+    rng = np.random.default_rng(seed)
+    space = np.column_stack([rng.uniform(0, 30000, S), rng.uniform(0, 30000, S), rng.uniform(1300, 1400, S)])
+    times = (np.arange(T) * 8 / 60).reshape(-1, 1)
+    data = rng.uniform(0, 40, (S, T))
+    return gm.gaussian_model(space, times, data, latlon_length_scale=4300., elevation_length_scale=30.,
+                             time_length_scale=0.25, noise_variance=36., signal_variance=400.)
+
+
+def queryPoints(n, seed=1):
+    rng = np.random.default_rng(seed)
+    space = torch.tensor(np.column_stack([rng.uniform(0, 30000, n), rng.uniform(0, 30000, n), rng.uniform(1300, 1400, n)]))
+    times = torch.tensor(rng.uniform(0, (T - 1) * 8 / 60, (n, 1)))
+    return space, times
+
+
+def denseReference(model, test_space, test_times):
+    """Mean and variance over the grid test_space x test_times, from the explicit kron(Vt, Vs)"""
+    with torch.no_grad():
+        _, eigen_vector_t = gm.symCirculantMatrixEigen(np.zeros(T))
+        eigen_vector_st = gm.kronecker(torch.from_numpy(eigen_vector_t), model.eigen_vector_s)
+        sigma_inverse = eigen_vector_st @ torch.diag(model.eigen_value_st_plus_noise_inverse) @ eigen_vector_st.t()
+        alpha = sigma_inverse @ model.stData.t().reshape(-1, 1)
+
+        test_spatial_kernel, test_temporal_kernel = model.testKernels(test_space, test_times)
+        signal_variance = model.log_signal_variance.exp()
+        test_st_kernel = signal_variance * gm.kronecker(test_temporal_kernel, test_spatial_kernel)
+        yPred = (test_st_kernel @ alpha).view(test_times.size(0), test_space.size(0)).t()
+        yVar = signal_variance - ((test_st_kernel @ sigma_inverse) * test_st_kernel).sum(1)
+        return yPred, yVar.view(test_times.size(0), test_space.size(0)).t()
+
+
+def test_forward_matches_dense_kronecker():
+    model = makeModel()
+    test_space, _ = queryPoints(7)
+    test_times = model.time_coordinates[5:8]
+    yPred, yVar = model(test_space, test_times)
+    refPred, refVar = denseReference(model, test_space, test_times)
+    assert torch.allclose(yPred, refPred, rtol=1e-6, atol=1e-6)
+    assert torch.allclose(yVar, refVar, rtol=1e-6, atol=1e-6)
+
+
+def test_forward_points_is_the_grid_diagonal():
+    model = makeModel()
+    test_space, test_times = queryPoints(9)
+    yPred, yVar = model.forwardPoints(test_space, test_times)
+    refPred, refVar = denseReference(model, test_space, test_times)
+    assert torch.allclose(yPred, refPred.diagonal(), rtol=1e-6, atol=1e-6)
+    assert torch.allclose(yVar, refVar.diagonal(), rtol=1e-6, atol=1e-6)
+
+
+def test_mean_only():
+    model = makeModel()
+    test_space, test_times = queryPoints(5)
+    yPred, yVar = model.forwardPoints(test_space, test_times, return_variance=False)
+    assert yVar is None
+    assert torch.allclose(yPred, model.forwardPoints(test_space, test_times)[0])
+
+
+@pytest.mark.parametrize("size", [15, 16])
+def test_circulant_eigenvalues(size):
+    # Same values as symCirculantMatrixEigen, without its eigenvectors
+    kernel = gm.buildKernelArray(size, gm.gaussKernel, 2.5)
+    assert np.allclose(gm.symCirculantEigenvalues(kernel), gm.symCirculantMatrixEigen(kernel)[0])
+
+    # and, for a symmetric circulant, its eigenpairs
+    vector = np.exp(-np.minimum(np.arange(size), size - np.arange(size))**2 / 8.)
+    values = gm.symCirculantEigenvalues(vector)
+    _, vectors = gm.symCirculantMatrixEigen(vector)
+    assert np.allclose(vectors @ np.diag(values) @ vectors.T, scipy.linalg.circulant(vector))
+
+
+@pytest.mark.parametrize("size", [15, 16])
+def test_real_fourier_matches_the_eigenvectors(size):
+    _, vectors = gm.symCirculantMatrixEigen(np.zeros(size))
+    vectors = torch.from_numpy(vectors)
+    matrix = torch.from_numpy(np.random.default_rng(size).normal(size=(size, 3)))
+    assert torch.allclose(gm.realFourierTranspose(matrix), vectors.t() @ matrix)
+    assert torch.allclose(gm.realFourierApply(matrix), vectors @ matrix)
+    assert torch.allclose(gm.realFourierApply(gm.realFourierTranspose(matrix)), matrix)
+
+
+def test_spatial_eigen_cache_hits_on_geometry_and_length_scales(monkeypatch):
+    cache = gm.SpatialEigenCache(max_entries=2)
+    monkeypatch.setattr(gm, 'SPATIAL_EIGEN_CACHE', cache)
+    first = makeModel()
+    # Same sensors and length scales, different readings: one decomposition
+    second = makeModel(seed=0)
+    second.stData = second.stData + 1
+    second.update()
+    assert cache.stats()['misses'] == 1 and cache.stats()['hits'] == 2
+    assert second.eigen_vector_s is first.eigen_vector_s
+
+    # The cached pairs are those of the spatial kernel
+    values, _ = first.spatialEigen()
+    assert torch.allclose(first.eigen_value_s, values.detach())
+    assert torch.allclose(first.eigen_vector_s @ first.eigen_vector_s.t(), torch.eye(S, dtype=torch.float64))
+
+    # New sensors or length scales miss, and the oldest entry goes
+    makeModel(seed=2)
+    with torch.no_grad():
+        first.log_latlon_length_scale.add_(0.1)
+    first.update()
+    stats = cache.stats()
+    assert stats['misses'] == 3 and stats['entries'] == 2 and stats['evictions'] == 1
+
+
+def test_training_bypasses_the_spatial_eigen_cache(monkeypatch):
+    cache = gm.SpatialEigenCache()
+    monkeypatch.setattr(gm, 'SPATIAL_EIGEN_CACHE', cache)
+    model = makeModel()
+    model.update(use_cache=False)
+    assert model.eigen_vector_s.requires_grad
+    assert cache.stats()['misses'] == 1 and cache.stats()['hits'] == 0
+
+
+def test_diag_mult_left():
+    diag = torch.tensor([1., 2., 3.], dtype=torch.float32)
+    matrix = torch.arange(12, dtype=torch.float64).view(3, 4)
+    result = gm.diagMultTorchLeft(diag, matrix)
+    assert result.dtype == torch.float64
+    assert torch.equal(result, torch.diag(diag.double()) @ matrix)
+    # Mismatched sizes are refused, as before
+    assert gm.diagMultTorchLeft(diag, matrix.t()).numel() == 0
+
+
+def test_unstructured_variance_matches_per_row(monkeypatch, tmp_path):
+    # update() writes the temporal kernel to the working directory
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(0)
+    space = np.column_stack([rng.uniform(0, 30000, 8), rng.uniform(0, 30000, 8), rng.uniform(1300, 1400, 8)])
+    times = np.sort(rng.uniform(0, 2, 6)).reshape(-1, 1)
+    model = gm.gaussian_model(space, times, rng.uniform(0, 40, (8, 6)), noise_variance=36., signal_variance=400.,
+                              time_structured=False)
+    test_space, test_times = queryPoints(4)
+    yPred, yVar = model(test_space, test_times)
+
+    test_spatial_kernel, test_temporal_kernel = model.testKernels(test_space, test_times)
+    with torch.no_grad():
+        test_st_kernel = model.log_signal_variance.exp() * gm.kronecker(test_temporal_kernel, test_spatial_kernel)
+        rows = [model.log_signal_variance.exp() - k @ model.sigma_inverse @ k for k in test_st_kernel]
+    assert torch.allclose(yVar, torch.stack(rows).view(4, 4).t())
+    assert model.forward(test_space, test_times, return_variance=False)[1] is None
+    assert torch.allclose(model.forwardPoints(test_space, test_times)[1], yVar.diagonal())
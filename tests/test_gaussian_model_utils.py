@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+import pytz
+from tetrad import gaussian_model_utils, utils
+from test_gaussian_model import makeModel
+
+
+START = datetime(2021, 1, 1, 12, tzinfo=pytz.utc)
+
+
+@pytest.mark.parametrize("max_workers", [1, 3])
+def test_estimate_batch_matches_estimate_using_model(monkeypatch, max_workers):
+    # estimateUsingModel projects lat/lon itself; take them as meters already
+    monkeypatch.setattr(utils, 'latlonToUTM', lambda lats, lons: (lats, lons, None, None), raising=False)
+    model = makeModel()
+    time_offset = gaussian_model_utils.getTimeCoordinateBin(START)
+
+    rng = np.random.default_rng(3)
+    n = 7
+    x, y, elevations = rng.uniform(0, 30000, n), rng.uniform(0, 30000, n), rng.uniform(1300, 1400, n)
+    dates = [START + timedelta(minutes=int(m)) for m in rng.integers(0, 100, n)]
+
+    # chunk_points=3 puts chunk boundaries after points 3 and 6
+    yPred, yVar = gaussian_model_utils.estimateBatch(
+        model, np.column_stack((x, y, elevations)), dates, time_offset, chunk_points=3, max_workers=max_workers)
+    gridPred, gridVar = gaussian_model_utils.estimateUsingModel(model, x, y, elevations, dates, time_offset)
+    assert np.allclose(yPred, gridPred.diagonal())
+    assert np.allclose(yVar, gridVar.diagonal())
+
+    meanOnly, noVar = gaussian_model_utils.estimateBatch(
+        model, np.column_stack((x, y, elevations)), dates, time_offset, chunk_points=3, max_workers=max_workers,
+        return_variance=False)
+    assert noVar is None and np.allclose(meanOnly, yPred)
@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from google.cloud.bigquery.table import Row
+import pytest
+import pytz
+from tetrad.api_consts import *
+from tetrad.classes import NoDataError
+from tetrad.live_snapshot import LiveSnapshot, liveRows
+from tetrad.query_builder import SOURCE_LABELS
+
+
+NOW = datetime.now(pytz.utc)
+NAMES = [FIELD_MAP["DEVICEID"], FIELD_MAP["TIMESTAMP"], FIELD_MAP["SOURCE"], FIELD_MAP["LABEL"],
+         "Latitude", "Longitude", FIELD_MAP["TEMPERATURE"]]
+
+
+class FakeBigQuery:
+    """Records each query and answers it with `rows` (tuples in NAMES order)"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def query(self, sql, job_config):
+        self.queries.append((sql, {p.name: p for p in job_config.query_parameters}))
+        index = {name: i for i, name in enumerate(NAMES)}
+        result = SimpleNamespace(schema=[SimpleNamespace(name=name) for name in NAMES],
+                                 pages=[[Row(values, index) for values in self.rows]])
+        return SimpleNamespace(result=lambda: result)
+
+
+ROWS = [
+    ("A", NOW - timedelta(minutes=2), "Tetrad", "slc_ut", 40.7, -111.9, 20.5),
+    ("B", NOW - timedelta(minutes=40), "PurpleAir", "slc_ut", 40.8, -111.8, 18.0),
+]
+
+
+def test_snapshot_serves_only_what_it_holds():
+    snapshot = LiveSnapshot(fields=["PM2_5", "TEMPERATURE"], window_minutes=15)
+    assert snapshot.serves(["PM2_5"], 15)
+    assert not snapshot.serves(["PM2_5"], 60)
+    assert not snapshot.serves(["PM10"], 5)
+
+
+def test_snapshot_query_is_limited_to_its_fields_and_labels():
+    bq = FakeBigQuery(ROWS)
+    snapshot = LiveSnapshot(bq_client=bq, fields=["TEMPERATURE"], window_minutes=15)
+    snapshot.refresh()
+    sql, params = bq.queries[0]
+    assert f'{FIELD_MAP["LABEL"]} IN UNNEST(@live_labels)' in sql
+    assert params["live_labels"].values == LIVE_SNAPSHOT_LABELS
+    assert params["window_minutes"].value == 15
+    assert FIELD_MAP["PM2_5"] not in sql
+
+    data = snapshot.get(["all"], ["TEMPERATURE"], 15)
+    assert [d[FIELD_MAP["DEVICEID"]] for d in data] == ["A"]
+
+
+def test_other_requests_are_queried_directly():
+    bq = FakeBigQuery(ROWS)
+    data = liveRows(["TEMPERATURE"], 60, ["tetrad"], bq_client=bq)
+    sql, params = bq.queries[0]
+    assert params["window_minutes"].value == 60
+    assert params["source"].value == SOURCE_LABELS["tetrad"]
+    assert params["live_labels"].values == LIVE_SNAPSHOT_LABELS
+    assert [d[FIELD_MAP["TEMPERATURE"]] for d in data] == [20.5, 18.0]
+
+
+def test_never_loaded_snapshot_answers_503():
+    with pytest.raises(NoDataError) as error:
+        LiveSnapshot().get(["all"], ["PM2_5"], 15, timeout=0)
+    assert error.value.status_code == 503
+
+
+def nearSnapshot(rows):
+    """A loaded snapshot of (device, lat, lon, temperature) rows"""
+    snapshot = LiveSnapshot(fields=["TEMPERATURE"])
+    data = [{FIELD_MAP["DEVICEID"]: device, FIELD_MAP["TIMESTAMP"]: NOW, FIELD_MAP["SOURCE"]: "Tetrad",
+             FIELD_MAP["LABEL"]: "slc_ut", "Latitude": lat, "Longitude": lon, FIELD_MAP["TEMPERATURE"]: temperature}
+            for device, lat, lon, temperature in rows]
+    snapshot._located = snapshot._buildTree(data)
+    snapshot._ready.set()
+    return snapshot
+
+
+def nearestIds(snapshot, n):
+    return [d[FIELD_MAP["DEVICEID"]] for d in snapshot.nearest(40.7, -111.9, n, ["TEMPERATURE"])]
+
+
+def test_nearest_are_ordered_by_distance():
+    snapshot = nearSnapshot([
+        ("far", 40.9, -111.9, 20.), ("near", 40.71, -111.9, 20.), ("mid", 40.8, -111.9, 20.), ("none", None, None, 20.),
+    ])
+    found = snapshot.nearest(40.7, -111.9, 2, ["TEMPERATURE"])
+    assert [d[FIELD_MAP["DEVICEID"]] for d in found] == ["near", "mid"]
+    assert found[0]["Distance"] == pytest.approx(1.11, abs=0.01)
+    assert found[1]["Distance"] == pytest.approx(11.1, abs=0.1)
+
+
+def test_nearest_skips_devices_without_the_fields():
+    snapshot = nearSnapshot([("near", 40.71, -111.9, None), ("mid", 40.8, -111.9, 20.), ("far", 40.9, -111.9, 20.)])
+    assert nearestIds(snapshot, 2) == ["mid", "far"]
+
+
+def test_nearest_ties_keep_snapshot_order():
+    snapshot = nearSnapshot([("b", 40.8, -111.9, 20.), ("a", 40.8, -111.9, 20.), ("c", 40.6, -111.9, 20.)])
+    # 'c' is as far south as 'a' and 'b' are north
+    assert nearestIds(snapshot, 3) == ["b", "a", "c"]
+    assert len(nearestIds(snapshot, 1)) == 1
+
+
+def test_nearest_returns_every_device_when_n_is_larger():
+    snapshot = nearSnapshot([("near", 40.71, -111.9, 20.), ("mid", 40.8, -111.9, 20.)])
+    assert nearestIds(snapshot, 10) == ["near", "mid"]
+    assert nearestIds(nearSnapshot([("only", 40.71, -111.9, 20.)]), 5) == ["only"]
+    assert nearestIds(nearSnapshot([]), 5) == []
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+import threading
+import time
+import pytz
+import torch
+from tetrad.model_cache import ModelCache
+
+
+START = datetime(2021, 1, 1, 12, 3, tzinfo=pytz.utc)
+
+
+class FakeModel:
+    def __init__(self):
+        self.data = torch.zeros(10, dtype=torch.float64)
+
+    def parameters(self):
+        return []
+
+
+def key(start=START, end=START + timedelta(hours=2), version='v1'):
+    return ModelCache.makeKey('slc_ut', start, end, 4300, 30, 0.25, version)
+
+
+def test_requests_within_a_bin_share_a_model():
+    cache, built = ModelCache(), []
+    build = lambda: built.append(1) or (FakeModel(), 0)
+    first = cache.model(key(), build)
+    second = cache.model(key(START + timedelta(minutes=2), START + timedelta(hours=2, minutes=1)), build)
+    assert second[0] is first[0] and len(built) == 1
+    assert cache.stats()['hits'] == 1
+
+
+def test_new_registry_version_builds_a_new_model():
+    cache = ModelCache()
+    first = cache.model(key(version='v1'), lambda: (FakeModel(), 0))
+    second = cache.model(key(version='v2'), lambda: (FakeModel(), 0))
+    assert second[0] is not first[0]
+
+
+def test_bounded_by_model_bytes():
+    cache = ModelCache(max_bytes=200)
+    for hours in range(3):
+        cache.model(key(START + timedelta(hours=hours)), lambda: (FakeModel(), 0))
+    stats = cache.stats()
+    assert stats['entries'] == 2 and stats['bytes'] == 160 and stats['evictions'] == 1
+
+
+def test_concurrent_misses_build_once():
+    cache, built = ModelCache(), []
+    barrier = threading.Barrier(8)
+
+    def build():
+        built.append(1)
+        time.sleep(0.05)
+        return FakeModel(), 0
+
+    def estimate():
+        barrier.wait()
+        results.append(cache.model(key(), build)[0])
+
+    results = []
+    threads = [threading.Thread(target=estimate) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(built) == 1
+    assert len(results) == 8 and all(model is results[0] for model in results)
+    assert not cache._building
+
+
+def test_concurrent_misses_share_an_uncacheable_model():
+    # Too big to cache: the waiters still take the one that was built
+    cache, built = ModelCache(max_bytes=10), []
+    barrier = threading.Barrier(8)
+
+    def build():
+        built.append(1)
+        time.sleep(0.05)
+        return FakeModel(), 0
+
+    def estimate():
+        barrier.wait()
+        cache.model(key(), build)
+
+    threads = [threading.Thread(target=estimate) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(built) == 1
+    assert cache.stats()['entries'] == 0 and not cache._building
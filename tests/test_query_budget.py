@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+import pytest
+import pytz
+from tetrad.classes import ArgumentError
+from tetrad.query_budget import GB, ByteBudget
+
+
+START = datetime(2021, 1, 1, tzinfo=pytz.utc)
+END = START + timedelta(days=10)
+
+
+def test_within_budget_is_charged():
+    budget = ByteBudget(request_bytes=10 * GB, user_bytes=30 * GB, window_seconds=3600)
+    budget.check('a', 4 * GB, START, END)
+    assert budget.spent('a') == 4 * GB and budget.spent('b') == 0
+
+
+def test_over_the_request_budget_is_400():
+    budget = ByteBudget(request_bytes=10 * GB, user_bytes=0, window_seconds=3600)
+    with pytest.raises(ArgumentError) as error:
+        budget.check('a', 40 * GB, START, END, aggregated=8 * GB)
+    assert error.value.status_code == 400
+    report = error.value.payload
+    assert not report['within_budget']
+    # A quarter of the bytes: about a quarter of the window
+    assert report['suggested_end'] == (START + timedelta(hours=60)).isoformat()
+    assert report['aggregated'] == {'agg': '1h', 'fn': 'mean', 'estimated_bytes': 8 * GB, 'within_budget': True}
+    assert 'per-request budget' in error.value.message
+    assert f"end={report['suggested_end']}" in error.value.message
+    assert 'agg=1h&fn=mean' in error.value.message
+    assert budget.spent('a') == 0
+
+
+def test_over_the_user_budget_is_429():
+    budget = ByteBudget(request_bytes=10 * GB, user_bytes=12 * GB, window_seconds=3600)
+    budget.check('a', 8 * GB, START, END)
+    with pytest.raises(ArgumentError) as error:
+        budget.check('a', 8 * GB, START, END, aggregated=8 * GB)
+    assert error.value.status_code == 429
+    report = error.value.payload
+    assert report['user_budget_bytes_remaining'] == 4 * GB
+    assert report['aggregated']['within_budget'] is False
+    assert '1-hour budget' in error.value.message
+    # Aggregating is still mentioned, with what it would cost
+    assert 'agg=1h&fn=mean' in error.value.message and '8.0 GB as well' in error.value.message
+    # Other users have their own budget
+    budget.check('b', 8 * GB, START, END)
+
+
+def test_report_does_not_charge():
+    budget = ByteBudget(request_bytes=10 * GB, user_bytes=12 * GB, window_seconds=3600)
+    report = budget.report('a', 4 * GB, START, END)
+    assert report['within_budget'] and 'aggregated' not in report
+    assert budget.spent('a') == 0
@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+import pytest
+import pytz
+from tetrad import query_builder, utils
+from tetrad.api_consts import *
+from tetrad.classes import ArgumentError
+
+
+START = datetime(2021, 1, 1, tzinfo=pytz.utc)
+END = START + timedelta(hours=6)
+BOX = {'lat_hi': 41, 'lat_lo': 40, 'lon_hi': -111, 'lon_lo': -112}
+
+
+def params(config):
+    return {p.name: getattr(p, 'values', None) or p.value for p in config.query_parameters}
+
+
+def test_requests_differing_only_in_values_send_the_same_sql():
+    sql, config = query_builder.telemetryQuery(["slc_ut"], ["PM2_5", "PM10"], id_ls="D1")(START, END, True)
+    same_sql, other = query_builder.telemetryQuery(["chatt_tn", "kc_mo"], ["PM10", "PM2_5"], id_ls=["D2", "D3"])(
+        START + timedelta(days=1), END + timedelta(days=1), True)
+    assert sql == same_sql
+    assert "slc_ut" not in sql and "D1" not in sql and "2021" not in sql
+    assert params(config) == {"labels": ["slc_ut"], "ids": ["D1"], "start": START, "end": END}
+    assert params(other)["labels"] == ["chatt_tn", "kc_mo"]
+
+
+def test_field_order_shares_one_template():
+    query_builder.telemetryTemplate.cache_clear()
+    for fields in (["PM2_5", "TEMPERATURE"], ["TEMPERATURE", "PM2_5"]):
+        sql, _ = query_builder.telemetryQuery(["slc_ut"], fields)(START, END, False)
+    info = query_builder.telemetryTemplate.cache_info()
+    assert info.misses == 1 and info.hits == 1
+    # and the columns come out in the one order
+    assert sql.index(FIELD_MAP["PM2_5"]) < sql.index(FIELD_MAP["TEMPERATURE"])
+
+
+def test_label_modes():
+    assert query_builder.labelParams(["all"]) == []
+    assert params(query_builder.telemetryQuery(["tetrad"], ["PM2_5"])(START, END, True)[1])["source"] == "Tetrad"
+    sql, _ = query_builder.telemetryQuery(["all"], ["PM2_5"])(START, END, True)
+    assert "@labels" not in sql and "@source" not in sql
+
+
+def test_window_ends():
+    query = query_builder.telemetryQuery(["slc_ut"], ["PM2_5"])
+    assert f'{FIELD_MAP["TIMESTAMP"]} <= @end' in query(START, END, True)[0]
+    assert f'{FIELD_MAP["TIMESTAMP"]} < @end' in query(START, END, False)[0]
+
+
+def test_regions_are_parameters():
+    sql, config = query_builder.telemetryQuery(["all"], ["PM2_5"], radius=2.5, center={'lat': 40.7, 'lon': -111.9})(
+        START, END, True)
+    assert "ST_DWITHIN" in sql and params(config)["radius_m"] == 2500
+    assert (params(config)["lat"], params(config)["lon"]) == (40.7, -111.9)
+
+    sql, config = query_builder.telemetryQuery(["all"], ["PM2_5"], bbox=BOX)(START, END, True)
+    assert "ST_GEOGFROMGEOJSON(@box)" in sql
+    assert params(config)["box"].startswith('{"type": "Polygon", "coordinates": [[[-111,41],[-111,40],[-112,40]')
+
+
+def test_located_devices_leave_the_uncovered_tail_open():
+    until = START + timedelta(hours=3)
+    query = query_builder.telemetryQuery(["all"], ["PM2_5"], bbox=BOX, located=(["D1"], until))
+    before, config = query(START, until - timedelta(hours=1), False)
+    after, _ = query(START, END, True)
+    assert f'{FIELD_MAP["DEVICEID"]} IN UNNEST(@located_ids)' in before
+    assert f'{FIELD_MAP["TIMESTAMP"]} >= @located_until' not in before
+    assert f'{FIELD_MAP["TIMESTAMP"]} >= @located_until' in after
+    assert params(config)["located_ids"] == ["D1"] and params(config)["located_until"] == until
+
+
+def test_aggregates_group_by_device_and_bucket():
+    sql, config = query_builder.telemetryQuery(["slc_ut"], ["PM2_5", "TEMPERATURE"], agg=(3600, "median"))(
+        START, END, True)
+    assert "GROUP BY 1, 2" in sql
+    assert f'DIV(UNIX_SECONDS({FIELD_MAP["TIMESTAMP"]}), @agg_seconds) * @agg_seconds' in sql
+    assert params(config)["agg_seconds"] == 3600
+    # Bad readings are nulled before they are aggregated
+    pm = FIELD_MAP["PM2_5"]
+    assert f"APPROX_QUANTILES(IF({pm} = {PM_BAD_FLAG} OR {pm} >= {PM_BAD_THRESH}, NULL, {pm}), 2)[OFFSET(1)]" in sql
+    assert f'IF({FIELD_MAP["TEMPERATURE"]} = {TEMP_BAD_FLAG}, NULL' in sql
+
+    # The interval is a parameter, the function part of the template
+    assert query_builder.telemetryQuery(["slc_ut"], ["PM2_5", "TEMPERATURE"], agg=(300, "median"))(
+        START, END, True)[0] == sql
+    assert query_builder.telemetryQuery(["slc_ut"], ["PM2_5", "TEMPERATURE"], agg=(3600, "max"))(
+        START, END, True)[0] != sql
+
+
+def test_agg_arguments():
+    assert utils.argParseAgg(None, None) is None
+    assert utils.argParseAgg("1H", None) == (AGG_INTERVALS["1h"], "mean")
+    assert utils.argParseAgg("15m", "Count") == (AGG_INTERVALS["15m"], "count")
+    for agg, fn in [(None, "mean"), ("2h", None), ("1h", "sum")]:
+        with pytest.raises(ArgumentError) as error:
+            utils.argParseAgg(agg, fn)
+        assert error.value.status_code == 400
@@ -0,0 +1,21 @@
+import logging
+import pytest
+from tetrad import utils
+from tetrad.registry import Registry
+
+
+def test_seed_is_used_before_the_source():
+    registry = Registry({'regions': lambda version: (7, 'live')}, seeds={'regions': lambda version: ('seed', 'copy')})
+    assert registry.current['regions'] == 'copy'
+    assert registry.reload() and registry.current['regions'] == 'live'
+
+
+def test_missing_snapshot_falls_back_to_the_source(monkeypatch, tmp_path, caplog):
+    monkeypatch.setenv("REGION_INFO_SNAPSHOT_FILENAME", str(tmp_path / "region_info.json"))
+    with pytest.raises(FileNotFoundError, match="README"):
+        utils.loadRegionSnapshot()
+
+    registry = Registry({'regions': lambda version: (7, 'live')}, seeds={'regions': utils.loadRegionSnapshot})
+    with caplog.at_level(logging.WARNING):
+        assert registry.current['regions'] == 'live'
+    assert "seeding 'regions' failed" in caplog.text
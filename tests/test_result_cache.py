@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+import pytz
+from tetrad import result_cache
+from tetrad.api_consts import *
+from tetrad.result_cache import CachedRows, ResultCache
+
+
+START = datetime(2021, 1, 1, tzinfo=pytz.utc)
+END = START + timedelta(hours=6)
+
+
+def rows(n):
+    return CachedRows(['schema'], [list(range(n))])
+
+
+def test_keys_are_normalized():
+    mountain = pytz.timezone('US/Mountain')
+    key = ResultCache.makeKey(["slc_ut", "chatt_tn"], ["PM2_5", "PM10"], START, END,
+                              bbox={'north': 41, 'south': 40, 'east': -111, 'west': -112}, devices=["B", "A"])
+    same = ResultCache.makeKey(["chatt_tn", "slc_ut"], ["PM10", "PM2_5"], START.astimezone(mountain),
+                               END.astimezone(mountain),
+                               bbox={'west': -112, 'east': -111, 'south': 40, 'north': 41}, devices=["A", "B"])
+    assert key == same
+    assert hash(key) == hash(same)
+
+    # Anything else the rows depend on tells keys apart
+    assert ResultCache.makeKey(["slc_ut"], ["PM2_5"], START, END, registry='v1') != \
+        ResultCache.makeKey(["slc_ut"], ["PM2_5"], START, END, registry='v2')
+    assert ResultCache.makeKey(["slc_ut"], ["PM2_5"], START, END, agg=(3600, 'mean')) != \
+        ResultCache.makeKey(["slc_ut"], ["PM2_5"], START, END)
+
+
+def test_settled_windows_are_kept_longer():
+    now = datetime.now(pytz.utc)
+    assert ResultCache.ttl(now - timedelta(minutes=RESULT_CACHE_SETTLE_MINUTES + 1)) == RESULT_CACHE_HISTORICAL_TTL
+    assert ResultCache.ttl(now - timedelta(minutes=RESULT_CACHE_SETTLE_MINUTES - 1)) == RESULT_CACHE_RECENT_TTL
+    assert ResultCache.ttl(now) == RESULT_CACHE_RECENT_TTL
+
+
+def test_entries_expire(monkeypatch):
+    clock = [1000.]
+    monkeypatch.setattr(result_cache, 'monotonic', lambda: clock[0])
+    cache = ResultCache()
+    cache.put('k', rows(3), ttl=60)
+    clock[0] += 59
+    assert cache.get('k').total_rows == 3
+    clock[0] += 2
+    assert cache.get('k') is None
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'evictions': 0, 'entries': 0, 'rows': 0,
+                             'max_rows': RESULT_CACHE_MAX_ROWS}
+
+
+def test_bounded_by_rows_held():
+    cache = ResultCache(max_rows=10, max_entry_rows=6)
+    cache.put('a', rows(4), ttl=60)
+    cache.put('b', rows(4), ttl=60)
+    cache.get('a')
+    cache.put('c', rows(4), ttl=60)
+    # 'b' was least recently used
+    assert cache.get('b') is None and cache.get('a') and cache.get('c')
+    # Too big for one entry: not cached at all
+    cache.put('d', rows(7), ttl=60)
+    assert cache.get('d') is None and cache.stats()['rows'] == 8
+
+
+def test_wrapped_results_are_cached_once_fully_read():
+    cache = ResultCache()
+    wrapped = cache.wrap('k', rows(3), ttl=60)
+    pages = wrapped.pages
+    next(pages)
+    assert cache.get('k') is None
+    next(pages, None)
+    assert list(cache.get('k')) == [0, 1, 2]
@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+import sys
+import threading
+import types
+from types import SimpleNamespace
+import pyarrow as pa
+import pytest
+import pytz
+from tetrad import clients
+from tetrad.api_consts import *
+from tetrad.storage_read import StorageRows
+
+
+TS = FIELD_MAP["TIMESTAMP"]
+START = datetime(2021, 1, 1, tzinfo=pytz.utc)
+
+
+class FakeReadClient:
+    """
+    Just enough of BigQueryReadClient: each table is split round-robin
+    into up to max_stream_count streams of one-row batches. `wait`
+    runs before each stream is read.
+    """
+
+    def __init__(self, tables, wait=lambda table, stream: None):
+        self.tables = tables
+        self.wait = wait
+        self.requested_streams = []
+
+    def create_read_session(self, parent, read_session, max_stream_count):
+        self.requested_streams.append(max_stream_count)
+        table = read_session.table
+        n = min(max_stream_count, len(self.tables[table]))
+        return SimpleNamespace(streams=[SimpleNamespace(name=(table, i, n)) for i in range(n)])
+
+    def read_rows(self, name):
+        table, i, n = name
+        client = self
+
+        class Stream:
+            def rows(self, session):
+                client.wait(table, i)
+                times = client.tables[table][i::n]
+                return SimpleNamespace(pages=[
+                    SimpleNamespace(to_arrow=lambda t=t: pa.RecordBatch.from_arrays(
+                        [pa.array([t], pa.timestamp('us', tz='UTC')), pa.array([table])], names=[TS, 'table']))
+                    for t in times
+                ])
+        return Stream()
+
+
+@pytest.fixture
+def readClient(monkeypatch):
+    # Table references and read sessions pass straight through to the fake
+    types_ = SimpleNamespace(ReadSession=lambda table, data_format: SimpleNamespace(table=table),
+                             DataFormat=SimpleNamespace(ARROW='ARROW'))
+    monkeypatch.setitem(sys.modules, 'google.cloud.bigquery_storage', types.SimpleNamespace(types=types_))
+
+    def use(tables, **kw):
+        client = FakeReadClient(tables, **kw)
+        monkeypatch.setattr(clients, 'bigqueryRead', lambda: client)
+        return client
+    return use
+
+
+def chunked(names, rows_per_table):
+    return SimpleNamespace(
+        schema=[SimpleNamespace(name=TS), SimpleNamespace(name='table')],
+        total_rows=len(names) * rows_per_table,
+        jobs=[SimpleNamespace(destination=SimpleNamespace(to_bqstorage=lambda name=name: name)) for name in names],
+        iterators=[SimpleNamespace(total_rows=rows_per_table) for _ in names],
+    )
+
+
+def readAll(rows):
+    return [(row[TS], row['table']) for row in rows]
+
+
+def test_chunks_read_as_several_streams_stay_in_order(readClient):
+    times = [START + timedelta(minutes=m) for m in range(10)]
+    client = readClient({'day1': times, 'day2': [t + timedelta(days=1) for t in times]})
+    rows = readAll(StorageRows(chunked(['day1', 'day2'], 10)))
+    assert client.requested_streams == [STORAGE_READ_MAX_STREAMS] * 2
+    assert rows == [(t, 'day1') for t in times] + [(t + timedelta(days=1), 'day2') for t in times]
+
+
+def test_streams_of_one_chunk_are_read_in_parallel(readClient):
+    # Every stream waits for all of them to have started
+    barrier = threading.Barrier(STORAGE_READ_MAX_STREAMS, timeout=5)
+    times = [START + timedelta(minutes=m) for m in range(STORAGE_READ_MAX_STREAMS * 3)]
+    readClient({'day1': times}, wait=lambda table, stream: barrier.wait())
+    assert [t for t, _ in readAll(StorageRows(chunked(['day1'], len(times))))] == times
+
+
+def test_requests_do_not_wait_on_each_other(readClient):
+    # A large request whose streams are all stuck doesn't hold up a small one
+    stuck = threading.Event()
+    times = [START + timedelta(minutes=m) for m in range(STORAGE_READ_MAX_STREAMS)]
+    readClient({'big': times * 2, 'small': times}, wait=lambda table, stream: table == 'big' and stuck.wait(10))
+
+    big = iter(StorageRows(chunked(['big'] * STORAGE_READ_MAX_STREAMS, len(times) * 2)))
+    small = []
+    readers = [
+        threading.Thread(target=lambda: next(big, None)),
+        threading.Thread(target=lambda: small.extend(readAll(StorageRows(chunked(['small'], len(times)))))),
+    ]
+    readers[0].start()
+    readers[1].start()
+    readers[1].join(timeout=5)
+    done = not readers[1].is_alive()
+    stuck.set()
+    readers[0].join()
+    big.close()
+    readers[1].join()
+    assert done and [t for t, _ in small] == times
@@ -0,0 +1,106 @@
+import csv
+from datetime import datetime, timedelta
+import io
+import json
+from types import SimpleNamespace
+import numpy as np
+import pyarrow as pa
+import pytz
+from tetrad import stream_utils
+from tetrad.api_consts import *
+
+
+TS = FIELD_MAP["TIMESTAMP"]
+ID = FIELD_MAP["DEVICEID"]
+PM = FIELD_MAP["PM2_5"]
+LAT = "Latitude"
+START = datetime(2021, 1, 1, tzinfo=pytz.utc)
+
+PAGES = [
+    [{ID: "A", TS: START, PM: 12.5}, {ID: "B", TS: START + timedelta(minutes=2), PM: None}],
+    [],
+    [{ID: "A", TS: START + timedelta(minutes=4), PM: 3.0}],
+]
+
+
+def test_ndjson_is_one_object_per_line_and_one_chunk_per_page():
+    chunks = list(stream_utils.ndjsonStream(PAGES))
+    assert len(chunks) == 2
+    lines = ''.join(chunks).splitlines()
+    assert [json.loads(line)[ID] for line in lines] == ["A", "B", "A"]
+    assert json.loads(lines[1])[PM] is None
+
+
+def test_csv_has_a_header_then_one_chunk_per_page():
+    columns = [ID, TS, PM]
+    chunks = list(stream_utils.csvStream(PAGES, columns))
+    assert len(chunks) == 3
+    rows = list(csv.reader(io.StringIO(''.join(chunks))))
+    assert rows[0] == columns
+    assert rows[1] == ["A", START.isoformat(), "12.5"]
+    # Nulls are empty fields
+    assert rows[2][2] == ""
+    assert len(rows) == 4
+
+
+def test_streams_are_lazy():
+    def pages():
+        yield PAGES[0]
+        raise AssertionError("read past the first page")
+
+    assert next(stream_utils.ndjsonStream(pages()))
+    stream = stream_utils.csvStream(pages(), [ID])
+    assert next(stream) == f"{ID}\r\n" and next(stream) == "A\r\nB\r\n"
+
+
+SCHEMA = [SimpleNamespace(name=ID, field_type="STRING"), SimpleNamespace(name=TS, field_type="TIMESTAMP"),
+          SimpleNamespace(name=PM, field_type="FLOAT"), SimpleNamespace(name=LAT, field_type="FLOAT")]
+COLUMNS = {
+    ID: ["A", "B", None, "A"],
+    TS: [START + timedelta(minutes=2 * i) for i in range(4)],
+    PM: [12.5, None, 3.0, 4.25],
+    LAT: [40.7654321, 40.1, 40.2, None],
+}
+
+
+def test_columns_are_typed():
+    encoded = {name: (kind, data) for name, kind, data in stream_utils.encodeColumns(SCHEMA, COLUMNS)}
+    kind, (dictionary, codes) = encoded[ID]
+    assert kind == 'dictionary' and dictionary == ["A", "B"] and codes.tolist() == [0, 1, -1, 0]
+    assert encoded[TS][1].tolist() == [1609459200000 + 120000 * i for i in range(4)]
+    assert encoded[PM][1].dtype == np.float32 and np.isnan(encoded[PM][1][1])
+    # Coordinates keep their precision
+    assert encoded[LAT][1].dtype == np.float64 and encoded[LAT][1][0] == 40.7654321
+
+    # Timestamps read as datetime64 encode the same
+    as_datetime64 = {**COLUMNS, TS: np.array([t.replace(tzinfo=None) for t in COLUMNS[TS]], dtype='datetime64[us]')}
+    assert np.array_equal(stream_utils.encodeColumns(SCHEMA, as_datetime64)[1][2], encoded[TS][1])
+
+
+def test_columnar_json():
+    out = json.loads(stream_utils.columnarJSON(stream_utils.encodeColumns(SCHEMA, COLUMNS, float_dtype=np.float64)))
+    assert out["length"] == 4 and out["columns"] == [ID, TS, PM, LAT]
+    assert out["types"] == {ID: "dictionary<int32,string>", TS: "int64", PM: "float64", LAT: "float64"}
+    assert out[ID] == {"dictionary": ["A", "B"], "codes": [0, 1, -1, 0]}
+    assert out[PM] == [12.5, None, 3.0, 4.25]
+
+
+def test_arrow_stream_round_trips():
+    table = pa.ipc.open_stream(stream_utils.arrowStream(stream_utils.encodeColumns(SCHEMA, COLUMNS))).read_all()
+    assert table.column_names == [ID, TS, PM, LAT]
+    assert table.column(ID).to_pylist() == ["A", "B", None, "A"]
+    assert table.column(TS).to_pylist() == COLUMNS[TS]
+    assert table.column(PM).to_pylist() == [12.5, None, 3.0, 4.25]
+    assert table.schema.field(PM).type == pa.float32() and table.schema.field(LAT).type == pa.float64()
+
+
+def test_collect_columns_joins_pages():
+    class Pages:
+        schema = SCHEMA[:1]
+
+        def columnPages(self):
+            yield {ID: np.array(["A"])}
+            yield {ID: ["B", "C"]}
+
+    schema, columns = stream_utils.collectColumns(Pages())
+    assert schema == SCHEMA[:1] and columns == {ID: ["A", "B", "C"]}
@@ -0,0 +1,49 @@
+import math
+import numpy as np
+import pytest
+from tetrad import utils
+
+
+def distBetweenCoords(p1, p2):
+    """The scalar great-circle distance the vectorized haversine replaced"""
+    R = 6371
+    phi1 = p1[0] * (math.pi / 180)
+    phi2 = p2[0] * (math.pi / 180)
+    del1 = (p2[0] - p1[0]) * (math.pi / 180)
+    del2 = (p2[1] - p1[1]) * (math.pi / 180)
+    a = math.sin(del1 / 2) * math.sin(del1 / 2) + math.cos(phi1) * math.cos(phi2) * math.sin(del2 / 2) * math.sin(del2 / 2)
+    return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+@pytest.mark.parametrize("center", [
+    {'lat': 40.7, 'lon': -111.9},
+    # Across the antimeridian and around a pole
+    {'lat': 10., 'lon': 179.9},
+    {'lat': 89.9, 'lon': 0.},
+])
+def test_radius_mask_matches_the_per_row_distance(center):
+    rng = np.random.default_rng(4)
+    radius = 25.
+    lats = np.clip(center['lat'] + rng.uniform(-0.5, 0.5, 500), -90, 90)
+    lons = (center['lon'] + rng.uniform(-1, 1, 500) + 180) % 360 - 180
+    lats[:5] = np.nan
+
+    mask = utils.radiusMask(lats, lons, radius, center)
+    expected = [not math.isnan(lat) and distBetweenCoords((lat, lon), (center['lat'], center['lon'])) <= radius
+                for lat, lon in zip(lats, lons)]
+    assert mask.tolist() == expected
+    assert 0 < mask.sum() < len(mask)
+
+
+def test_radius_filtering_keeps_row_order():
+    center = {'lat': 40.7, 'lon': -111.9}
+    data = [{'Latitude': 40.7, 'Longitude': -111.9, 'n': 0}, {'Latitude': 41.7, 'Longitude': -111.9, 'n': 1},
+            {'Latitude': None, 'Longitude': None, 'n': 2}, {'Latitude': 40.71, 'Longitude': -111.9, 'n': 3}]
+    assert [datum['n'] for datum in utils.bboxDataToRadiusData(data, 5, center)] == [0, 3]
+    assert utils.bboxDataToRadiusData([], 5, center) == []
+
+
+def test_chords_convert_to_great_circle_km():
+    points = utils.unitVectors(np.array([40.7, 40.9]), np.array([-111.9, -111.5]))
+    chord = np.linalg.norm(points[0] - points[1])
+    assert utils.chordToKm(chord) == pytest.approx(utils.haversine(40.7, -111.9, 40.9, -111.5))
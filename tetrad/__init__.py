@@ -4,15 +4,14 @@ from flask_caching import Cache
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_cors import CORS, cross_origin
-from firebase_admin import initialize_app
-from tetrad import utils 
+from tetrad import utils, clients
 from os import getenv, environ
-import google.cloud.logging 
-gcloud_logging_client = google.cloud.logging.Client()
-gcloud_logging_client.get_default_handler()
-gcloud_logging_client.setup_logging()
 import logging
 
+# One Cloud Logging setup and one of each client for the whole process,
+# created in the background or on first use instead of here
+clients.warmUp()
+
 logging.error("Inside __init__.py setup")
 
 # app = Flask(__name__)
@@ -34,8 +33,6 @@ limiter = Limiter(
     default_limits=['2000 per day']
 )
 
-firebase_app = initialize_app()
-
 cache = Cache(app)
 
 # Load our many route files
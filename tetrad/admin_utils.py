@@ -3,23 +3,14 @@
 import json 
 import requests 
 import functools
-from firebase_admin import auth
-from google.cloud import firestore, secretmanager, storage
 from os import getenv
 from flask import request
 import re
 import base64
-import google.cloud.logging 
-gcloud_logging_client = google.cloud.logging.Client()
-gcloud_logging_client.get_default_handler()
-gcloud_logging_client.setup_logging()
+from tetrad import clients
 import logging
 
 
-
-fs_client = firestore.Client()
-
-
 def check_creds(uid):
     """ 
     Check that the supplied email/password from header match
@@ -73,7 +64,7 @@ def ingroup(group_or_groups):
                 return f'No token provided. Please provide a key/value pair for header: {getenv("FB_AUTH_HEADER")}:<session JWT>"', 401
             
             try:
-                user = auth.verify_id_token(request.headers.get(getenv('FB_AUTH_HEADER')))
+                user = clients.firebaseAuth().verify_id_token(request.headers.get(getenv('FB_AUTH_HEADER')))
                 request.user = user
             except Exception as e:
                 return 'Invalid token provided.' + repr(e), 401
@@ -92,8 +83,8 @@ def _access_secret_version(secret_id, version_id="latest"):
     can be a version number as a string (e.g. "5") or an alias (e.g. "latest").
     """
 
-    # Create the Secret Manager client.
-    client = secretmanager.SecretManagerServiceClient()
+    # The shared Secret Manager client.
+    client = clients.secretManager()
 
     # Build the resource name of the secret version.
     name = f"projects/{getenv('GOOGLE_CLOUD_PROJECT')}/secrets/{secret_id}/versions/{version_id}"
@@ -106,10 +97,10 @@ def _access_secret_version(secret_id, version_id="latest"):
 
 def fs_get_in_group(uid, group):
     if isinstance(group, str):
-        doc = fs_client.collection(getenv('FS_USER_GROUPS_COLLECTION')).document(f'{group}').get()
+        doc = clients.firestore().collection(getenv('FS_USER_GROUPS_COLLECTION')).document(f'{group}').get()
         return (doc.exists) and (f'{uid}' in list(doc.get(getenv('FS_USER_GROUPS_UIDS_KEY'))))
     elif isinstance(group, list):
-        docs = fs_client.collection(getenv('FS_USER_GROUPS_COLLECTION')).where('__name__', 'in', group).stream()
+        docs = clients.firestore().collection(getenv('FS_USER_GROUPS_COLLECTION')).where('__name__', 'in', group).stream()
         valid_uids = []
         for doc in docs:
             valid_uids += list(doc.get(getenv('FS_USER_GROUPS_UIDS_KEY'))) 
@@ -163,7 +154,7 @@ def gs_get_blob(bucket_name, source_blob_name, dnl_type):
     Download blob from GS bucket into bytes object
     @parm dnl_type: one of "string", "text", "bytes"
     """
-    c = storage.Client()
+    c = clients.storage()
     bucket = c.bucket(bucket_name)
     blob = bucket.blob(source_blob_name)
     try:
@@ -58,7 +58,7 @@ FIELD_MAP = {
     "PM2_5":        getenv("FIELD_PM2"),
     "PM10":         getenv("FIELD_PM10"),
     "TEMPERATURE":  getenv("FIELD_TEMP"),
-    "HUMIDTY":      getenv("FIELD_HUM"),
+    "HUMIDITY":     getenv("FIELD_HUM"),
     "MICSRED":      getenv("FIELD_RED"),
     "MICSNOX":      getenv("FIELD_NOX"),
     "MICSHEATER":   getenv("FIELD_HTR"),
@@ -81,4 +81,100 @@ VALID_QUERY_FIELDS = {
     "MICSRED":      getenv("FIELD_RED"),
     "MICSNOX":      getenv("FIELD_NOX"),
     "MICSHEATER":   getenv("FIELD_HTR"),
-}
\ No newline at end of file
+}
+
+# Values sensors report for bad readings. PM2.5 at or above 
+# PM_BAD_THRESH is also treated as bad.
+PM_BAD_FLAG = float(getenv("PM_BAD_FLAG", -1))
+PM_BAD_THRESH = float(getenv("PM_BAD_THRESH", 500))
+TEMP_BAD_FLAG = float(getenv("TEMP_BAD_FLAG", -1000))
+HUM_BAD_FLAG = float(getenv("HUM_BAD_FLAG", -1000))
+
+# Server-side time aggregation for /requestData ('agg' -> seconds, 'fn')
+AGG_INTERVALS = {
+    "1m":  60,
+    "5m":  300,
+    "15m": 900,
+    "1h":  3600,
+    "1d":  86400,
+}
+AGG_FUNCTIONS = ["mean", "median", "max", "min", "count"]
+
+# In-memory snapshot of the latest reading per device (/liveSensors).
+# /liveSensors only returns LIVE_SNAPSHOT_LABELS (every label if empty);
+# requests for other fields or a longer 'delta' go to BigQuery
+LIVE_SNAPSHOT_REFRESH_SECONDS = int(getenv("LIVE_SNAPSHOT_REFRESH_SECONDS", 60))
+LIVE_SNAPSHOT_WINDOW_MINUTES = int(getenv("LIVE_SNAPSHOT_WINDOW_MINUTES", 15))
+LIVE_SNAPSHOT_FIELDS = getenv("LIVE_SNAPSHOT_FIELDS", "PM2_5").upper().split(',')
+LIVE_SNAPSHOT_LABELS = [label for label in getenv("LIVE_SNAPSHOT_LABELS", "").split(',') if label]
+LIVE_SNAPSHOT_WAIT_SECONDS = float(getenv("LIVE_SNAPSHOT_WAIT_SECONDS", 2))
+
+# Rows per page fetched from BigQuery for /requestData
+REQUEST_DATA_PAGE_SIZE = int(getenv("REQUEST_DATA_PAGE_SIZE", 10000))
+
+# Long /requestData ranges run as concurrent day- or week-sized sub-queries
+REQUEST_DATA_MAX_WORKERS = int(getenv("REQUEST_DATA_MAX_WORKERS", 8))
+CHUNK_MIN_RANGE_HOURS = int(getenv("CHUNK_MIN_RANGE_HOURS", 24))
+CHUNK_WEEKS_AFTER_DAYS = int(getenv("CHUNK_WEEKS_AFTER_DAYS", 31))
+
+# /requestData result cache. Windows that ended more than
+# RESULT_CACHE_SETTLE_MINUTES ago are treated as immutable.
+RESULT_CACHE_MAX_ROWS = int(getenv("RESULT_CACHE_MAX_ROWS", 250000))
+RESULT_CACHE_MAX_ENTRY_ROWS = int(getenv("RESULT_CACHE_MAX_ENTRY_ROWS", 50000))
+RESULT_CACHE_SETTLE_MINUTES = int(getenv("RESULT_CACHE_SETTLE_MINUTES", 120))
+RESULT_CACHE_HISTORICAL_TTL = int(getenv("RESULT_CACHE_HISTORICAL_TTL", 86400))
+RESULT_CACHE_RECENT_TTL = int(getenv("RESULT_CACHE_RECENT_TTL", 60))
+
+# /requestData hourly buckets for plain label queries
+BUCKET_CACHE_MAX_ROWS = int(getenv("BUCKET_CACHE_MAX_ROWS", 250000))
+
+# Byte budgets for /requestData, checked with a BigQuery dry run before
+# a query runs. 0 disables a limit.
+QUERY_BUDGET_REQUEST_BYTES = int(getenv("QUERY_BUDGET_REQUEST_BYTES", 0))
+QUERY_BUDGET_USER_BYTES = int(getenv("QUERY_BUDGET_USER_BYTES", 0))
+QUERY_BUDGET_WINDOW_SECONDS = int(getenv("QUERY_BUDGET_WINDOW_SECONDS", 86400))
+
+# Results of at least STORAGE_READ_MIN_ROWS rows are read through the
+# BigQuery Storage Read API as Arrow batches instead of REST pages,
+# on up to STORAGE_READ_MAX_STREAMS streams (and threads) per request
+STORAGE_READ_MIN_ROWS = int(getenv("STORAGE_READ_MIN_ROWS", 200000))
+STORAGE_READ_MAX_STREAMS = int(getenv("STORAGE_READ_MAX_STREAMS", 4))
+STORAGE_READ_PREFETCH_BATCHES = int(getenv("STORAGE_READ_PREFETCH_BATCHES", 4))
+
+# Spatial kernel eigenpairs kept per worker, keyed by sensor positions and length scales
+GP_SPATIAL_EIGEN_CACHE_SIZE = int(getenv("GP_SPATIAL_EIGEN_CACHE_SIZE", 32))
+
+# Fitted estimate models kept per worker, bounded by the bytes their tensors hold
+GP_MODEL_CACHE_MAX_BYTES = int(getenv("GP_MODEL_CACHE_MAX_BYTES", 64 * 2**20))
+
+# /estimates: gaussian process length scales (meters, meters, hours), the most
+# points and the longest span of hours per request, and how the points are
+# evaluated: in chunks of GP_ESTIMATE_CHUNK_POINTS, on up to GP_ESTIMATE_MAX_WORKERS threads
+GP_LATLON_LENGTH_SCALE = float(getenv("GP_LATLON_LENGTH_SCALE", 4300.))
+GP_ELEVATION_LENGTH_SCALE = float(getenv("GP_ELEVATION_LENGTH_SCALE", 30.))
+GP_TIME_LENGTH_SCALE = float(getenv("GP_TIME_LENGTH_SCALE", 0.25))
+GP_ESTIMATE_MAX_POINTS = int(getenv("GP_ESTIMATE_MAX_POINTS", 20000))
+GP_ESTIMATE_MAX_HOURS = int(getenv("GP_ESTIMATE_MAX_HOURS", 168))
+GP_ESTIMATE_CHUNK_POINTS = int(getenv("GP_ESTIMATE_CHUNK_POINTS", 2000))
+GP_ESTIMATE_MAX_WORKERS = int(getenv("GP_ESTIMATE_MAX_WORKERS", 1))
+
+# How often the correction factors and region info are checked for changes
+REGISTRY_RELOAD_SECONDS = int(getenv("REGISTRY_RELOAD_SECONDS", 120))
+
+# Device locations for prefiltering /requestData box and radius queries.
+# Queries that start before the lookback run without the prefilter.
+# Every instance scans the lookback's GPS columns once when it starts,
+# so keep it to the windows most queries ask for.
+DEVICE_REGISTRY_REFRESH_SECONDS = int(getenv("DEVICE_REGISTRY_REFRESH_SECONDS", 300))
+DEVICE_REGISTRY_LOOKBACK_DAYS = int(getenv("DEVICE_REGISTRY_LOOKBACK_DAYS", 7))
+DEVICE_REGISTRY_CELL_DEGREES = float(getenv("DEVICE_REGISTRY_CELL_DEGREES", 0.5))
+DEVICE_REGISTRY_MAX_CELLS = int(getenv("DEVICE_REGISTRY_MAX_CELLS", 64))
+DEVICE_REGISTRY_MAX_IDS = int(getenv("DEVICE_REGISTRY_MAX_IDS", 2000))
+
+# /nearestSensors
+NEAREST_SENSORS_DEFAULT_N = int(getenv("NEAREST_SENSORS_DEFAULT_N", 10))
+NEAREST_SENSORS_MAX_N = int(getenv("NEAREST_SENSORS_MAX_N", 100))
+
+# Clients (see tetrad/clients.py) created in the background at startup
+# instead of on first use
+STARTUP_WARM_CLIENTS = [name for name in getenv("STARTUP_WARM_CLIENTS", "cloudLogging,bigquery").split(',') if name]
@@ -1,11 +1,17 @@
 from datetime import datetime, timedelta
 import pytz
-from flask import request, jsonify, render_template
+from flask import request, jsonify, render_template, Response, stream_with_context
 import functools
-from google.cloud.bigquery import Client as BQClient, QueryJobConfig, ScalarQueryParameter
-from tetrad import app, cache, admin_utils, limiter, utils
+from flask_limiter.util import get_remote_address
+from tetrad import app, cache, admin_utils, limiter, utils, stream_utils, chunked_query, query_builder, query_budget, clients
 from tetrad.api_consts import *
 from tetrad.classes import ArgumentError, NoDataError
+from tetrad.live_snapshot import LiveSnapshot, liveRows
+from tetrad.device_registry import DeviceRegistry
+from tetrad.result_cache import ResultCache, CachedRows
+from tetrad.bucket_cache import HourBucketCache
+from tetrad.storage_read import StorageRows
+from tetrad.stream_utils import STREAM_FORMATS, COLUMNAR_FORMATS, RESPONSE_FORMATS, ACCEPT_FORMATS
 # from tetrad import gaussian_model_utils
 import json
 import numpy as np 
@@ -14,10 +20,6 @@ from os import getenv
 import re 
 import requests
 from time import time 
-import google.cloud.logging 
-gcloud_logging_client = google.cloud.logging.Client()
-gcloud_logging_client.get_default_handler()
-gcloud_logging_client.setup_logging()
 import logging
 
 
@@ -39,7 +41,24 @@ def handle_nodata_error(error):
     return response
 
 
-bq_client = BQClient()
+@app.after_request
+def add_registry_version(response):
+    # Which correction factors / region info produced this response
+    response.headers['X-Registry-Version'] = utils.REGISTRY.current.version
+    return response
+
+
+utils.REGISTRY.start()
+
+live_snapshot = LiveSnapshot()
+live_snapshot.start()
+
+device_registry = DeviceRegistry()
+device_registry.start()
+
+result_cache = ResultCache()
+bucket_cache = HourBucketCache()
+byte_budget = query_budget.ByteBudget()
 
 @app.route('/', subdomain=getenv('SUBDOMAIN_API'))
 def home():
@@ -52,7 +71,6 @@ def home():
 # https://api.tetradsensors.com/liveSensors?src=all&field=pm2_5
 @app.route("/liveSensors", methods=["GET"], subdomain=getenv('SUBDOMAIN_API'))
 # @app.route("/liveSensors", methods=["GET"])
-# @cache.cached(timeout=119)
 def liveSensors():
 
     def argParseDelta(delta):
@@ -78,94 +96,60 @@ def liveSensors():
     except ArgumentError:
         raise
 
-    #################################
-    # Query Builder
-    #################################
+    # Served from the in-memory snapshot, which a background thread
+    # refreshes every LIVE_SNAPSHOT_REFRESH_SECONDS, when it holds these
+    # fields that far back
+    if live_snapshot.serves(fields, delta):
+        data = live_snapshot.get(srcs, fields, delta)
+    else:
+        data = liveRows(fields, delta, srcs)
 
-    Q_FIELDS = utils.queryBuildFields(fields)
-    Q_LABELS = utils.queryBuildLabels(srcs)
-    # Build the query
-    SUBQ = f"""SELECT 
-                    {Q_FIELDS}
-                FROM 
-                    `{BQ_PATH_TELEMETRY}`
-                WHERE 
-                    {Q_LABELS}
-                        AND
-                    {FIELD_MAP["TIMESTAMP"]} >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {delta} MINUTE)
-            """
-
-    # Build the full query
-    q = f"""
-    SELECT 
-        * EXCEPT(row_num)
-    FROM
-        (
-            SELECT 
-                *, 
-                ROW_NUMBER() 
-            OVER
-                (
-                    PARTITION BY 
-                        {FIELD_MAP["DEVICEID"]} 
-                    ORDER BY 
-                        {FIELD_MAP["TIMESTAMP"]} DESC
-                ) row_num
-            FROM 
-                (
-                    {SUBQ}
-                )
-        )
-    WHERE 
-        row_num = 1;
-    """
+    return jsonify(data), 200
 
-    # TODO: Tom added this manually as a quick fix to the huge bigquery cost
-    query = """
-    SELECT 
-        * EXCEPT(row_num)
-    FROM
-        (
-            SELECT 
-                *, 
-                ROW_NUMBER() 
-            OVER
-                (
-                    PARTITION BY 
-                        DeviceID 
-                    ORDER BY 
-                        Timestamp DESC
-                ) row_num
-            FROM 
-                (
-                    SELECT 
-                      DeviceID, 
-                      Timestamp,
-                      Source,
-                      Label,
-                      ST_Y(GPS) AS Latitude, 
-                      ST_X(GPS) AS Longitude,
-                      PM2_5
-                    FROM 
-                      `tetrad-296715.telemetry.telemetry`
-                    WHERE 
-                    (
-                      Label = 'slc_ut' OR Label = 'chatt_tn' OR Label = 'kc_mo' OR Label = 'clev_oh' OR Label = 'global' OR Label = 'pv_ma'
-                    )
-                      AND
-                    Timestamp >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 15 MINUTE)
-                )
-        )
-    WHERE 
-        row_num = 1;
+# https://api.tetradsensors.com/nearestSensors?lat=40.76&lon=-111.89&n=5&field=pm2_5
+@app.route("/nearestSensors", methods=["GET"], subdomain=getenv('SUBDOMAIN_API'))
+def nearestSensors():
+    """
+    The 'n' active devices nearest to 'lat','lon' with a reading for 
+    every 'field', nearest first, with their latest readings and 
+    'Distance' in kilometers. Answered from the live snapshot.
     """
-    query_job = bq_client.query(query=query)
-    rows = query_job.result()
 
-    data = [dict(r) for r in rows]
+    def argParseN(n):
+        if n is None:
+            n = NEAREST_SENSORS_DEFAULT_N
+        if not (0 < n <= NEAREST_SENSORS_MAX_N):
+            raise ArgumentError(f"Argument 'n' must be an integer between 1 and {NEAREST_SENSORS_MAX_N}", 400)
+        return n
+
+    args = [
+        'lat',
+        'lon',
+        'n',
+        'field'
+    ]
+
+    req_args = [
+        'lat',
+        'lon',
+        'field'
+    ]
+
+    try:
+        utils.verifyArgs(request.args, req_args, args)
+        lat    = request.args.get('lat', type=float)
+        lon    = request.args.get('lon', type=float)
+        if lat is None or lon is None or not utils.verifyLatLon(lat, lon):
+            raise ArgumentError("Arguments 'lat' and 'lon' must be a valid pair of latitude,longitude coordinates", 400)
+        fields = utils.argParseFields(request.args.get('field', type=str))
+        n      = argParseN(request.args.get('n', type=int))
+    except ArgumentError:
+        raise
+
+    if not set(fields).issubset(LIVE_SNAPSHOT_FIELDS):
+        raise ArgumentError(f"Argument 'field' must be included from one or more of {', '.join(LIVE_SNAPSHOT_FIELDS)}", status_code=400)
 
-    # Clean data and apply correction factors
-    data = utils.tuneAllFields(data, fields)
+    data = live_snapshot.nearest(lat, lon, n, fields)
 
     return jsonify(data), 200
 
@@ -183,8 +167,85 @@ def requestData():
     @param: box     (optional)  List of coordinates in this order: North, South, East, West
     @param: radius  (optional)  Radius in kilometers
     @param: center  (optional)  Required if 'radius' is supplied. Lat,Lon center of radius. &center=42.012,-111.423&
+    @param: format  (optional)  One of 'json' (default), 'ndjson', 'csv', 'columnar-json', 'arrow'. 
+                                'ndjson' and 'csv' are streamed page by page. 'columnar-json' and 'arrow' 
+                                return one typed array per field. If absent, the 'Accept' header is used.
+    @param: agg     (optional)  One of '1m', '5m', '15m', '1h', '1d'. Aggregate each device's readings 
+                                into buckets of this length in BigQuery, one row per device and bucket, 
+                                stamped with the bucket start
+    @param: fn      (optional)  Aggregate for 'agg': one of 'mean' (default), 'median' (approximate), 
+                                'max', 'min', 'count'
+    @param: estimate (optional) 'true' to only return the bytes the query would scan (from a 
+                                BigQuery dry run) and how that compares to the byte budgets, 
+                                with the same request aggregated as 'agg=1h' for comparison
     """
 
+    srcs, fields, start, end, devices, box, rc, fmt, agg, estimate = _argParseRequestData()
+    # Cached rows depend on the registry's region polygons and
+    # correction factors, so a new registry version starts new entries
+    version = utils.REGISTRY.current.version
+
+    #################################
+    # Query Picker
+    #################################
+    if not (box or rc or devices or agg):
+        # Plain label queries are assembled from hourly buckets, 
+        # so sliding windows only fetch (and are only charged for) 
+        # the hours they don't have
+        fields = sorted(fields)
+        windowQuery = query_builder.telemetryQuery(srcs, fields)
+        response = _checkBudget(
+            [windowQuery(lo, hi, False) for lo, hi in bucket_cache.missingWindows(srcs, fields, start, end, version)],
+            start, end, estimate, [query_builder.telemetryQuery(srcs, fields, agg=_suggestedAgg())(start, end, True)])
+        if response:
+            return response
+
+        rows = bucket_cache.rows(srcs, fields, start, end, fetch=_fetchBuckets(srcs, fields), version=version)
+        return _bucketResponse(rows, fields, fmt, rows.cache_status)
+
+    if rc and not (devices or agg) and not bucket_cache.missingWindows(srcs, sorted(fields), start, end, version):
+        # Every hour of these labels is already cached: refine it to the
+        # circle locally instead of running ST_DWITHIN in BigQuery
+        if estimate:
+            return _checkBudget([], start, end, estimate)
+        fields = sorted(fields)
+        rows = bucket_cache.rows(srcs, fields, start, end, fetch=_fetchBuckets(srcs, fields), version=version)
+        rows = CachedRows(rows.schema, [utils.bboxDataToRadiusData(page, *rc) for page in rows.pages])
+        return _bucketResponse(rows, fields, fmt, 'HIT')
+
+    cache_key = result_cache.makeKey(srcs, fields, start, end, bbox=box, rc=rc, devices=devices, agg=agg,
+                                     registry=version)
+    rows = result_cache.get(cache_key)
+    cache_status = 'MISS' if rows is None else 'HIT'
+    if rows is None:
+        # Boxes and circles also become a list of the devices that were
+        # inside them, so BigQuery only tests those devices' rows
+        located = None
+        if (box or rc) and not devices:
+            located = device_registry.locate(start, bbox=box, radius=rc[0] if rc else None, center=rc[1] if rc else None)
+
+        region = dict(bbox=box, radius=rc[0] if rc else None, center=rc[1] if rc else None, id_ls=devices, located=located)
+        windowQuery = query_builder.telemetryQuery(srcs, fields, agg=agg, **region)
+        aggregated = [] if agg else [query_builder.telemetryQuery(srcs, fields, agg=_suggestedAgg(), **region)(start, end, True)]
+        response = _checkBudget([windowQuery(start, end, True)], start, end, estimate, aggregated)
+        if response:
+            return response
+        if rc:
+            rows = _requestData(srcs, fields, start, end, radius=rc[0], center=rc[1], id_ls=devices, agg=agg, located=located)
+        else:
+            rows = _requestData(srcs, fields, start, end, bbox=box, id_ls=devices, agg=agg, located=located)
+        rows = result_cache.wrap(cache_key, rows, result_cache.ttl(end))
+    elif estimate:
+        # Cached results scan nothing
+        return _checkBudget([], start, end, estimate)
+
+    response = _formatRows(rows, fmt)
+    response.headers['X-Cache'] = cache_status
+    return response
+
+
+def _argParseRequestData():
+    """The /requestData arguments, parsed and checked"""
     args = [
         'src',
         'field',
@@ -193,7 +254,11 @@ def requestData():
         'device',
         'box',
         'radius',
-        'center'
+        'center',
+        'format',
+        'agg',
+        'fn',
+        'estimate'
     ]
 
     req_args = [
@@ -220,115 +285,327 @@ def requestData():
         rc      = utils.argParseRadiusArgs(
                     request.args.get('radius', type=float),
                     request.args.get('center', type=str))
+        fmt     = utils.argParseFormat(
+                    request.args.get('format', type=str) or ACCEPT_FORMATS.get(request.accept_mimetypes.best_match(ACCEPT_FORMATS)),
+                    list(RESPONSE_FORMATS))
+        agg     = utils.argParseAgg(
+                    request.args.get('agg', type=str),
+                    request.args.get('fn', type=str))
+        estimate = utils.argParseBool(request.args.get('estimate', type=str), 'estimate')
     except ArgumentError as e:
         raise
     except Exception as e:
         logging.error(str(e))
         raise
 
-    #################################
-    # Query Picker
-    #################################
-    data = None
     if box and rc:
         raise ArgumentError("Must choose either 'box' or 'radius','center' arguments", status_code=400)
-    elif rc:
-        data = _requestData(srcs, fields, start, end, radius=rc[0], center=rc[1], id_ls=devices)
-    else:
-        data = _requestData(srcs, fields, start, end, bbox=box, id_ls=devices)
+    return srcs, fields, start, end, devices, box, rc, fmt, agg, estimate
 
-    if isinstance(data, int):
-        if data == 408:
-            return "Timeout (2 minutes). Try a smaller query.", 408
-        else:
-            return "Something went wrong. That's all we know. Contact the developers.", data
 
-    response = jsonify(data)
-    response.status_code = 200
+def _bucketResponse(rows, fields, fmt, cache_status):
+    """Response for rows assembled from the hourly bucket cache"""
+    if rows.total_rows == 0:
+        raise NoDataError("No data returned.", status_code=222)
+    response = _formatRows(_cleanRows(rows, fields), fmt)
+    response.headers['X-Cache'] = cache_status
     return response
 
 
-def _requestData(srcs, fields, start, end, bbox=None, radius=None, center=None, id_ls=None, removeNulls=False):
+def _checkBudget(queries, start, end, estimate, aggregated=()):
+    """
+    Dry-run `queries` and hold them to the caller's byte budget. With 
+    `estimate`, return the estimate as the response instead, without 
+    running or charging anything. Otherwise returns None. `aggregated`
+    are the same queries aggregated as query_budget.SUGGESTED_AGG, 
+    offered as an alternative.
+    """
+    if not (estimate or byte_budget.enabled):
+        return None
+
+    user = get_remote_address()
+    nbytes = query_budget.estimateBytes(clients.bigquery(), queries) if queries else 0
+    # The alternative is only dry-run when it would be offered
+    aggregated_bytes = None
+    if aggregated and (estimate or not byte_budget.report(user, nbytes, start, end)['within_budget']):
+        aggregated_bytes = query_budget.estimateBytes(clients.bigquery(), aggregated)
+    if estimate:
+        return jsonify(byte_budget.report(user, nbytes, start, end, aggregated_bytes)), 200
+
+    byte_budget.check(user, nbytes, start, end, aggregated_bytes)
+    return None
+
+
+def _suggestedAgg():
+    """query_budget.SUGGESTED_AGG as utils.argParseAgg returns it"""
+    agg, fn = query_budget.SUGGESTED_AGG
+    return AGG_INTERVALS[agg], fn
+
+
+def _formatRows(rows, fmt):
+    """Build the /requestData response for `rows` in format `fmt`"""
+    if fmt == 'json':
+        response = jsonify([dict(r) for r in rows])
+        response.status_code = 200
+        return response
+
+    if fmt in COLUMNAR_FORMATS:
+        schema, columns = stream_utils.collectColumns(rows)
+        if fmt == 'arrow':
+            body = stream_utils.arrowStream(stream_utils.encodeColumns(schema, columns))
+        else:
+            body = stream_utils.columnarJSON(stream_utils.encodeColumns(schema, columns, float_dtype=np.float64))
+        return Response(body, mimetype=COLUMNAR_FORMATS[fmt], status=200)
+
+    # Stream the rest, one BigQuery page at a time
+    pages = stream_utils.rowPages(rows)
+    if fmt == 'ndjson':
+        body = stream_utils.ndjsonStream(pages)
+    else:
+        body = stream_utils.csvStream(pages, [f.name for f in rows.schema])
+
+    return Response(stream_with_context(body), mimetype=STREAM_FORMATS[fmt], status=200)
+
+
+def _fetchBuckets(srcs, fields):
+    """fetch() for the hourly bucket cache: one [lo, hi) query per window"""
+    windowQuery = query_builder.telemetryQuery(srcs, fields)
+
+    def fetch(windows):
+        return chunked_query.runChunked(
+            clients.bigquery(),
+            [windowQuery(lo, hi, False) for lo, hi in windows],
+            page_size=REQUEST_DATA_PAGE_SIZE
+        ).iterators
+    return fetch
+
+
+def _requestData(srcs, fields, start, end, bbox=None, radius=None, center=None, id_ls=None, agg=None, located=None, removeNulls=False):
     """
     Function to query a field (like Temperature, Humidity, PM, etc.) 
     or list of fields, in date range [start, end], inside a bounding
     box. The bounding box is a dict {'lat_hi', 'lat_lo', 'lon_hi', 'lon_lo'} 
     coordinates.
-    If radius, radius is in meters, center is dict {'lat', 'lon'}
+    If radius, radius is in kilometers, center is dict {'lat', 'lon'}
     Can include an ID or a list of IDs
+    If agg, (interval seconds, fn): aggregated per device and interval in BigQuery
+    If located, (ids, until) from DeviceRegistry.locate
+    Returns a RowIterator-like ChunkedRows, or StorageRows for large
+    results (not yet downloaded)
     """
 
-    if id_ls:
-        query_devs = utils.idsToWHEREClause(id_ls, FIELD_MAP['DEVICEID'])
-    else:
-        query_devs = "True"
-
-    query_fields = utils.queryBuildFields(fields)
-
-    if bbox:
-        n, s, e, w = bbox['lat_hi'], bbox['lat_lo'], bbox['lon_hi'], bbox['lon_lo']
-        query_region = f"""
-            ST_WITHIN(
-                {FIELD_MAP["GPS"]}, 
-                ST_GeogFromGeoJSON(
-                    '{{"type": "Polygon", "coordinates": [[[{e},{n}],[{e},{s}],[{w},{s}],[{w},{n}],[{e},{n}]]]}}'
-                )
-            )
-        """
-    elif radius:
-        query_region = f"""
-            ST_DWITHIN(
-                {FIELD_MAP["GPS"]}, 
-                ST_GEOGPOINT({center['lon']}, {center['lat']}),
-                {radius * 1000}
-            )
-        """
-    else:
-        query_region = "True"
-
-    query_labels = utils.queryBuildLabels(srcs)
-    QUERY = f"""
-        SELECT 
-            {query_fields}
-        FROM 
-            `{BQ_PATH_TELEMETRY}` 
-        WHERE 
-            {query_labels}
-                AND
-            {FIELD_MAP["TIMESTAMP"]} >= "{start}"
-                AND
-            {FIELD_MAP["TIMESTAMP"]} <= "{end}"
-                AND
-            {query_region}
-                AND
-            {query_devs}
-        ORDER BY
-            {FIELD_MAP["TIMESTAMP"]}
-    """
-
-    # data = ' '.join([i for i in QUERY.replace('\n', ' ').split(' ') if i])
-
-    # Run the query and collect the result
-    # try:
-    query_job = bq_client.query(QUERY)
-    rows = query_job.result()   
-    # except Exception as e:
-    #     print(str(e))
-    #     return 408
+    windowQuery = query_builder.telemetryQuery(
+        srcs, fields, bbox=bbox, radius=radius, center=center, id_ls=id_ls, agg=agg, located=located)
+
+    # Long ranges are split into day/week chunks that run concurrently. 
+    # Each chunk sorts only its own rows; chunks are stitched back in order. 
+    # Chunks end on UTC day boundaries, so 'agg' buckets never straddle two. 
+    # Rows are fetched lazily, one page at a time, as the caller iterates. 
+    chunks = chunked_query.timeChunks(start, end, chunked_query.chunkSize(start, end))
+    rows = chunked_query.runChunked(
+        clients.bigquery(), 
+        [windowQuery(*chunk) for chunk in chunks], 
+        page_size=REQUEST_DATA_PAGE_SIZE
+    )
     
     # # break on empty iterator
     if rows.total_rows == 0:
         raise NoDataError("No data returned.", status_code=222)
-        
-    # # Convert Response object (generator) to list-of-dicts
-    data = [dict(r) for r in rows]
 
-    # # Clean data and apply correction factors
-    # data = utils.tuneAllFields(data, fields, removeNulls=removeNulls)
+    # Large extracts are read as Arrow through the Storage Read API, 
+    # which is much faster than paging through REST
+    if rows.total_rows >= STORAGE_READ_MIN_ROWS:
+        rows = StorageRows(rows)
 
-    # Apply correction factors to data
-    
-    return data
+    # Clean data and apply correction factors, page by page
+    return _cleanRows(rows, fields, agg)
+
+
+def _cleanRows(rows, fields, agg=None):
+    """
+    Run `rows` through the columnar cleaning stage if any of `fields` 
+    needs it. Aggregates were already masked in SQL, so they are only 
+    corrected, and counts are left as they are.
+    """
+    if not set(fields) & set(utils.CLEANING_RULES):
+        return rows
+    if agg and agg[1] == 'count':
+        return rows
+    return stream_utils.CleanedRows(rows, fields, mask=not agg)
+
+
+# https://api.tetradsensors.com/estimates with a JSON body:
+# {"src": "slc_ut", "lat": [40.76, 40.77], "lon": [-111.89, -111.88], "time": ["2021-01-01T00:00:00Z", "2021-01-01T01:00:00Z"]}
+@app.route("/estimates", methods=["POST"], subdomain=getenv('SUBDOMAIN_API'))
+def estimates():
+    """
+    PM2.5 estimates at many (lat, lon, time) points, from the gaussian 
+    process model of one region over the hours around them. The model 
+    is cached (see ModelCache), so requests for the same region within 
+    a time bin share it. Arguments are in a JSON body:
+    @param: src       (required)  Region label with a bounding box
+    @param: lat       (required)  Array of latitudes
+    @param: lon       (required)  Array of longitudes
+    @param: time      (required)  Array of datetimes, in the format of /requestData 'start'
+    @param: elevation (optional)  Array of elevations in meters. Each defaults to the 
+                                  elevation of the nearest sensor
+    @param: variance  (optional)  false to only return the estimates, which is cheaper 
+                                  (e.g. for maps). Defaults to true
+    All arrays have one entry per point, at most GP_ESTIMATE_MAX_POINTS.
+    Points must be inside the region's box and span at most 
+    GP_ESTIMATE_MAX_HOURS. Returns {'PM2_5': [...], 'variance': [...]},
+    in the order of the points.
+    """
+
+    src, region, lats, lons, elevations, times, variance = _argParseEstimates(request.get_json(silent=True))
+
+    # The model covers the points' hours and enough on either side for
+    # the temporal kernel
+    padding = timedelta(hours=TIME_KERNEL_FACTOR_PADDING * GP_TIME_LENGTH_SCALE)
+    start, end = min(times) - padding, max(times) + padding
+    if end - start > timedelta(hours=GP_ESTIMATE_MAX_HOURS):
+        raise ArgumentError(f"Points must be within {GP_ESTIMATE_MAX_HOURS} hours of each other", status_code=400)
+
+    from tetrad import gaussian_model_utils
+    models = _modelCache()
+    key = models.makeKey(src, start, end, GP_LATLON_LENGTH_SCALE, GP_ELEVATION_LENGTH_SCALE, GP_TIME_LENGTH_SCALE,
+                         utils.REGISTRY.current.version)
+    model, time_offset = models.model(key, lambda: _estimateModel(src, region, *models.window(start, end)))
+
+    x, y = utils.localMeters(lats, lons, _regionOrigin(region))
+    if elevations is None:
+        elevations = _nearestElevations(model, x, y)
+    yPred, yVar = gaussian_model_utils.estimateBatch(
+        model, np.column_stack((x, y, elevations)), times, time_offset, return_variance=variance)
+
+    if not variance:
+        return jsonify({'PM2_5': yPred.tolist()}), 200
+    return jsonify({'PM2_5': yPred.tolist(), 'variance': yVar.tolist()}), 200
+
+
+def _argParseEstimates(body):
+    """The /estimates arguments from the JSON `body`, parsed and checked"""
+
+    args = [
+        'src',
+        'lat',
+        'lon',
+        'time',
+        'elevation',
+        'variance'
+    ]
+
+    req_args = [
+        'src',
+        'lat',
+        'lon',
+        'time'
+    ]
+
+    if not isinstance(body, dict):
+        raise ArgumentError("Request body must be a JSON object", status_code=400)
+    utils.verifyArgs(body, req_args, args)
+
+    src    = utils.argParseSources(str(body['src']), single_source=True)
+    region = utils.regions()['info'].get(src)
+    if region is None:
+        raise ArgumentError(f"Argument 'src' must be one of: {', '.join(utils.regions()['active'])}", status_code=400)
+
+    lats, lons = _argParsePoints(body['lat'], 'lat'), _argParsePoints(body['lon'], 'lon')
+    elevations = _argParsePoints(body['elevation'], 'elevation') if body.get('elevation') is not None else None
+    if not isinstance(body['time'], list):
+        raise ArgumentError("Argument 'time' must be an array of datetimes", status_code=400)
+    times = [utils.argParseDatetime(str(t)) for t in body['time']]
+    variance = body.get('variance', True)
+    if not isinstance(variance, bool):
+        raise ArgumentError("Argument 'variance' must be true or false", status_code=400)
+
+    if not 0 < len(lats) <= GP_ESTIMATE_MAX_POINTS:
+        raise ArgumentError(f"Between 1 and {GP_ESTIMATE_MAX_POINTS} points can be estimated at once", status_code=400)
+    if not (len(lats) == len(lons) == len(times) and (elevations is None or len(elevations) == len(lats))):
+        raise ArgumentError("Arguments 'lat', 'lon', 'time' and 'elevation' must have the same length", status_code=400)
+    if not np.all((lats >= region['lat_lo']) & (lats <= region['lat_hi']) & (lons >= region['lon_lo']) & (lons <= region['lon_hi'])):
+        raise ArgumentError(f"Points must be inside the bounding box of region '{src}'", status_code=400)
+    return src, region, lats, lons, elevations, times, variance
+
+
+def _argParsePoints(values, name):
+    """A JSON array of numbers as a float64 array"""
+    try:
+        values = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        values = None
+    if values is None or values.ndim != 1 or not np.all(np.isfinite(values)):
+        raise ArgumentError(f"Argument '{name}' must be an array of numbers", status_code=400)
+    return values
+
+
+@functools.lru_cache(maxsize=None)
+def _modelCache():
+    """
+    The fitted-model cache for /estimates, created on first use: the 
+    gaussian process code imports torch, which would slow every cold 
+    start
+    """
+    from tetrad.model_cache import ModelCache
+    return ModelCache()
+
+
+def _regionOrigin(region):
+    """Where utils.localMeters puts (0, 0) for a region: the center of its box"""
+    return {'lat': (region['lat_lo'] + region['lat_hi']) / 2, 'lon': (region['lon_lo'] + region['lon_hi']) / 2}
+
+
+def _estimateModel(src, region, start, end):
+    """
+    (model, time_offset) for ModelCache: the gaussian process fitted to
+    the region's corrected PM2.5 readings in [start, end]
+    """
+    from tetrad import gaussian_model_utils
+    fields = ["PM2_5", "ELEVATION"]
+    box = {k: region[k] for k in ('lat_hi', 'lat_lo', 'lon_hi', 'lon_lo')}
+    located = device_registry.locate(start, bbox=box)
+
+    windowQuery = query_builder.telemetryQuery([src], fields, bbox=box, located=located)
+    _checkBudget([windowQuery(start, end, True)], start, end, False)
+    rows = _requestData([src], fields, start, end, bbox=box, located=located)
+
+    pm, elevation = FIELD_MAP["PM2_5"], FIELD_MAP["ELEVATION"]
+    sensor_data = [dict(r) for r in rows if r[pm] is not None]
+    sensor_data = utils.removeInvalidSensors(sensor_data)
+    if not sensor_data:
+        raise NoDataError("No data returned.", status_code=222)
+
+    # Devices that don't report an elevation get the median of those that do
+    known = [datum[elevation] for datum in sensor_data if datum[elevation] is not None]
+    fill = float(np.median(known)) if known else 0.
+    x, y = utils.localMeters(
+        [datum['Latitude'] for datum in sensor_data], [datum['Longitude'] for datum in sensor_data], _regionOrigin(region))
+    for datum, utm_x, utm_y in zip(sensor_data, x.tolist(), y.tolist()):
+        datum['utm_x'], datum['utm_y'] = utm_x, utm_y
+        if datum[elevation] is None:
+            datum[elevation] = fill
+
+    return gaussian_model_utils.createModel(
+        sensor_data, GP_LATLON_LENGTH_SCALE, GP_ELEVATION_LENGTH_SCALE, GP_TIME_LENGTH_SCALE)
+
+
+def _nearestElevations(model, x, y):
+    """Elevation of the model's nearest sensor to each point"""
+    from scipy.spatial import cKDTree
+    sensors = model.space_coordinates.numpy()
+    _, nearest = cKDTree(sensors[:, :2]).query(np.column_stack((x, y)))
+    return sensors[nearest, 2]
+
+
+@app.route("/cacheStats", methods=["GET"], subdomain=getenv('SUBDOMAIN_API'))
+def cacheStats():
+    """Hit/miss counters for the /requestData and /estimates caches (this instance only)"""
+    stats = {'results': result_cache.stats(), 'buckets': bucket_cache.stats()}
+    # Don't create the model cache (and import torch) just to report on it
+    if _modelCache.cache_info().currsize:
+        stats['models'] = _modelCache().stats()
+    return jsonify(stats), 200
 
 
 @app.route("/nickname", methods=["GET"], subdomain=getenv('SUBDOMAIN_API'))
@@ -355,16 +632,7 @@ def nickname():
         raise
 
     # Perform the UPDATE query
-    query = f'''
-    UPDATE
-        `{PROJECT_ID}.{getenv('BQ_DATASET_META')}.{getenv('BQ_TABLE_META_DEVICES')}`
-    SET
-        {getenv('FIELD_NN')} = "{nickname}"
-    WHERE
-        {getenv('FIELD_ID')} = "{device}"
-    '''
-
-    print(query)
-    bq_client.query(query)
+    query, job_config = query_builder.nicknameQuery(device, nickname)
+    clients.bigquery().query(query, job_config=job_config)
 
     return 'success', 200
@@ -6,10 +6,6 @@ import json
 from functools import wraps
 # from firebase_admin import credentials, auth
 from flask import Flask, request
-import google.cloud.logging 
-gcloud_logging_client = google.cloud.logging.Client()
-gcloud_logging_client.get_default_handler()
-gcloud_logging_client.setup_logging()
 import logging
 logging.error("Inside basic_routes.py")
 
@@ -0,0 +1,218 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import threading
+import pytz
+from tetrad import chunked_query
+from tetrad.result_cache import CachedRows
+from tetrad.api_consts import *
+
+
+HOUR = timedelta(hours=1)
+
+
+def floorHour(t):
+    return t.replace(minute=0, second=0, microsecond=0)
+
+
+class BucketRows:
+    """
+    A /requestData result assembled from hourly buckets. Exposes the
+    same parts of RowIterator as ChunkedRows. `pages` yields one page
+    per hour, in order, fetching missing hours as it reaches them.
+    """
+
+    def __init__(self, schema, total_rows, pages, cache_status):
+        self.schema = schema
+        self.total_rows = total_rows
+        self._pages = pages
+        self.cache_status = cache_status
+
+    @property
+    def pages(self):
+        return self._pages
+
+    def __iter__(self):
+        for page in self.pages:
+            for row in page:
+                yield row
+
+
+class HourBucketCache:
+    """
+    Telemetry rows cached in fixed one-hour (UTC) buckets keyed by
+    (labels, field set, registry version, hour). The registry version
+    is part of the key since 'allgps' and region labels are resolved
+    with the region polygons it holds. A request only fetches the hours it
+    doesn't have, plus hours that are still open: an hour is closed,
+    and kept, once it ended more than RESULT_CACHE_SETTLE_MINUTES ago.
+    LRU eviction keeps at most BUCKET_CACHE_MAX_ROWS rows.
+    """
+
+    def __init__(self, max_rows=BUCKET_CACHE_MAX_ROWS, settle_minutes=RESULT_CACHE_SETTLE_MINUTES):
+        self.max_rows = max_rows
+        self.settle = timedelta(minutes=settle_minutes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._rows_held = 0
+        self._buckets = OrderedDict()  # (labels, fields, version, hour) -> [Row]
+        self._schemas = {}             # (labels, fields, version) -> schema
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def seriesKey(srcs, fields, version=None):
+        return (tuple(sorted(srcs)), tuple(sorted(fields)), version)
+
+    def isClosed(self, hour):
+        return hour + HOUR <= datetime.now(pytz.utc) - self.settle
+
+    def rows(self, srcs, fields, start, end, fetch, version=None):
+        """
+        Rows for [start, end] in timestamp order.
+        `fetch(windows)` must run one query per [lo, hi) window for this
+        series and return their RowIterators (jobs done, rows not yet read).
+        `version` is utils.REGISTRY.current.version.
+        """
+        series = self.seriesKey(srcs, fields, version)
+        # Rows are bucketed by their UTC hour, so the request must be too
+        start, end = start.astimezone(pytz.utc), end.astimezone(pytz.utc)
+        hours = self._hours(start, end)
+
+        cached, missing = {}, []
+        with self._lock:
+            for hour in hours:
+                bucket = self._buckets.get(series + (hour,))
+                if bucket is not None:
+                    self._buckets.move_to_end(series + (hour,))
+                    cached[hour] = bucket
+                    self.hits += 1
+                else:
+                    missing.append(hour)
+                    self.misses += 1
+
+        # Contiguous runs of missing hours, split into day/week windows
+        # so long cold ranges still run in parallel. The first and last
+        # hour get windows of their own: they're read up front, so the
+        # rows outside [start, end] aren't counted in total_rows
+        edges = {hours[0], hours[-1]}
+        windows = [(hour, hour + HOUR) for hour in missing if hour in edges]
+        for lo, hi in self._runs([hour for hour in missing if hour not in edges]):
+            windows += [(a, b) for a, b, _ in chunked_query.timeChunks(lo, hi, chunked_query.chunkSize(lo, hi))]
+        windows.sort()
+        fetched = fetch(windows) if windows else []
+
+        if fetched:
+            self._schemas[series] = fetched[0].schema
+        schema = self._schemas.get(series)
+
+        total_rows = sum(len(self._trim(bucket, hour, start, end)) for hour, bucket in cached.items())
+        for i, ((lo, _), it) in enumerate(zip(windows, fetched)):
+            if lo in edges:
+                rows = list(it)
+                fetched[i] = CachedRows(it.schema, [rows])
+                total_rows += len(self._trim(rows, lo, start, end))
+            else:
+                total_rows += it.total_rows or 0
+        if not missing:
+            cache_status = 'HIT'
+        elif cached:
+            cache_status = 'PARTIAL'
+        else:
+            cache_status = 'MISS'
+
+        pages = self._pages(series, hours, cached, self._splitHours(fetched), start, end)
+        return BucketRows(schema, total_rows, pages, cache_status)
+
+    def missingWindows(self, srcs, fields, start, end, version=None):
+        """
+        The [lo, hi) windows rows() would have to fetch for [start, end]
+        right now. Doesn't count as a hit or miss.
+        """
+        series = self.seriesKey(srcs, fields, version)
+        start, end = start.astimezone(pytz.utc), end.astimezone(pytz.utc)
+        with self._lock:
+            missing = [h for h in self._hours(start, end) if series + (h,) not in self._buckets]
+        return self._runs(missing)
+
+    @staticmethod
+    def _hours(start, end):
+        hours = []
+        hour = floorHour(start)
+        while hour <= end:
+            hours.append(hour)
+            hour += HOUR
+        return hours
+
+    @staticmethod
+    def _runs(hours):
+        """[h0, h1, h2, h5] -> [(h0, h3), (h5, h6)] as [lo, hi) ranges"""
+        runs = []
+        for hour in hours:
+            if runs and runs[-1][1] == hour:
+                runs[-1][1] = hour + HOUR
+            else:
+                runs.append([hour, hour + HOUR])
+        return [tuple(run) for run in runs]
+
+    @staticmethod
+    def _splitHours(fetched):
+        """Group the (sorted) fetched rows into (hour, [Row]) in order"""
+        hour, bucket = None, []
+        for it in fetched:
+            for page in it.pages:
+                for row in page:
+                    row_hour = floorHour(row[FIELD_MAP["TIMESTAMP"]])
+                    if row_hour != hour:
+                        if bucket:
+                            yield hour, bucket
+                        hour, bucket = row_hour, []
+                    bucket.append(row)
+        if bucket:
+            yield hour, bucket
+
+    def _pages(self, series, hours, cached, fetched_hours, start, end):
+        pending = next(fetched_hours, None)
+        for hour in hours:
+            if hour in cached:
+                bucket = cached[hour]
+            else:
+                # Hours with no rows come back as no group at all
+                bucket = []
+                if pending is not None and pending[0] == hour:
+                    bucket = pending[1]
+                    pending = next(fetched_hours, None)
+                if self.isClosed(hour):
+                    self._put(series + (hour,), bucket)
+
+            yield self._trim(bucket, hour, start, end)
+
+    @staticmethod
+    def _trim(bucket, hour, start, end):
+        """The rows of `hour`'s bucket within [start, end]"""
+        # Only the first and last hour can stick out of [start, end]
+        if hour < start or hour + HOUR > end:
+            return [r for r in bucket if start <= r[FIELD_MAP["TIMESTAMP"]] <= end]
+        return bucket
+
+    def _put(self, key, bucket):
+        with self._lock:
+            if key in self._buckets:
+                return
+            self._buckets[key] = bucket
+            # Empty hours count as one row so they're bounded too
+            self._rows_held += max(1, len(bucket))
+            while self._rows_held > self.max_rows:
+                _, evicted = self._buckets.popitem(last=False)
+                self._rows_held -= max(1, len(evicted))
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'buckets': len(self._buckets),
+                'rows': self._rows_held,
+                'max_rows': self.max_rows,
+            }
@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import pytz
+from tetrad.api_consts import *
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+# Shared by every request in this process, so the number of
+# concurrent BigQuery jobs per instance stays bounded
+query_pool = ThreadPoolExecutor(max_workers=REQUEST_DATA_MAX_WORKERS, thread_name_prefix="bq-chunk")
+
+
+def chunkSize(start, end):
+    """
+    None for short ranges (run as one query), one day for
+    ranges up to CHUNK_WEEKS_AFTER_DAYS, one week beyond that
+    """
+    span = end - start
+    if span <= timedelta(hours=CHUNK_MIN_RANGE_HOURS):
+        return None
+    elif span <= timedelta(days=CHUNK_WEEKS_AFTER_DAYS):
+        return timedelta(days=1)
+    else:
+        return timedelta(weeks=1)
+
+
+def timeChunks(start, end, size):
+    """
+    Split [start, end] into consecutive windows on `size` boundaries
+    (counted from the epoch, so day chunks start at UTC midnight).
+    Returns a list of (lo, hi, hi_inclusive): every window is [lo, hi)
+    except the last, which is [lo, end] like the original range.
+    """
+    if size is None:
+        return [(start, end, True)]
+
+    chunks = []
+    lo = start
+    hi = EPOCH + ((start - EPOCH) // size + 1) * size
+    while hi < end:
+        chunks.append((lo, hi, False))
+        lo, hi = hi, hi + size
+    chunks.append((lo, end, True))
+    return chunks
+
+
+class ChunkedRows:
+    """
+    Stitches the RowIterators of consecutive time chunks back into one
+    result. Each chunk is already sorted, and chunks are kept in time
+    order, so the pages come out in timestamp order without a global sort.
+    Exposes the parts of RowIterator that the response writers use.
+    """
+
+    def __init__(self, iterators, jobs=None):
+        self.iterators = iterators
+        self.jobs = jobs
+
+    @property
+    def schema(self):
+        return self.iterators[0].schema
+
+    @property
+    def total_rows(self):
+        return sum(it.total_rows or 0 for it in self.iterators)
+
+    @property
+    def pages(self):
+        for it in self.iterators:
+            for page in it.pages:
+                yield page
+
+    def __iter__(self):
+        for page in self.pages:
+            for row in page:
+                yield row
+
+
+def runChunked(bq_client, queries, page_size):
+    """
+    Run each (sql, job_config) on the shared pool and wait for every job to finish.
+    Rows are not downloaded here; they are paged in lazily, chunk by
+    chunk, as the ChunkedRows is iterated.
+    """
+    def run(query):
+        sql, job_config = query
+        job = bq_client.query(sql, job_config=job_config)
+        return job, job.result(page_size=page_size)
+
+    futures = [query_pool.submit(run, q) for q in queries]
+    jobs, iterators = zip(*[f.result() for f in futures])
+    return ChunkedRows(list(iterators), list(jobs))
@@ -0,0 +1,109 @@
+# Google Cloud and Firebase clients, shared by the whole process.
+#
+# Each client is created on first use, never at import, and only once:
+# modules call e.g. clients.bigquery() wherever they need one. The
+# client libraries are imported inside the factories too, so a module
+# that never needs a client never pays for importing it. warmUp()
+# creates some of them in a background thread at startup, so the first
+# request usually finds them ready without the instance waiting on them
+# before it can serve.
+import functools
+import threading
+from time import perf_counter
+from tetrad.api_consts import *
+import logging
+
+
+# Seconds each client took to create, for tools/startup_profile.py
+TIMINGS = {}
+
+_clients = {}
+
+
+def shared(factory):
+    """Run `factory` once, on first call; later calls return what it returned"""
+    name = factory.__name__
+    # One lock per client, so a slow one doesn't hold up the others
+    lock = threading.Lock()
+
+    @functools.wraps(factory)
+    def get():
+        try:
+            return _clients[name]
+        except KeyError:
+            pass
+        with lock:
+            if name not in _clients:
+                t0 = perf_counter()
+                _clients[name] = factory()
+                TIMINGS[name] = perf_counter() - t0
+            return _clients[name]
+    return get
+
+
+@shared
+def cloudLogging():
+    """Route the `logging` module to Cloud Logging"""
+    import google.cloud.logging
+    client = google.cloud.logging.Client()
+    client.get_default_handler()
+    client.setup_logging()
+    return client
+
+
+@shared
+def bigquery():
+    from google.cloud.bigquery import Client
+    return Client()
+
+
+@shared
+def bigqueryRead():
+    from google.cloud.bigquery_storage import BigQueryReadClient
+    return BigQueryReadClient()
+
+
+@shared
+def storage():
+    from google.cloud.storage import Client
+    return Client()
+
+
+@shared
+def firestore():
+    from google.cloud.firestore import Client
+    return Client()
+
+
+@shared
+def secretManager():
+    from google.cloud.secretmanager import SecretManagerServiceClient
+    return SecretManagerServiceClient()
+
+
+@shared
+def firebaseApp():
+    from firebase_admin import initialize_app
+    return initialize_app()
+
+
+def firebaseAuth():
+    """firebase_admin.auth, with the default app initialized"""
+    firebaseApp()
+    from firebase_admin import auth
+    return auth
+
+
+def warmUp(names=STARTUP_WARM_CLIENTS):
+    """Create the clients in `names` (factory names above) in a background thread"""
+    factories = [globals()[name] for name in names]
+
+    def run():
+        for factory in factories:
+            try:
+                factory()
+            except Exception as e:
+                logging.error(f"Warming up client '{factory.__name__}' failed: {e!r}")
+
+    if factories:
+        threading.Thread(target=run, name="warm-clients", daemon=True).start()
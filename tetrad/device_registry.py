@@ -0,0 +1,190 @@
+from datetime import datetime, timedelta
+import math
+import threading
+from time import sleep
+import numpy as np
+import pytz
+from tetrad import utils, clients, query_builder
+from tetrad.api_consts import *
+import logging
+
+
+class DeviceIndex:
+    """
+    Immutable snapshot of where each device reported from in
+    [since, until): the extent (lat_lo, lat_hi, lon_lo, lon_hi) of its
+    GPS fixes and its latest fix. Extents are indexed in a uniform grid
+    of `cell_degrees` cells; devices whose extent spans more than
+    DEVICE_REGISTRY_MAX_CELLS cells (mobile sensors) are kept aside and
+    always checked.
+    """
+
+    def __init__(self, devices, since, until, cell_degrees=DEVICE_REGISTRY_CELL_DEGREES):
+        self.devices = devices
+        self.since = since
+        self.until = until
+        self.cell_degrees = cell_degrees
+        self.ids = np.array(list(devices), dtype=object)
+
+        extents = np.array(
+            [(d['lat_lo'], d['lat_hi'], d['lon_lo'], d['lon_hi']) for d in devices.values()],
+            dtype=np.float64
+        ).reshape(-1, 4)
+        self.lat_lo, self.lat_hi, self.lon_lo, self.lon_hi = extents.T
+
+        cells, wide = {}, []
+        for i, (r0, c0, r1, c1) in enumerate(zip(*self._cell(self.lat_lo, self.lon_lo), *self._cell(self.lat_hi, self.lon_hi))):
+            if (r1 - r0 + 1) * (c1 - c0 + 1) > DEVICE_REGISTRY_MAX_CELLS:
+                wide.append(i)
+                continue
+            for r in range(r0, r1 + 1):
+                for c in range(c0, c1 + 1):
+                    cells.setdefault((r, c), []).append(i)
+        self.cells = {cell: np.array(members, dtype=np.intp) for cell, members in cells.items()}
+        self.wide = np.array(wide, dtype=np.intp)
+
+    def _cell(self, lat, lon):
+        """Grid (row, column) of coordinates, scalars or arrays"""
+        return (
+            np.floor_divide(np.add(lat, 90), self.cell_degrees).astype(int),
+            np.floor_divide(np.add(lon, 180), self.cell_degrees).astype(int),
+        )
+
+    def inBox(self, lat_lo, lat_hi, lon_lo, lon_hi):
+        """Indices of the devices whose extent overlaps the box"""
+        (r0, c0), (r1, c1) = self._cell(lat_lo, lon_lo), self._cell(lat_hi, lon_hi)
+        if (r1 - r0 + 1) * (c1 - c0 + 1) > len(self.cells):
+            # Cheaper to check every device than to walk the cells
+            candidates = np.arange(len(self.ids))
+        else:
+            candidates = np.unique(np.concatenate([self.wide] + [
+                self.cells[(r, c)]
+                for r in range(r0, r1 + 1)
+                for c in range(c0, c1 + 1)
+                if (r, c) in self.cells
+            ]))
+
+        overlap = (
+            (self.lat_lo[candidates] <= lat_hi) & (self.lat_hi[candidates] >= lat_lo) &
+            (self.lon_lo[candidates] <= lon_hi) & (self.lon_hi[candidates] >= lon_lo)
+        )
+        return candidates[overlap]
+
+
+def _geodesicLatRange(bbox):
+    """
+    Latitude range of the polygon query_builder builds for `bbox`. Its
+    east-west edges are geodesics, which bow toward the nearer pole.
+    """
+    half_width = math.radians(bbox['lon_hi'] - bbox['lon_lo']) / 2
+    if half_width >= math.pi / 2:
+        bow = lambda lat: math.copysign(90, lat)
+    else:
+        bow = lambda lat: math.degrees(math.atan(math.tan(math.radians(lat)) / math.cos(half_width)))
+    lat_hi = bow(bbox['lat_hi']) if bbox['lat_hi'] > 0 else bbox['lat_hi']
+    lat_lo = bow(bbox['lat_lo']) if bbox['lat_lo'] < 0 else bbox['lat_lo']
+    return lat_lo, lat_hi
+
+
+def _radiusBoxes(radius, center):
+    """Boxes (lat_lo, lat_hi, lon_lo, lon_hi) that cover the circle, split at the antimeridian"""
+    dlat, dlon = utils.radiusBounds(radius, center)
+    lat_lo, lat_hi = max(center['lat'] - dlat, -90), min(center['lat'] + dlat, 90)
+    if dlon is None or dlon >= 180:
+        return [(lat_lo, lat_hi, -180, 180)]
+
+    lon_lo, lon_hi = center['lon'] - dlon, center['lon'] + dlon
+    if lon_lo < -180:
+        return [(lat_lo, lat_hi, lon_lo + 360, 180), (lat_lo, lat_hi, -180, lon_hi)]
+    elif lon_hi > 180:
+        return [(lat_lo, lat_hi, lon_lo, 180), (lat_lo, lat_hi, -180, lon_hi - 360)]
+    return [(lat_lo, lat_hi, lon_lo, lon_hi)]
+
+
+class DeviceRegistry:
+    """
+    Where every device has reported from, kept in memory as a
+    DeviceIndex and refreshed every `refresh_seconds` by a single
+    background thread. The first refresh looks back `lookback_days`;
+    later ones only query the rows since the last one and widen the
+    extents. The newest RESULT_CACHE_SETTLE_MINUTES are queried again
+    each time, since late rows may still arrive for them.
+
+    locate() turns a box or radius into the few devices that can have
+    rows inside it, so /requestData can add a DeviceID filter that
+    BigQuery prunes clustered blocks with. The geography predicate
+    still runs, but only over those devices' rows.
+    """
+
+    def __init__(self, bq_client=None, refresh_seconds=DEVICE_REGISTRY_REFRESH_SECONDS,
+                 lookback_days=DEVICE_REGISTRY_LOOKBACK_DAYS, max_ids=DEVICE_REGISTRY_MAX_IDS,
+                 settle_minutes=RESULT_CACHE_SETTLE_MINUTES):
+        self.bq_client = bq_client
+        self.refresh_seconds = refresh_seconds
+        self.lookback = timedelta(days=lookback_days)
+        self.max_ids = max_ids
+        self.settle = timedelta(minutes=settle_minutes)
+        self.index = None
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Start the refresh thread (once per process)"""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="device-registry", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"Device registry refresh failed: {e!r}")
+            sleep(self.refresh_seconds)
+
+    def refresh(self):
+        now = datetime.now(pytz.utc)
+        index = self.index
+        since = index.until if index else now - self.lookback
+        query, job_config = query_builder.deviceLocationsQuery(since, now)
+        rows = (self.bq_client or clients.bigquery()).query(query, job_config=job_config).result()
+
+        devices = dict(index.devices) if index else {}
+        updated = 0
+        for row in rows:
+            device = dict(row)
+            device_id = device.pop(FIELD_MAP["DEVICEID"])
+            old = devices.get(device_id)
+            if old is not None:
+                device['lat_lo'] = min(device['lat_lo'], old['lat_lo'])
+                device['lat_hi'] = max(device['lat_hi'], old['lat_hi'])
+                device['lon_lo'] = min(device['lon_lo'], old['lon_lo'])
+                device['lon_hi'] = max(device['lon_hi'], old['lon_hi'])
+            devices[device_id] = device
+            updated += 1
+
+        self.index = DeviceIndex(devices, index.since if index else since, now - self.settle)
+        logging.info(f"Device registry: {len(devices)} devices, {updated} updated")
+
+    def locate(self, start, bbox=None, radius=None, center=None):
+        """
+        (ids, until) for query_builder.telemetryQuery's `located`: the
+        devices that reported from inside the box or radius at some time
+        in [start, until). None if the registry doesn't cover `start`
+        (or isn't loaded yet), or the list would be too long to help.
+        """
+        index = self.index
+        if index is None or start < index.since:
+            return None
+
+        if bbox:
+            lat_lo, lat_hi = _geodesicLatRange(bbox)
+            boxes = [(lat_lo, lat_hi, bbox['lon_lo'], bbox['lon_hi'])]
+        else:
+            boxes = _radiusBoxes(radius, center)
+        indices = np.unique(np.concatenate([index.inBox(*box) for box in boxes]))
+
+        if len(indices) > self.max_ids:
+            return None
+        return sorted(index.ids[indices]), index.until
@@ -1,13 +1,8 @@
-from firebase_admin import auth#, initialize_app
 from flask import request, send_file
-from tetrad import app, admin_utils
+from tetrad import app, admin_utils, clients
 import traceback 
 from os import getenv
 from io import BytesIO
-import google.cloud.logging
-gcloud_logging_client = google.cloud.logging.Client()
-gcloud_logging_client.get_default_handler()
-gcloud_logging_client.setup_logging()
 import logging
 
 
@@ -28,7 +23,7 @@ def signup():
     if not admin_utils.check_password(password):
         return 'ERROR: Invalid password. Password must be at least 8 characters and include: [a-z], [A-Z], [0-9], [@$!#%*?&]', 400
     try:
-        user = auth.create_user(
+        user = clients.firebaseAuth().create_user(
                email=email,
                password=password
         )
@@ -8,12 +8,17 @@
 #
 # v02: modual version of v01_2
 # %%
+from collections import OrderedDict
+import hashlib
+import threading
 import torch
+import torch.fft
 import torch.nn as nn
 import numpy as np
 import math
 import scipy
-from scipy.fft import fft
+from scipy.fft import fft, rfft
+from tetrad.api_consts import *
 
 
 
@@ -28,16 +33,14 @@ JITTER = 1e-6
 # efficient matrix multiply with diagonal matrix -- I cannot believe torch doesn't have this.
 def diagMultTorchLeft(diag_vector, matrix):
     rows = diag_vector.shape[0]
-    cols = matrix.shape[1]
 #    print(diag_vector.shape)
 #    print(matrix.shape)
     if (rows != matrix.shape[0]):
         print("RunTimeError: bad entries for diagonal matrix multiply")
         return torch.zeros([0])
 
-    result = torch.zeros([rows,cols],dtype=torch.float64)
-    for i in range(rows):
-        result[i, :] = diag_vector[i]*matrix[i, :]
+    # scale row i by diag_vector[i], broadcast in one step
+    result = diag_vector.view(rows, 1).to(torch.float64) * matrix
 #    print(result.shape)
     return result
 
@@ -122,6 +125,46 @@ def symCirculantMatrixEigen(vector):
     return(v_fft, array)
 
 
+
+# The eigenvalues that go with symCirculantMatrixEigen's eigenvectors, without building them
+def symCirculantEigenvalues(vector):
+    size = vector.shape[0]
+    v_rfft = np.real(rfft(vector))
+    return(np.concatenate([v_rfft, v_rfft[1:(size+1)//2][::-1]]))
+
+# Column scales of symCirculantMatrixEigen's eigenvectors: sqrt(2/size), except the constant
+# column (and the high-freq one, in the even case), which are 1/sqrt(size)
+def _realFourierScales(size):
+    scales = torch.full([size], math.sqrt(2./size), dtype=torch.float64)
+    scales[0] = 1./math.sqrt(size)
+    if (size % 2) == 0:
+        scales[size//2] = 1./math.sqrt(size)
+    return(scales)
+
+# eigenvectors.t() @ matrix, where eigenvectors is symCirculantMatrixEigen's for this size,
+# using a real FFT down the columns: O(size log size) per column instead of O(size^2), and the
+# eigenvector matrix is never built.  Column i <= size/2 is the cosine at frequency i, and
+# column size-i the (negated) sine, so the result is the real and imaginary parts of the rfft.
+def realFourierTranspose(matrix):
+    size = matrix.shape[0]
+    half = (size+1)//2
+    coefficients = torch.fft.rfft(matrix, dim=0)
+    result = torch.cat([coefficients.real, -coefficients.imag[1:half].flip(0)], dim=0)
+    return(_realFourierScales(size).view(-1, 1) * result)
+
+# eigenvectors @ matrix, the inverse of realFourierTranspose (the eigenvectors are orthonormal)
+def realFourierApply(matrix):
+    size = matrix.shape[0]
+    half = (size+1)//2
+    matrix = matrix / _realFourierScales(size).view(-1, 1)
+    # the constant and (in the even case) high-freq coefficients are real
+    imag = torch.cat([
+        torch.zeros_like(matrix[:1]),
+        -matrix[size-half+1:].flip(0),
+        torch.zeros_like(matrix[:size//2+1-half]),
+    ], dim=0)
+    return(torch.fft.irfft(torch.complex(matrix[:size//2+1], imag), n=size, dim=0))
+
 ####  end of code to support circulant matrices
 
 def kronecker(A, B):
@@ -147,6 +190,66 @@ def combinations(A, B):
     return torch.cat((A1, B1), dim=1)
 
 
+class SpatialEigenCache:
+    """
+    LRU cache of spatial kernel eigenpairs, shared by every model in the
+    process. The spatial kernel only depends on the sensor positions and
+    the lat/lon and elevation length scales, which rarely change between
+    consecutive estimates over a region, so its O(S^3) decomposition
+    runs once per configuration instead of once per model. Keeps at
+    most GP_SPATIAL_EIGEN_CACHE_SIZE entries; entries are detached, so
+    training bypasses the cache (see gaussian_model.update).
+    """
+
+    def __init__(self, max_entries=GP_SPATIAL_EIGEN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (eigen_value_s, eigen_vector_s)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(space_coordinates, log_latlon_length_scale, log_elevation_length_scale):
+        coordinates = space_coordinates.detach().contiguous().numpy()
+        digest = hashlib.sha1(coordinates.tobytes()).hexdigest()
+        return (digest, coordinates.shape, str(coordinates.dtype),
+                float(log_latlon_length_scale.detach()), float(log_elevation_length_scale.detach()))
+
+    def get(self, key, decompose):
+        """The eigenpairs for `key`, from `decompose()` on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        # Decompose outside the lock, so one slow miss doesn't hold up other keys
+        entry = tuple(t.detach() for t in decompose())
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+            }
+
+
+SPATIAL_EIGEN_CACHE = SpatialEigenCache()
+
+
 # USAGE sequence for this class
 # 1) constructor (with sensor data)
 # 2) forward
@@ -202,14 +305,22 @@ class gaussian_model(nn.Module):
         K = torch.exp(K/(-2.)) * 1.0
         return K
 
-    def update(self):
+    def spatialEigen(self):
         latlon_kernel = self.SE_kernel(self.space_coordinates[:, 0:2], self.space_coordinates[:, 0:2],
                                         torch.exp(self.log_latlon_length_scale))
         elevation_kernel = self.SE_kernel(self.space_coordinates[:, 2:3], self.space_coordinates[:, 2:3],
                                           torch.exp(self.log_elevation_length_scale))
         spatial_kernel = latlon_kernel * elevation_kernel + torch.eye(latlon_kernel.size(0)) * JITTER
 
-        eigen_value_s, eigen_vector_s = torch.symeig(spatial_kernel, eigenvectors=True)
+        return torch.symeig(spatial_kernel, eigenvectors=True)
+
+    # use_cache=False recomputes the spatial eigenpairs with their gradients, for training
+    def update(self, use_cache=True):
+        if use_cache:
+            key = SPATIAL_EIGEN_CACHE.key(self.space_coordinates, self.log_latlon_length_scale, self.log_elevation_length_scale)
+            eigen_value_s, eigen_vector_s = SPATIAL_EIGEN_CACHE.get(key, self.spatialEigen)
+        else:
+            eigen_value_s, eigen_vector_s = self.spatialEigen()
         
         if not self.time_structured:
             temporal_kernel = self.SE_kernel(
@@ -241,21 +352,25 @@ class gaussian_model(nn.Module):
                                                              # express the length in terms of bins
                                                              torch.exp(self.log_time_length_scale)/delta_time)
 #            print("about to do circ eigen")
-            eigen_value_t_np, eigen_vector_t_np = symCirculantMatrixEigen(temporal_kernel_vector)
+            # the eigenvectors are those of symCirculantMatrixEigen, but they are never built:
+            # realFourierTranspose/realFourierApply multiply by them with an FFT
+            eigen_value_t = torch.from_numpy(symCirculantEigenvalues(temporal_kernel_vector))
 #            print("done circ eigen")
 
-            eigen_value_t = torch.from_numpy(eigen_value_t_np)
-            eigen_vector_t = torch.from_numpy(eigen_vector_t_np)
-#            print("temp inversion")
-# this is a test to make sure they are eigen vectors            
-#            print(eigen_vector_t_np.transpose()@temporal_kernel@eigen_vector_t_np)                
-
 
-            self.eigen_vector_st = kronecker(eigen_vector_t, eigen_vector_s)
+            # The space-time eigenvectors are kron(eigen_vector_t, eigen_vector_s), a dense (T*S)x(T*S)
+            # matrix. It is never formed: with y = stData flattened time-major (index t*S + s),
+            # kron(A, B) @ y == (A @ Y @ B.t()).reshape(-1) where Y = y.view(T, S).
+            self.eigen_value_t = eigen_value_t
+            self.eigen_value_s, self.eigen_vector_s = eigen_value_s, eigen_vector_s
 #            eigen_value_st = kronecker(eigen_value_t.view(-1, 1), eigen_value_s.view(-1, 1)).view(-1)
             self.eigen_value_st = kronecker(eigen_value_t.view(-1, 1), eigen_value_s.view(-1, 1)).view(-1)
 #            print("done kronecker products")
             self.eigen_value_st_plus_noise_inverse = 1. / (self.log_signal_variance.exp()*self.eigen_value_st + torch.exp(self.log_noise_variance))
+            # alpha = sigma_inverse @ y = E @ diag(1/(eigenvalues + noise)) @ E.t() @ y, with E the Kronecker product above
+            inverse = self.eigen_value_st_plus_noise_inverse.view(eigen_value_t.size(0), eigen_value_s.size(0))
+            weights = inverse * (realFourierTranspose(self.stData.transpose(-2, -1)) @ eigen_vector_s)
+            self.alpha = (realFourierApply(weights) @ eigen_vector_s.t()).reshape(-1, 1)
 #            sigma_inverse = eigen_vector_st @ eigen_value_st_plus_noise_inverse.diag_embed() @ (eigen_vector_st.transpose(-2, -1))
 #            self.K = eigen_vector_st @ eigen_value_st.diag_embed() @ eigen_vector_st.transpose(-2, -1)
 #            print("done computing vectors")
@@ -270,51 +385,85 @@ class gaussian_model(nn.Module):
 #        self.alpha = sigma_inverse @ self.stData.transpose(-2, -1).reshape(-1, 1)
 #        self.eigen_value_st = eigen_value_st
 
-    def forward(self, test_space_coordinates, test_time_coordinates):
-        with torch.no_grad():
-            test_latlon_kernel = self.SE_kernel(test_space_coordinates[:, 0:2], self.space_coordinates[:, 0:2],
-                                                 torch.exp(self.log_latlon_length_scale))
-            test_elevation_kernel = self.SE_kernel(test_space_coordinates[:, 2:3], self.space_coordinates[:, 2:3],
-                                                   torch.exp(self.log_elevation_length_scale))
-            test_spatial_kernel = test_latlon_kernel * test_elevation_kernel
+    # kernels between the test and the measured locations, and the test and the measured times
+    def testKernels(self, test_space_coordinates, test_time_coordinates):
+        test_latlon_kernel = self.SE_kernel(test_space_coordinates[:, 0:2], self.space_coordinates[:, 0:2],
+                                             torch.exp(self.log_latlon_length_scale))
+        test_elevation_kernel = self.SE_kernel(test_space_coordinates[:, 2:3], self.space_coordinates[:, 2:3],
+                                               torch.exp(self.log_elevation_length_scale))
+        test_spatial_kernel = test_latlon_kernel * test_elevation_kernel
 
-            test_temporal_kernel = self.SE_kernel(test_time_coordinates, self.time_coordinates,
-                                                  torch.exp(self.log_time_length_scale))
+        test_temporal_kernel = self.SE_kernel(test_time_coordinates, self.time_coordinates,
+                                              torch.exp(self.log_time_length_scale))
+        return test_spatial_kernel, test_temporal_kernel
+
+    # return_variance=False skips the variance (yVar is None), for callers that only need the mean
+    def forward(self, test_space_coordinates, test_time_coordinates, return_variance=True):
+        with torch.no_grad():
+            test_spatial_kernel, test_temporal_kernel = self.testKernels(test_space_coordinates, test_time_coordinates)
 
-            test_st_kernel = self.log_signal_variance.exp()*kronecker(test_temporal_kernel, test_spatial_kernel)
             # alpha is the kernel inverse times the measurements that were taken already
             #        self.alpha = sigma_inverse @ self.stData.transpose(-2, -1).reshape(-1, 1)
             if self.time_structured==True:
-                sigma_diag = diagMultTorchLeft(self.eigen_value_st_plus_noise_inverse, ((self.eigen_vector_st).transpose(-2, -1)@self.stData.transpose(-2, -1).reshape(-1, 1)))
-#                print("done with sigma_diag")
-                yPred = (test_st_kernel@self.eigen_vector_st)@sigma_diag
-#                print("done with yPred")
-                yVar = torch.zeros(test_st_kernel.size(0))
-                test_times_eigen = test_st_kernel@ self.eigen_vector_st
-                # for i in range(test_st_kernel.size(0)):
-                #     yVar[i] = self.log_signal_variance.exp() - test_times_eigen[i:i+1, :] @diagMultTorchLeft(self.eigen_value_st_plus_noise_inverse, test_times_eigen[i:i+1, :] .t())
-#                yVar = torch.diagonal(self.log_signal_variance.exp()*torch.eye(test_st_kernel.size(0)) - test_times_eigen@diagMultTorchLeft(self.eigen_value_st_plus_noise_inverse, test_times_eigen.t()))
-                yVar = self.log_signal_variance.exp()*torch.ones(test_st_kernel.size(0)) - torch.einsum("ij,ji->i", test_times_eigen, diagMultTorchLeft(self.eigen_value_st_plus_noise_inverse, test_times_eigen.t()))
-#                print(test_times_eigen.shape)
-#                print(diagMultTorchLeft(self.eigen_value_st_plus_noise_inverse, test_times_eigen.t()))
-
-#                print("done with yVar")
+                # Same as the unstructured case, but with the Kronecker factors kept apart (see update):
+                # the test kernel kron(Kt, Ks) and the eigenvectors kron(Vt, Vs) are never formed
+                signal_variance = self.log_signal_variance.exp()
+                alpha = self.alpha.view(self.time_coordinates.size(0), self.space_coordinates.size(0))
+                yPred = signal_variance * (test_temporal_kernel @ alpha @ test_spatial_kernel.t())
+                yPred = yPred.transpose(-2, -1)
+                if not return_variance:
+                    return yPred, None
+
+                # diag(K* E D E' K*') where K* E = signal_variance * kron(Kt Vt, Ks Vs)
+                test_times_eigen_t = realFourierTranspose(test_temporal_kernel.t()).t()
+                test_times_eigen_s = test_spatial_kernel @ self.eigen_vector_s
+                inverse = self.eigen_value_st_plus_noise_inverse.view(self.eigen_value_t.size(0), self.eigen_value_s.size(0))
+                yVar = signal_variance - signal_variance**2 * ((test_times_eigen_t**2) @ inverse @ (test_times_eigen_s**2).t())
+                yVar = yVar.transpose(-2, -1)
 
+            else:
+                test_st_kernel = self.log_signal_variance.exp()*kronecker(test_temporal_kernel, test_spatial_kernel)
+                yPred = test_st_kernel @ self.alpha
                 yPred = yPred.view(test_time_coordinates.size(0), test_space_coordinates.size(0)).transpose(-2, -1)
+                if not return_variance:
+                    return yPred, None
+
+                # diag(K* sigma_inverse K*') in one batched product, instead of one query row at a time
+                yVar = self.log_signal_variance.exp() - ((test_st_kernel @ self.sigma_inverse) * test_st_kernel).sum(1)
                 yVar = yVar.view(test_time_coordinates.size(0), test_space_coordinates.size(0)).transpose(-2, -1)
 
-            else:
-                yPred = test_st_kernel @ self.alpha
+            return yPred, yVar
 
-                yVar = torch.zeros(test_st_kernel.size(0))
-                for i in range(test_st_kernel.size(0)):
-                    yVar[i] = self.log_signal_variance.exp() - test_st_kernel[i:i + 1, :] @ self.sigma_inverse @ test_st_kernel[i:i + 1, :].t()
+    # Like forward, but for N (location, time) pairs -- row i of test_space_coordinates at row i of
+    # test_time_coordinates -- instead of every location at every time.  Returns yPred and yVar as
+    # vectors of length N: the diagonal of what forward would return, without building the N x N grid.
+    def forwardPoints(self, test_space_coordinates, test_time_coordinates, return_variance=True):
+        with torch.no_grad():
+            test_spatial_kernel, test_temporal_kernel = self.testKernels(test_space_coordinates, test_time_coordinates)
+            signal_variance = self.log_signal_variance.exp()
 
-                yPred = yPred.view(test_time_coordinates.size(0), test_space_coordinates.size(0)).transpose(-2, -1)
-                yVar = yVar.view(test_time_coordinates.size(0), test_space_coordinates.size(0)).transpose(-2, -1)
+            if self.time_structured==True:
+                # the test kernel row for point i is kron(Kt[i], Ks[i]), so each product in forward
+                # becomes a row-wise sum
+                alpha = self.alpha.view(self.time_coordinates.size(0), self.space_coordinates.size(0))
+                yPred = signal_variance * ((test_temporal_kernel @ alpha) * test_spatial_kernel).sum(1)
+                if not return_variance:
+                    return yPred, None
+
+                test_times_eigen_t = realFourierTranspose(test_temporal_kernel.t()).t()
+                test_times_eigen_s = test_spatial_kernel @ self.eigen_vector_s
+                inverse = self.eigen_value_st_plus_noise_inverse.view(self.eigen_value_t.size(0), self.eigen_value_s.size(0))
+                yVar = signal_variance - signal_variance**2 * (((test_times_eigen_t**2) @ inverse) * test_times_eigen_s**2).sum(1)
+            else:
+                test_st_kernel = signal_variance * torch.einsum("it,is->its", test_temporal_kernel, test_spatial_kernel).reshape(
+                    test_space_coordinates.size(0), -1)
+                yPred = (test_st_kernel @ self.alpha).view(-1)
+                if not return_variance:
+                    return yPred, None
+                yVar = signal_variance - ((test_st_kernel @ self.sigma_inverse) * test_st_kernel).sum(1)
 
             return yPred, yVar
-            
+
     def negative_log_likelihood(self):
         nll = 0
         nll += 0.5 * (self.eigen_value_st + torch.exp(self.log_noise_variance)).log().sum()
@@ -328,7 +477,7 @@ class gaussian_model(nn.Module):
         # LBFGS
         def closure():
             optimizer.zero_grad()
-            self.update()
+            self.update(use_cache=False)
             loss = self.negative_log_likelihood()
             loss.backward()
             print('nll:', loss.item())
@@ -342,7 +491,7 @@ class gaussian_model(nn.Module):
         optimizer = torch.optim.Adam(self.parameters(), lr=lr)
         for i in range(niteration):
             optimizer.zero_grad()
-            self.update()
+            self.update(use_cache=False)
             loss = self.negative_log_likelihood()
             loss.backward()
             optimizer.step()
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import pytz
 import numpy
@@ -415,7 +416,7 @@ def createModel(sensor_data, latlon_length_scale, elevation_length_scale, time_l
 
 
 # Ross changed this to do the formatting in the api_routes call instead of here
-def estimateUsingModel(model, lats, lons, elevations, query_dates, time_offset, save_matrices=False):
+def estimateUsingModel(model, lats, lons, elevations, query_dates, time_offset, save_matrices=False, return_variance=True):
 
     # converts from absolute dates to the local time coordinate system (in hours).  time_offset is the date of the first bin in the sensor data
     time_coordinates = convertToTimeCoordinatesVector(query_dates, time_offset)
@@ -454,15 +455,38 @@ def estimateUsingModel(model, lats, lons, elevations, query_dates, time_offset,
         numpy.savetxt('query_space_coords.csv', space_coordinates, delimiter=',')
         numpy.savetxt('query_time_coords.csv', query_time, delimiter=',')
     
-    yPred, yVar = model(query_space, query_time)
+    yPred, yVar = model(query_space, query_time, return_variance=return_variance)
     yPred = yPred.numpy()
-    yVar = yVar.numpy()
+    yVar = yVar.numpy() if return_variance else None
 #    yPred = [float(value) for value in yPred]
 #    yVar = [float(value) for value in yVar]
 
 #    print(yPred)
     return yPred, yVar
 
+
+# Estimates at N scattered points: the location in row i of space_coordinates (N x 3, in the same meter
+# coordinates as the model) at query_dates[i].  Points are evaluated chunk_points at a time, so memory
+# stays bounded however many there are, on up to max_workers threads (torch releases the GIL in its
+# kernels).  Returns yPred and yVar as arrays of length N, in the order of the points (yVar is None if
+# not return_variance).
+def estimateBatch(model, space_coordinates, query_dates, time_offset, chunk_points=GP_ESTIMATE_CHUNK_POINTS, max_workers=GP_ESTIMATE_MAX_WORKERS,
+                  return_variance=True):
+    query_space = torch.tensor(numpy.asarray(space_coordinates, dtype=numpy.float64))
+    query_time = torch.tensor(convertToTimeCoordinatesVector(query_dates, time_offset), dtype=torch.float64).view(-1, 1)
+
+    chunks = [slice(i, i + chunk_points) for i in range(0, query_time.size(0), chunk_points)]
+    evaluate = lambda chunk: model.forwardPoints(query_space[chunk], query_time[chunk], return_variance=return_variance)
+    if max_workers > 1 and len(chunks) > 1:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as pool:
+            results = list(pool.map(evaluate, chunks))
+    else:
+        results = [evaluate(chunk) for chunk in chunks]
+
+    yPred = torch.cat([pred for pred, _ in results]).numpy()
+    yVar = torch.cat([var for _, var in results]).numpy() if return_variance else None
+    return yPred, yVar
+
 # 
 # this kind of formatting of data is now done in the API (api_routes), because it will get formatted differently for different types of queries. 
 #
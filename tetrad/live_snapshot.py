@@ -0,0 +1,156 @@
+from datetime import datetime, timedelta
+import threading
+from time import sleep
+import numpy as np
+import pytz
+from tetrad import utils, clients, query_builder, stream_utils
+from tetrad.classes import NoDataError
+from tetrad.api_consts import *
+import logging
+
+
+def liveRows(fields, window_minutes, srcs=("all",), bq_client=None):
+    """
+    Latest cleaned reading of `fields` per device of `srcs` over the last
+    `window_minutes`, straight from BigQuery, as dicts
+    """
+    query, job_config = query_builder.liveQuery(fields, window_minutes, srcs)
+    rows = (bq_client or clients.bigquery()).query(query, job_config=job_config).result()
+    _, columns = stream_utils.collectColumns(rows)
+    return utils.columnsToDicts(utils.cleanColumns(columns, fields))
+
+
+class LiveSnapshot:
+    """
+    Latest reading per device over the last `window_minutes`, kept in
+    memory and refreshed every `refresh_seconds` by a single background
+    thread. Each refresh builds a new dict and swaps it in, so readers
+    never block on BigQuery and never see a half-built snapshot.
+    Devices with a GPS fix are also indexed in a KD-tree for nearest().
+    """
+
+    def __init__(self, bq_client=None, refresh_seconds=LIVE_SNAPSHOT_REFRESH_SECONDS,
+                 window_minutes=LIVE_SNAPSHOT_WINDOW_MINUTES, fields=LIVE_SNAPSHOT_FIELDS):
+        self.bq_client = bq_client
+        self.refresh_seconds = refresh_seconds
+        self.window_minutes = window_minutes
+        self.fields = fields
+        self.updated = None
+        self._rows = {}
+        self._located = (None, [])
+        self._ready = threading.Event()
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Start the refresh thread (once per process)"""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="live-snapshot", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"Live snapshot refresh failed: {e!r}")
+            sleep(self.refresh_seconds)
+
+    def refresh(self):
+        # Clean once per refresh instead of once per request
+        data = liveRows(self.fields, self.window_minutes, bq_client=self.bq_client)
+
+        self._rows = {datum[FIELD_MAP["DEVICEID"]]: datum for datum in data}
+        self._located = self._buildTree(data)
+        self.updated = datetime.now(pytz.utc)
+        self._ready.set()
+
+    def serves(self, fields, delta):
+        """Whether get() can answer for `fields` over the last `delta` minutes"""
+        return set(fields) <= set(self.fields) and delta <= self.window_minutes
+
+    @staticmethod
+    def _buildTree(data):
+        """(KD-tree over the unit vectors of the rows with a fix, those rows)"""
+        from scipy.spatial import cKDTree
+
+        located = [datum for datum in data if datum["Latitude"] is not None and datum["Longitude"] is not None]
+        if not located:
+            return None, []
+        points = utils.unitVectors(
+            np.array([datum["Latitude"] for datum in located], dtype=np.float64),
+            np.array([datum["Longitude"] for datum in located], dtype=np.float64)
+        )
+        return cKDTree(points), located
+
+    @staticmethod
+    def _project(datum, fields):
+        columns = [
+            FIELD_MAP["DEVICEID"],
+            FIELD_MAP["TIMESTAMP"],
+            FIELD_MAP["SOURCE"],
+            FIELD_MAP["LABEL"],
+            "Latitude",
+            "Longitude"
+        ] + [FIELD_MAP[field] for field in fields]
+        return {c: datum[c] for c in columns}
+
+    def _waitReady(self, timeout):
+        """
+        Give a first refresh that is under way `timeout` seconds to finish;
+        if the snapshot has never loaded, answer 503 rather than hold the
+        request (and its worker) until it does.
+        """
+        if not self._ready.wait(timeout):
+            raise NoDataError("Live data is still loading, try again shortly.", status_code=503)
+
+    def nearest(self, lat, lon, n, fields, timeout=LIVE_SNAPSHOT_WAIT_SECONDS):
+        """
+        The `n` devices closest to (lat, lon) with a reading for every one
+        of `fields`, nearest first (equally near ones in snapshot order), 
+        projected like get() plus 'Distance' (km)
+        """
+        self._waitReady(timeout)
+        tree, located = self._located
+        if tree is None:
+            return []
+
+        point = utils.unitVectors(lat, lon)[0]
+        names = [FIELD_MAP[field] for field in fields]
+        k = n
+        while True:
+            # Devices without these readings are skipped, so ask for more until n are left
+            chords, indices = tree.query(point, k=min(k, len(located)))
+            chords, indices = np.atleast_1d(chords), np.atleast_1d(indices)
+            order = np.lexsort((indices, chords))
+            chords, indices = chords[order], indices[order]
+            hits = [
+                (chord, located[i]) for chord, i in zip(chords, indices)
+                if all(located[i][name] is not None for name in names)
+            ]
+            if len(hits) >= n or k >= len(located):
+                break
+            k *= 2
+
+        return [
+            {**self._project(datum, fields), "Distance": float(utils.chordToKm(chord))}
+            for chord, datum in hits[:n]
+        ]
+
+    def get(self, srcs, fields, delta, timeout=LIVE_SNAPSHOT_WAIT_SECONDS):
+        """
+        Rows for the labels in `srcs` no older than `delta` minutes,
+        projected onto the standard columns plus `fields`.
+        """
+        self._waitReady(timeout)
+        rows = self._rows
+
+        keep = utils.labelFilter(srcs)
+        cutoff = datetime.now(pytz.utc) - timedelta(minutes=delta)
+
+        return [
+            self._project(datum, fields)
+            for datum in rows.values()
+            if datum[FIELD_MAP["TIMESTAMP"]] >= cutoff and keep(datum)
+        ]
@@ -0,0 +1,155 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import threading
+from time import monotonic
+import pytz
+from tetrad import gaussian_model_utils
+from tetrad.api_consts import *
+
+
+BIN = timedelta(minutes=gaussian_model_utils.NUM_MINUTES_PER_BIN)
+
+
+def floorBin(t):
+    """Start of the NUM_MINUTES_PER_BIN time bin `t` falls in"""
+    return t - (t - gaussian_model_utils.JANUARY1ST) % BIN
+
+
+def ceilBin(t):
+    floor = floorBin(t)
+    return floor if floor == t else floor + BIN
+
+
+def modelBytes(model):
+    """Memory held by a gaussian_model's tensors (parameters, data and factorizations)"""
+    tensors = {id(t): t for t in model.parameters()}
+    tensors.update({id(t): t for t in vars(model).values() if hasattr(t, 'element_size')})
+    return sum(t.element_size() * t.nelement() for t in tensors.values())
+
+
+class ModelCache:
+    """
+    LRU cache of fitted gaussian_models, keyed by region, time window
+    and length scales, so repeated estimates for the same region skip
+    the data query, binning and model construction. Windows are widened
+    to whole NUM_MINUTES_PER_BIN bins (see window()), so every request
+    within a bin period shares one model. Models of windows ending more
+    than RESULT_CACHE_SETTLE_MINUTES ago are kept for
+    RESULT_CACHE_HISTORICAL_TTL seconds; those reaching up to "now" only
+    for one bin, since new readings keep arriving. Bounded by the memory
+    the models' tensors hold, GP_MODEL_CACHE_MAX_BYTES in all.
+    """
+
+    def __init__(self, max_bytes=GP_MODEL_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes_held = 0
+        self._entries = OrderedDict()  # key -> (expires, nbytes, (model, time_offset))
+        self._building = {}            # key -> [Lock held while building, waiters, (model, time_offset)]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def window(start, end):
+        """[start, end] widened to whole bins: the window a cached model covers"""
+        return floorBin(start.astimezone(pytz.utc)), ceilBin(end.astimezone(pytz.utc))
+
+    @staticmethod
+    def makeKey(region, start, end, latlon_length_scale, elevation_length_scale, time_length_scale,
+                registry_version=None):
+        """
+        `region` is anything hashable that names the sensors, e.g. a region
+        name or bbox items. Models are fit to corrected readings, so
+        `registry_version` (utils.REGISTRY.current.version) keeps models
+        fit under older correction factors from being reused.
+        """
+        start, end = ModelCache.window(start, end)
+        return (region, start, end, float(latlon_length_scale), float(elevation_length_scale), float(time_length_scale),
+                registry_version)
+
+    @staticmethod
+    def ttl(end):
+        settled = datetime.now(pytz.utc) - timedelta(minutes=RESULT_CACHE_SETTLE_MINUTES)
+        if end < settled:
+            return RESULT_CACHE_HISTORICAL_TTL
+        return BIN.total_seconds()
+
+    def get(self, key):
+        """(model, time_offset) for `key`, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, model, time_offset, ttl):
+        nbytes = modelBytes(model)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (monotonic() + ttl, nbytes, (model, time_offset))
+            self._bytes_held += nbytes
+            while self._bytes_held > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def model(self, key, build):
+        """
+        (model, time_offset) for `key`, from `build()` (which returns the
+        same, e.g. gaussian_model_utils.createModel over the rows of
+        window(start, end)) on a miss. Concurrent misses on one key build
+        it once; the others wait for it.
+        """
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        # One [lock, waiters, result] per key being built. Waiters take
+        # the builder's result even if it was too big to cache, and the
+        # last one out drops the entry
+        with self._lock:
+            building = self._building.setdefault(key, [threading.Lock(), 0, None])
+            building[1] += 1
+        try:
+            with building[0]:
+                if building[2] is None:
+                    building[2] = self._cachedOrBuild(key, build)
+                return building[2]
+        finally:
+            with self._lock:
+                building[1] -= 1
+                if not building[1]:
+                    del self._building[key]
+
+    def _cachedOrBuild(self, key, build):
+        # Someone else may have built it since our miss
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] > monotonic():
+            return entry[2]
+        model, time_offset = build()
+        self.put(key, model, time_offset, self.ttl(key[2]))
+        return model, time_offset
+
+    def _remove(self, key):
+        _, nbytes, _ = self._entries.pop(key)
+        self._bytes_held -= nbytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes_held,
+                'max_bytes': self.max_bytes,
+            }
@@ -1,14 +1,9 @@
-from firebase_admin import auth#, initialize_app
 from flask import request, send_file
 from tetrad import app, admin_utils
 import functools
 import traceback 
 from os import getenv
 from io import BytesIO
-import google.cloud.logging 
-gcloud_logging_client = google.cloud.logging.Client()
-gcloud_logging_client.get_default_handler()
-gcloud_logging_client.setup_logging()
 import logging
 
 
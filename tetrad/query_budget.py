@@ -0,0 +1,132 @@
+from collections import defaultdict, deque
+from datetime import timedelta
+import threading
+from time import monotonic
+from google.cloud.bigquery import QueryJobConfig
+from tetrad import chunked_query
+from tetrad.api_consts import *
+from tetrad.classes import ArgumentError
+
+
+GB = 1e9
+
+# The aggregation offered as an alternative to raw readings:
+# (agg, fn) as /requestData takes them
+SUGGESTED_AGG = ('1h', 'mean')
+
+
+def estimateBytes(bq_client, queries):
+    """
+    Bytes BigQuery would scan for the (sql, job_config) `queries`, from
+    concurrent dry runs. Dry runs are free and don't touch the query cache.
+    """
+    def dryRun(query):
+        sql, job_config = query
+        config = QueryJobConfig(
+            dry_run=True,
+            use_query_cache=False,
+            query_parameters=job_config.query_parameters
+        )
+        return bq_client.query(sql, job_config=config).total_bytes_processed or 0
+
+    futures = [chunked_query.query_pool.submit(dryRun, q) for q in queries]
+    return sum(f.result() for f in futures)
+
+
+def suggestEnd(start, end, estimated, allowed):
+    """The end time, on an hour boundary, that would scan about `allowed` bytes"""
+    hours = int((end - start) / timedelta(hours=1) * allowed / estimated)
+    return start + timedelta(hours=max(1, hours))
+
+
+class ByteBudget:
+    """
+    Limits on the bytes a /requestData call may scan: a per-request cap,
+    and a per-user cap over a rolling QUERY_BUDGET_WINDOW_SECONDS. Users
+    are keyed like the rate limiter (remote address). Spend is tracked
+    per instance. A limit of 0 disables it.
+    """
+
+    def __init__(self, request_bytes=QUERY_BUDGET_REQUEST_BYTES, user_bytes=QUERY_BUDGET_USER_BYTES,
+                 window_seconds=QUERY_BUDGET_WINDOW_SECONDS):
+        self.request_bytes = request_bytes
+        self.user_bytes = user_bytes
+        self.window_seconds = window_seconds
+        self._spent = defaultdict(deque)  # user -> deque[(time, bytes)]
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.request_bytes or self.user_bytes)
+
+    def spent(self, user):
+        """Bytes charged to `user` in the current window"""
+        with self._lock:
+            charges = self._spent.get(user)
+            if not charges:
+                return 0
+            cutoff = monotonic() - self.window_seconds
+            while charges and charges[0][0] < cutoff:
+                charges.popleft()
+            if not charges:
+                del self._spent[user]
+                return 0
+            return sum(b for _, b in charges)
+
+    def charge(self, user, nbytes):
+        if self.user_bytes and nbytes:
+            with self._lock:
+                self._spent[user].append((monotonic(), nbytes))
+
+    def report(self, user, estimated, start, end, aggregated=None):
+        """
+        What `estimated` bytes would mean for `user`; used for 
+        estimate=true and errors. `aggregated` is the estimate for the
+        same request aggregated as SUGGESTED_AGG, if it was made.
+        """
+        report = {
+            'estimated_bytes': estimated,
+            'request_budget_bytes': self.request_bytes or None,
+            'user_budget_bytes_remaining': max(0, self.user_bytes - self.spent(user)) if self.user_bytes else None,
+        }
+        allowed = min(b for b in (report['request_budget_bytes'], report['user_budget_bytes_remaining'], float('inf')) if b is not None)
+        report['within_budget'] = estimated <= allowed
+        if not report['within_budget'] and allowed > 0:
+            report['suggested_end'] = suggestEnd(start, end, estimated, allowed).isoformat()
+        if aggregated is not None:
+            report['aggregated'] = {
+                'agg': SUGGESTED_AGG[0],
+                'fn': SUGGESTED_AGG[1],
+                'estimated_bytes': aggregated,
+                'within_budget': aggregated <= allowed,
+            }
+        return report
+
+    def check(self, user, estimated, start, end, aggregated=None):
+        """Raise ArgumentError if `estimated` bytes is over either budget, otherwise charge them"""
+        report = self.report(user, estimated, start, end, aggregated)
+        if not report['within_budget']:
+            if self.request_bytes and estimated > self.request_bytes:
+                message = (f"Query would scan about {estimated / GB:.1f} GB, over the "
+                           f"{self.request_bytes / GB:.1f} GB per-request budget.")
+                status_code = 400
+            else:
+                message = (f"Query would scan about {estimated / GB:.1f} GB, but only "
+                           f"{report['user_budget_bytes_remaining'] / GB:.1f} GB of your "
+                           f"{self.window_seconds // 3600}-hour budget is left.")
+                status_code = 429
+            if 'suggested_end' in report:
+                message += f" Try a narrower window (e.g. end={report['suggested_end']}) or fewer fields or sources."
+            if 'aggregated' in report:
+                message += self._aggregatedHint(report['aggregated'])
+            raise ArgumentError(message, status_code=status_code, payload=report)
+        self.charge(user, estimated)
+
+    @staticmethod
+    def _aggregatedHint(aggregated):
+        option = f"agg={aggregated['agg']}&fn={aggregated['fn']}"
+        if aggregated['within_budget']:
+            return (f" Or aggregate the readings ({option}), which would scan about "
+                    f"{aggregated['estimated_bytes'] / GB:.1f} GB.")
+        return (f" Aggregating the readings ({option}) returns one row per device and interval, "
+                f"but would scan about {aggregated['estimated_bytes'] / GB:.1f} GB as well.")
@@ -0,0 +1,331 @@
+# Parameterized SQL for telemetry queries.
+#
+# Queries are built from a small set of templates that hold no request
+# values, only @parameters. Templates are memoized on their shape (fields,
+# kind of label/region/device filter), so identical logical queries send
+# byte-identical SQL and BigQuery's result cache can hit.
+import functools
+from google.cloud.bigquery import QueryJobConfig, ScalarQueryParameter, ArrayQueryParameter
+from tetrad import utils
+from tetrad.api_consts import *
+
+
+# Sources that filter on the Source column instead of Label
+SOURCE_LABELS = {
+    "tetrad":    "Tetrad",
+    "purpleair": "PurpleAir",
+    "aqandu":    "AQ&U",
+}
+
+
+# SQL aggregate for each 'fn' argument. APPROX_QUANTILES(x, 2) is [min, median, max]
+AGG_SQL = {
+    "mean":   "AVG({0})",
+    "median": "APPROX_QUANTILES({0}, 2)[OFFSET(1)]",
+    "max":    "MAX({0})",
+    "min":    "MIN({0})",
+    "count":  "COUNT({0})",
+}
+
+
+def _labelMode(srcs):
+    """Which label clause the template needs"""
+    if "all" in srcs:
+        return "all"
+    elif "allgps" in srcs:
+        return "allgps"
+    for label in SOURCE_LABELS:
+        if label in srcs:
+            return label
+    return "labels"
+
+
+def _activeRegions():
+    """Enabled region boxes, as a hashable template key"""
+    return tuple(
+        (r['lat_hi'], r['lat_lo'], r['lon_hi'], r['lon_lo'])
+        for r in utils.regions()['info'].values() if r['enabled']
+    )
+
+
+def _labelClause(mode, regions):
+    if mode == "all":
+        return "True"
+    elif mode == "allgps":
+        region_list = [dict(zip(('lat_hi', 'lat_lo', 'lon_hi', 'lon_lo'), r)) for r in regions]
+        # Parenthesized as a whole so the top-level OR can't swallow the
+        # time/region/device conditions that follow it
+        return (
+            f'(({FIELD_MAP["SOURCE"]} != "PurpleAir") AND (IFNULL({FIELD_MAP["LABEL"]}, "") != "{BQ_LABEL_BADGPS}" '
+            f'AND {utils.queryBuildMultipleRegions(region_list)}) '
+            f'OR ({FIELD_MAP["LABEL"]} = "global" AND {FIELD_MAP["SOURCE"]} != "PurpleAir"))'
+        )
+    elif mode in SOURCE_LABELS:
+        return f'{FIELD_MAP["SOURCE"]} = @source'
+    else:
+        return f'{FIELD_MAP["LABEL"]} IN UNNEST(@labels)'
+
+
+def _regionClause(kind):
+    if kind == "box":
+        return f'ST_WITHIN({FIELD_MAP["GPS"]}, ST_GEOGFROMGEOJSON(@box))'
+    elif kind == "radius":
+        return f'ST_DWITHIN({FIELD_MAP["GPS"]}, ST_GEOGPOINT(@lon, @lat), @radius_m)'
+    return "True"
+
+
+def _locatedClause(located):
+    """
+    Device prefilter from the device registry. 'ids' when the window
+    lies entirely before @located_until, 'open' when it reaches past
+    it: rows after that aren't covered by the registry yet.
+    """
+    if located == "ids":
+        return f'{FIELD_MAP["DEVICEID"]} IN UNNEST(@located_ids)'
+    elif located == "open":
+        return f'({FIELD_MAP["DEVICEID"]} IN UNNEST(@located_ids) OR {FIELD_MAP["TIMESTAMP"]} >= @located_until)'
+    return "True"
+
+
+def _cleanExpr(field):
+    """
+    The field with the values utils.CLEANING_RULES treats as bad 
+    nulled out, so they don't end up in aggregates
+    """
+    name = FIELD_MAP[field]
+    if field not in utils.CLEANING_RULES:
+        return name
+    flag, thresh = utils.CLEANING_RULES[field]
+    bad = f"{name} = {flag}" + (f" OR {name} >= {thresh}" if thresh is not None else "")
+    return f"IF({bad}, NULL, {name})"
+
+
+def _aggFields(fields, fn):
+    """
+    Select list for rows aggregated per (device, @agg_seconds bucket). The
+    bucket start replaces the Timestamp; the position is the bucket mean.
+    """
+    return f"""{FIELD_MAP["DEVICEID"]},
+                   TIMESTAMP_SECONDS(DIV(UNIX_SECONDS({FIELD_MAP["TIMESTAMP"]}), @agg_seconds) * @agg_seconds) AS {FIELD_MAP["TIMESTAMP"]},
+                   ANY_VALUE({FIELD_MAP["SOURCE"]}) AS {FIELD_MAP["SOURCE"]},
+                   ANY_VALUE({FIELD_MAP["LABEL"]}) AS {FIELD_MAP["LABEL"]},
+                   AVG(ST_Y({FIELD_MAP["GPS"]})) AS Latitude,
+                   AVG(ST_X({FIELD_MAP["GPS"]})) AS Longitude,
+                   {','.join(f'{AGG_SQL[fn].format(_cleanExpr(field))} AS {FIELD_MAP[field]}' for field in fields)}
+                """
+
+
+@functools.lru_cache(maxsize=256)
+def telemetryTemplate(fields, label_mode, regions, region_kind, has_ids, hi_inclusive, agg_fn=None, located=None):
+    """
+    SELECT for one time window [@start, @end] (or [@start, @end)
+    if not hi_inclusive). With `agg_fn`, one row per device and
+    @agg_seconds bucket. `located` is the _locatedClause kind. 
+    All arguments must be hashable.
+    """
+    return f"""
+        SELECT
+            {_aggFields(fields, agg_fn) if agg_fn else utils.queryBuildFields(fields)}
+        FROM
+            `{BQ_PATH_TELEMETRY}`
+        WHERE
+            {_labelClause(label_mode, regions)}
+                AND
+            {FIELD_MAP["TIMESTAMP"]} >= @start
+                AND
+            {FIELD_MAP["TIMESTAMP"]} {'<=' if hi_inclusive else '<'} @end
+                AND
+            {_regionClause(region_kind)}
+                AND
+            {f'{FIELD_MAP["DEVICEID"]} IN UNNEST(@ids)' if has_ids else 'True'}
+                AND
+            {_locatedClause(located)}
+        {'GROUP BY 1, 2' if agg_fn else ''}
+        ORDER BY
+            {'2' if agg_fn else FIELD_MAP["TIMESTAMP"]}
+    """
+
+
+def labelParams(srcs):
+    mode = _labelMode(srcs)
+    if mode in SOURCE_LABELS:
+        return [ScalarQueryParameter("source", "STRING", SOURCE_LABELS[mode])]
+    elif mode == "labels":
+        return [ArrayQueryParameter("labels", "STRING", list(srcs))]
+    return []
+
+
+def regionParams(bbox=None, radius=None, center=None):
+    if bbox:
+        n, s, e, w = bbox['lat_hi'], bbox['lat_lo'], bbox['lon_hi'], bbox['lon_lo']
+        polygon = f'{{"type": "Polygon", "coordinates": [[[{e},{n}],[{e},{s}],[{w},{s}],[{w},{n}],[{e},{n}]]]}}'
+        return "box", [ScalarQueryParameter("box", "STRING", polygon)]
+    elif radius:
+        return "radius", [
+            ScalarQueryParameter("lat", "FLOAT64", center['lat']),
+            ScalarQueryParameter("lon", "FLOAT64", center['lon']),
+            ScalarQueryParameter("radius_m", "FLOAT64", radius * 1000),
+        ]
+    return None, []
+
+
+def telemetryQuery(srcs, fields, bbox=None, radius=None, center=None, id_ls=None, agg=None, located=None):
+    """
+    Return windowQuery(lo, hi, hi_inclusive) -> (sql, QueryJobConfig)
+    for the telemetry in `srcs`/`fields`, optionally inside a box or
+    radius (km) and limited to the devices in `id_ls`. `agg` is an
+    (interval seconds, fn) pair from utils.argParseAgg. `located` is
+    (ids, until) from DeviceRegistry.locate: the only devices that were
+    inside the box or radius before `until`.
+    """
+    if isinstance(id_ls, str):
+        id_ls = [id_ls]
+
+    # Sorted, so field orders share one cached template (and BigQuery's
+    # cached results for the same text)
+    fields = tuple(sorted(fields))
+    label_mode = _labelMode(srcs)
+    regions = _activeRegions() if label_mode == "allgps" else None
+    region_kind, region_params = regionParams(bbox, radius, center)
+    params = labelParams(srcs) + region_params
+    if id_ls:
+        params.append(ArrayQueryParameter("ids", "STRING", list(id_ls)))
+    if agg:
+        params.append(ScalarQueryParameter("agg_seconds", "INT64", agg[0]))
+    if located:
+        params += [
+            ArrayQueryParameter("located_ids", "STRING", list(located[0])),
+            ScalarQueryParameter("located_until", "TIMESTAMP", located[1]),
+        ]
+
+    def windowQuery(lo, hi, hi_inclusive):
+        located_kind = None
+        if located:
+            located_kind = "ids" if hi < located[1] else "open"
+        sql = telemetryTemplate(fields, label_mode, regions, region_kind, bool(id_ls), hi_inclusive,
+                                agg[1] if agg else None, located_kind)
+        config = QueryJobConfig(query_parameters=params + [
+            ScalarQueryParameter("start", "TIMESTAMP", lo),
+            ScalarQueryParameter("end", "TIMESTAMP", hi),
+        ])
+        return sql, config
+
+    return windowQuery
+
+
+@functools.lru_cache(maxsize=256)
+def liveTemplate(fields, label_mode="all", regions=None, live_labels=False):
+    """
+    Latest row per device over the last @window_minutes, for the labels
+    in `label_mode` (see telemetryTemplate) and, with `live_labels`, 
+    only those in @live_labels
+    """
+    return f"""
+        SELECT
+            * EXCEPT(row_num)
+        FROM
+            (
+                SELECT
+                    {utils.queryBuildFields(fields)},
+                    ROW_NUMBER()
+                OVER
+                    (
+                        PARTITION BY
+                            {FIELD_MAP["DEVICEID"]}
+                        ORDER BY
+                            {FIELD_MAP["TIMESTAMP"]} DESC
+                    ) row_num
+                FROM
+                    `{BQ_PATH_TELEMETRY}`
+                WHERE
+                    {_labelClause(label_mode, regions)}
+                        AND
+                    {f'{FIELD_MAP["LABEL"]} IN UNNEST(@live_labels)' if live_labels else 'True'}
+                        AND
+                    {FIELD_MAP["TIMESTAMP"]} >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @window_minutes MINUTE)
+            )
+        WHERE
+            row_num = 1
+    """
+
+
+@functools.lru_cache(maxsize=None)
+def deviceLocationsTemplate():
+    """
+    Where each device reported from in [@since, @until): the extent of 
+    its GPS fixes and its latest fix, with its nickname from meta.devices
+    """
+    return f"""
+        WITH located AS (
+            SELECT
+                {FIELD_MAP["DEVICEID"]},
+                MIN(ST_Y({FIELD_MAP["GPS"]})) AS lat_lo,
+                MAX(ST_Y({FIELD_MAP["GPS"]})) AS lat_hi,
+                MIN(ST_X({FIELD_MAP["GPS"]})) AS lon_lo,
+                MAX(ST_X({FIELD_MAP["GPS"]})) AS lon_hi,
+                ARRAY_AGG(
+                    STRUCT(ST_Y({FIELD_MAP["GPS"]}) AS lat, ST_X({FIELD_MAP["GPS"]}) AS lon, {FIELD_MAP["TIMESTAMP"]} AS ts)
+                    ORDER BY {FIELD_MAP["TIMESTAMP"]} DESC LIMIT 1
+                )[OFFSET(0)] AS last
+            FROM
+                `{BQ_PATH_TELEMETRY}`
+            WHERE
+                {FIELD_MAP["TIMESTAMP"]} >= @since
+                    AND
+                {FIELD_MAP["TIMESTAMP"]} < @until
+                    AND
+                {FIELD_MAP["GPS"]} IS NOT NULL
+            GROUP BY
+                {FIELD_MAP["DEVICEID"]}
+        )
+        SELECT
+            located.{FIELD_MAP["DEVICEID"]},
+            lat_lo, lat_hi, lon_lo, lon_hi,
+            last.lat AS lat,
+            last.lon AS lon,
+            last.ts AS last_seen,
+            devices.{getenv('FIELD_NN')} AS nickname
+        FROM
+            located
+        LEFT JOIN
+            `{PROJECT_ID}.{getenv('BQ_DATASET_META')}.{getenv('BQ_TABLE_META_DEVICES')}` AS devices
+        ON
+            located.{FIELD_MAP["DEVICEID"]} = devices.{FIELD_MAP["DEVICEID"]}
+    """
+
+
+def deviceLocationsQuery(since, until):
+    return deviceLocationsTemplate(), QueryJobConfig(query_parameters=[
+        ScalarQueryParameter("since", "TIMESTAMP", since),
+        ScalarQueryParameter("until", "TIMESTAMP", until),
+    ])
+
+
+def liveQuery(fields, window_minutes, srcs=("all",), live_labels=LIVE_SNAPSHOT_LABELS):
+    """
+    (sql, QueryJobConfig) for the latest row per device of `srcs` over
+    the last `window_minutes`, among the labels in `live_labels` (all
+    labels if empty)
+    """
+    label_mode = _labelMode(srcs)
+    regions = _activeRegions() if label_mode == "allgps" else None
+    params = labelParams(srcs) + [ScalarQueryParameter("window_minutes", "INT64", window_minutes)]
+    if live_labels:
+        params.append(ArrayQueryParameter("live_labels", "STRING", list(live_labels)))
+    sql = liveTemplate(tuple(sorted(fields)), label_mode, regions, bool(live_labels))
+    return sql, QueryJobConfig(query_parameters=params)
+
+
+def nicknameQuery(device, nickname):
+    sql = f"""
+        UPDATE
+            `{PROJECT_ID}.{getenv('BQ_DATASET_META')}.{getenv('BQ_TABLE_META_DEVICES')}`
+        SET
+            {getenv('FIELD_NN')} = @nickname
+        WHERE
+            {getenv('FIELD_ID')} = @device
+    """
+    return sql, QueryJobConfig(query_parameters=[
+        ScalarQueryParameter("nickname", "STRING", nickname),
+        ScalarQueryParameter("device", "STRING", device),
+    ])
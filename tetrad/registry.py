@@ -0,0 +1,114 @@
+import hashlib
+import threading
+from time import sleep
+from tetrad.api_consts import *
+import logging
+
+
+class RegistrySnapshot:
+    """
+    One immutable generation of reference data: name -> compiled data,
+    plus the source version (file mtime, blob generation, ...) each was
+    loaded from. `version` is a short digest of all of them.
+    """
+
+    def __init__(self, versions, data):
+        self.versions = versions
+        self.data = data
+        digest = hashlib.sha1(repr(sorted(versions.items())).encode())
+        self.version = digest.hexdigest()[:12]
+
+    def __getitem__(self, name):
+        return self.data[name]
+
+
+class Registry:
+    """
+    Reference data that can change without a redeploy. Each source is a
+    loader `load(version) -> (version, data)` that returns None when its
+    source is still at `version`, so checking for changes is cheap. A
+    background thread checks right away and then every `reload_seconds`;
+    when anything changed, a new RegistrySnapshot is built and swapped in
+    as `current` with a single assignment, so readers never lock and
+    never see a mix of generations. A source that fails to load keeps
+    its last data.
+
+    Nothing is loaded until `current` is first used. A source with a
+    seed (a loader for a local copy, e.g. a snapshot bundled with the
+    deploy) starts from the seed, so first use doesn't wait on the
+    network; the thread then replaces it with the real thing.
+    """
+
+    def __init__(self, loaders, seeds=None, reload_seconds=REGISTRY_RELOAD_SECONDS):
+        self.loaders = loaders
+        self.seeds = seeds or {}
+        self.reload_seconds = reload_seconds
+        self._current = None
+        self._seed_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def current(self):
+        snapshot = self._current
+        if snapshot is None:
+            with self._seed_lock:
+                if self._current is None:
+                    self._current = self._seed()
+                snapshot = self._current
+        return snapshot
+
+    @current.setter
+    def current(self, snapshot):
+        self._current = snapshot
+
+    def _seed(self):
+        """First snapshot: each source from its seed, or its loader if it has none or the seed fails"""
+        versions, data = {}, {}
+        for name, load in self.loaders.items():
+            seed = self.seeds.get(name)
+            if seed is not None:
+                try:
+                    versions[name], data[name] = seed(None)
+                    continue
+                except Exception as e:
+                    logging.warning(f"Registry: seeding '{name}' failed, loading it from its source instead: {e!r}")
+            try:
+                versions[name], data[name] = load(None)
+            except Exception as e:
+                logging.error(f"Registry: loading '{name}' failed: {e!r}")
+        snapshot = RegistrySnapshot(versions, data)
+        logging.info(f"Registry: loaded {', '.join(data)} (version {snapshot.version})")
+        return snapshot
+
+    def start(self):
+        """Start the reload thread (once per process)"""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="registry", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self.reload()
+            sleep(self.reload_seconds)
+
+    def reload(self):
+        """Reload changed sources. Returns True if a new snapshot was swapped in"""
+        snapshot = self.current
+        versions, data = dict(snapshot.versions), dict(snapshot.data)
+        changed = []
+        for name, load in self.loaders.items():
+            try:
+                result = load(versions.get(name))
+            except Exception as e:
+                logging.error(f"Registry: loading '{name}' failed: {e!r}")
+                continue
+            if result is not None:
+                versions[name], data[name] = result
+                changed.append(name)
+
+        if changed:
+            self._current = RegistrySnapshot(versions, data)
+            logging.info(f"Registry: reloaded {', '.join(changed)} (version {self._current.version})")
+        return bool(changed)
@@ -0,0 +1,146 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import threading
+from time import monotonic
+import pytz
+from tetrad.api_consts import *
+
+
+class CachedRows:
+    """
+    A fully downloaded result, kept as the original pages of BigQuery
+    Rows. Exposes the same parts of RowIterator as ChunkedRows.
+    """
+
+    def __init__(self, schema, pages):
+        self.schema = schema
+        self._pages = pages
+        self.total_rows = sum(len(page) for page in pages)
+
+    @property
+    def pages(self):
+        return iter(self._pages)
+
+    def __iter__(self):
+        for page in self._pages:
+            for row in page:
+                yield row
+
+
+class _TeeRows:
+    """
+    Pass-through for a result on its way to the client. Keeps each page
+    as it goes by and hands the finished CachedRows to `on_complete`
+    once the last page has been read.
+    """
+
+    def __init__(self, rows, on_complete):
+        self._rows = rows
+        self._on_complete = on_complete
+        self.schema = rows.schema
+        self.total_rows = rows.total_rows
+
+    @property
+    def pages(self):
+        kept = []
+        for page in self._rows.pages:
+            page = list(page)
+            kept.append(page)
+            yield page
+        self._on_complete(CachedRows(self.schema, kept))
+
+    def __iter__(self):
+        for page in self.pages:
+            for row in page:
+                yield row
+
+
+class ResultCache:
+    """
+    LRU cache of /requestData results, bounded by total rows held.
+    Windows ending more than RESULT_CACHE_SETTLE_MINUTES ago won't change
+    any more and are kept for RESULT_CACHE_HISTORICAL_TTL seconds; windows
+    reaching up to "now" only for RESULT_CACHE_RECENT_TTL seconds.
+    """
+
+    def __init__(self, max_rows=RESULT_CACHE_MAX_ROWS, max_entry_rows=RESULT_CACHE_MAX_ENTRY_ROWS):
+        self.max_rows = max_rows
+        self.max_entry_rows = max_entry_rows
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._rows_held = 0
+        self._entries = OrderedDict()  # key -> (expires, CachedRows)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def makeKey(srcs, fields, start, end, bbox=None, rc=None, devices=None, **extra):
+        """
+        Key on the normalized arguments from utils.argParse*. `extra`
+        holds anything else the rows depend on, e.g. the aggregate or
+        the registry version whose correction factors cleaned them.
+        """
+        return (
+            tuple(sorted(srcs or ())),
+            tuple(sorted(fields)),
+            start.astimezone(pytz.utc),
+            end.astimezone(pytz.utc),
+            tuple(sorted(bbox.items())) if bbox else None,
+            (rc[0], rc[1]['lat'], rc[1]['lon']) if rc else None,
+            tuple(sorted(devices)) if devices else None,
+        ) + tuple(sorted(extra.items()))
+
+    @staticmethod
+    def ttl(end):
+        settled = datetime.now(pytz.utc) - timedelta(minutes=RESULT_CACHE_SETTLE_MINUTES)
+        if end < settled:
+            return RESULT_CACHE_HISTORICAL_TTL
+        return RESULT_CACHE_RECENT_TTL
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, rows, ttl):
+        if rows.total_rows > self.max_entry_rows:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (monotonic() + ttl, rows)
+            self._rows_held += rows.total_rows
+            while self._rows_held > self.max_rows:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def wrap(self, key, rows, ttl):
+        """
+        Return `rows` unchanged if too big to cache, otherwise a
+        pass-through that stores the result once fully read
+        """
+        if not rows.total_rows or rows.total_rows > self.max_entry_rows:
+            return rows
+        return _TeeRows(rows, lambda cached: self.put(key, cached, ttl))
+
+    def _remove(self, key):
+        _, rows = self._entries.pop(key)
+        self._rows_held -= rows.total_rows
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'rows': self._rows_held,
+                'max_rows': self.max_rows,
+            }
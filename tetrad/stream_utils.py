@@ -0,0 +1,253 @@
+from datetime import datetime, timedelta
+import csv
+import io
+import json as std_json
+from flask import json
+import numpy as np
+import pytz
+from google.cloud.bigquery.table import Row
+from tetrad import utils
+from tetrad.api_consts import *
+
+
+# Output formats for /requestData, mapped to their mimetype
+STREAM_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv":    "text/csv",
+}
+
+# Formats that return one typed array per field instead of rows
+COLUMNAR_FORMATS = {
+    "columnar-json": "application/json",
+    "arrow":         "application/vnd.apache.arrow.stream",
+}
+
+RESPONSE_FORMATS = {"json": "application/json", **STREAM_FORMATS, **COLUMNAR_FORMATS}
+
+# 'Accept' header mimetypes that select a format when 'format' isn't given
+ACCEPT_FORMATS = {
+    "application/json":                     "json",
+    "application/x-ndjson":                 "ndjson",
+    "text/csv":                             "csv",
+    "application/vnd.tetrad.columnar+json": "columnar-json",
+    "application/vnd.apache.arrow.stream":  "arrow",
+}
+
+# String columns with few distinct values, sent as dictionary + codes
+DICTIONARY_COLUMNS = {FIELD_MAP["DEVICEID"], FIELD_MAP["LABEL"], FIELD_MAP["SOURCE"]}
+
+# Coordinates keep float64; float32 would round them to about a meter
+FLOAT64_COLUMNS = {"Latitude", "Longitude"}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+
+def rowPages(rows):
+    """
+    Walk a BigQuery RowIterator one page at a time, converting each page
+    to a list of dicts. Only one page is ever held in memory.
+    """
+    for page in rows.pages:
+        yield [dict(r) for r in page]
+
+
+def ndjsonStream(pages):
+    """One JSON object per line, one chunk per page"""
+    for page in pages:
+        if page:
+            yield ''.join(json.dumps(datum) + '\n' for datum in page)
+
+
+def _csvValue(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def csvStream(pages, columns):
+    """Header row, then one chunk of CSV lines per page"""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    def flush():
+        chunk = buf.getvalue()
+        buf.seek(0)
+        buf.truncate(0)
+        return chunk
+
+    writer.writerow(columns)
+    yield flush()
+
+    for page in pages:
+        if page:
+            writer.writerows([_csvValue(datum[c]) for c in columns] for datum in page)
+            yield flush()
+
+
+def pageColumns(rows):
+    """
+    Yield each page of `rows` as {name: column}. Row sources with a 
+    columnar form (StorageRows, CleanedRows) provide columnPages() 
+    and skip building Rows.
+    """
+    if hasattr(rows, 'columnPages'):
+        yield from rows.columnPages()
+        return
+
+    names = [f.name for f in rows.schema]
+    for page in rows.pages:
+        values = [r.values() for r in page]
+        if values:
+            yield dict(zip(names, (list(col) for col in zip(*values))))
+
+
+def _joinColumn(parts):
+    if parts and all(isinstance(p, np.ndarray) for p in parts):
+        return np.concatenate(parts)
+    return [v for p in parts for v in (p.tolist() if isinstance(p, np.ndarray) else p)]
+
+
+def collectColumns(rows):
+    """
+    Read a BigQuery RowIterator (or any row source) page by page 
+    into one column per field.
+    Returns (schema, {name: column})
+    """
+    names = [f.name for f in rows.schema]
+    parts = {name: [] for name in names}
+    for page in pageColumns(rows):
+        for name in names:
+            parts[name].append(page[name])
+    return rows.schema, {name: _joinColumn(parts[name]) for name in names}
+
+
+class CleanedRows:
+    """
+    Pass-through that runs each page of `rows` through 
+    utils.cleanColumns on its way to the client. Exposes the same 
+    parts of RowIterator as ChunkedRows.
+    """
+
+    def __init__(self, rows, fields, correct=True, mask=True):
+        self._rows = rows
+        self.fields = fields
+        self.correct = correct
+        self.mask = mask
+        self.schema = rows.schema
+        self.total_rows = rows.total_rows
+
+    def columnPages(self):
+        for columns in pageColumns(self._rows):
+            yield utils.cleanColumns(columns, self.fields, correct=self.correct, mask=self.mask)
+
+    @property
+    def pages(self):
+        names = [f.name for f in self.schema]
+        field_to_index = {name: i for i, name in enumerate(names)}
+        for columns in self.columnPages():
+            yield [Row(values, field_to_index) for values in zip(*(utils.listColumn(columns[n]) for n in names))]
+
+    def __iter__(self):
+        for page in self.pages:
+            for row in page:
+                yield row
+
+
+def _dictionaryEncode(col):
+    """Codes index into the dictionary in order of first appearance. None -> -1"""
+    lookup = {}
+    codes = np.fromiter(
+        (-1 if v is None else lookup.setdefault(v, len(lookup)) for v in col),
+        dtype=np.int32,
+        count=len(col)
+    )
+    return list(lookup), codes
+
+
+def encodeColumns(schema, columns, float_dtype=np.float32):
+    """
+    Type each column: 
+      TIMESTAMP         -> int64 epoch milliseconds (from datetimes or datetime64)
+      FLOAT/INTEGER     -> float_dtype (NaN for null; coordinates stay float64)
+      DICTIONARY_COLUMNS-> (dictionary, int32 codes)
+      anything else     -> list as-is
+    Returns a list of (name, kind, data) with kind one of 
+    'timestamp', 'float', 'dictionary', 'raw'
+    """
+    encoded = []
+    one_ms = timedelta(milliseconds=1)
+    for field in schema:
+        col = columns[field.name]
+        if field.field_type == "TIMESTAMP":
+            if isinstance(col, np.ndarray):
+                data = col.astype('datetime64[ms]').astype(np.int64)
+            else:
+                data = np.fromiter(((t - EPOCH) // one_ms for t in col), dtype=np.int64, count=len(col))
+            encoded.append((field.name, 'timestamp', data))
+        elif field.field_type in ("FLOAT", "FLOAT64", "INTEGER", "INT64", "NUMERIC"):
+            dtype = np.float64 if field.name in FLOAT64_COLUMNS else float_dtype
+            data = np.array(col, dtype=dtype)
+            encoded.append((field.name, 'float', data))
+        elif field.name in DICTIONARY_COLUMNS:
+            encoded.append((field.name, 'dictionary', _dictionaryEncode(col)))
+        else:
+            encoded.append((field.name, 'raw', list(col)))
+    return encoded
+
+
+def columnarJSON(encoded):
+    """
+    {
+        "length":  <n>,
+        "columns": [<name>, ...],
+        "types":   {<name>: <type>},
+        <name>:    [...] | {"dictionary": [...], "codes": [...]}
+    }
+    Timestamps are epoch milliseconds. Nulls are null; dictionary code -1 is null.
+    Encode with float_dtype=np.float64: as text, float32 only adds digits.
+    """
+    out = {"length": 0, "columns": [], "types": {}}
+    for name, kind, data in encoded:
+        out["columns"].append(name)
+        if kind == 'timestamp':
+            out["types"][name] = "int64"
+            out[name] = data.tolist()
+        elif kind == 'float':
+            out["types"][name] = str(data.dtype)
+            out[name] = np.where(np.isnan(data), None, data).tolist()
+        elif kind == 'dictionary':
+            dictionary, codes = data
+            out["types"][name] = "dictionary<int32,string>"
+            out[name] = {"dictionary": dictionary, "codes": codes.tolist()}
+            data = codes
+        else:
+            out["types"][name] = "string"
+            out[name] = data
+        out["length"] = len(data)
+    return std_json.dumps(out, separators=(',', ':'))
+
+
+def arrowStream(encoded):
+    """Serialize the columns as a single-batch Arrow IPC stream"""
+    import pyarrow as pa
+
+    arrays, names = [], []
+    for name, kind, data in encoded:
+        if kind == 'timestamp':
+            arrays.append(pa.array(data, type=pa.timestamp('ms', tz='UTC')))
+        elif kind == 'float':
+            arrays.append(pa.array(data, from_pandas=True))
+        elif kind == 'dictionary':
+            dictionary, codes = data
+            indices = pa.array(codes, type=pa.int32(), mask=(codes < 0))
+            arrays.append(pa.DictionaryArray.from_arrays(indices, pa.array(dictionary, type=pa.string())))
+        else:
+            arrays.append(pa.array(data))
+        names.append(name)
+
+    batch = pa.RecordBatch.from_arrays(arrays, names=names)
+    sink = pa.BufferOutputStream()
+    writer = pa.ipc.new_stream(sink, batch.schema)
+    writer.write_batch(batch)
+    writer.close()
+    return sink.getvalue().to_pybytes()
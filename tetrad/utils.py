@@ -1,25 +1,29 @@
-from os import getenv
+from os import getenv, path, stat
 from datetime import datetime, timedelta
 import dateutil
 from dateutil import parser as dateutil_parser
-from pytz import timezone
+from pytz import utc
 # from utm import from_latlon
 # from matplotlib.path import Path
 # from scipy import interpolate
 # from scipy.io import loadmat
 from csv import reader as csv_reader
+from itertools import compress
 import math 
+import logging
 from flask import jsonify
 import numpy as np
 import re
-from google.cloud.storage import Client as GSClient
 import json
 from tetrad.classes import ArgumentError
+from tetrad.registry import Registry
+from tetrad import clients
 from tetrad.api_consts import *
 
 
 DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S+0000"
 BQ_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+EPOCH = datetime(1970, 1, 1, tzinfo=utc)
 
 # def getModelBoxes():
 #     gs_client = storage.Client()
@@ -30,21 +34,48 @@ BQ_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 # MODEL_BOXES = getModelBoxes()
 
 
-def get_region_info():    
-    gs_client = GSClient()
-    bucket = gs_client.get_bucket(getenv("GS_BUCKET"))
+def loadRegionInfo(version=None):
+    """
+    Registry loader for the region info blob: (generation, regions), 
+    or None if the blob is still at generation `version`
+    """
+    bucket = clients.storage().bucket(getenv("GS_BUCKET"))
     blob = bucket.get_blob(getenv("GS_REGION_INFO_FILENAME"))
-    return json.loads(blob.download_as_string())
-REGION_INFO = get_region_info()
+    if blob.generation == version:
+        return None
+    return blob.generation, compileRegions(json.loads(blob.download_as_string()))
+
+
+def loadRegionSnapshot(version=None):
+    """
+    Registry seed for region info: the copy of the blob bundled with 
+    the deploy at REGION_INFO_SNAPSHOT_FILENAME, as (version, regions).
+    The copy is made by hand before deploying (see README).
+    """
+    filename = getenv("REGION_INFO_SNAPSHOT_FILENAME")
+    if not path.exists(filename):
+        raise FileNotFoundError(
+            f"No region info snapshot at {filename}; copy it from gs://{getenv('GS_BUCKET')} (see README)")
+    with open(filename) as f:
+        return f"snapshot-{stat(filename).st_mtime_ns}", compileRegions(json.load(f))
 
-# All regions with bounding boxes
-ACTIVE_REGIONS = [k for k,v in REGION_INFO.items() if v['enabled']]
 
-# All regions with GPS coordinates
-ALL_GPS_LABELS = ACTIVE_REGIONS + [BQ_LABEL_GLOBAL]
+def compileRegions(region_info):
+    # All regions with bounding boxes
+    active_regions = [k for k,v in region_info.items() if v['enabled']]
+    return {
+        'info': region_info,
+        'active': active_regions,
+        # All regions with GPS coordinates
+        'all_gps_labels': active_regions + [BQ_LABEL_GLOBAL],
+        # All labels
+        'all_labels': active_regions + [BQ_LABEL_BADGPS, BQ_LABEL_GLOBAL, "all", "allgps", "tetrad", "purpleair", "aqandu"],
+    }
 
-# All labels
-ALL_LABELS = ACTIVE_REGIONS + [BQ_LABEL_BADGPS, BQ_LABEL_GLOBAL, "all", "allgps", "tetrad", "purpleair", "aqandu"]
+
+def regions():
+    """The current compiled region info (see compileRegions)"""
+    return REGISTRY.current['regions']
 
 
 # def getModelRegion(src):
@@ -122,144 +153,192 @@ def parseDatetimeString(datetime_string:str):
 #         return bounding_box_vertices
 
 
-def loadCorrectionFactors():
-    with open(getenv("CORRECTION_FACTORS_FILENAME")) as csv_file:
-        read_csv = csv_reader(csv_file, delimiter=',')
-        rows = [row for row in read_csv]
-        header = rows[0]
-        rows = rows[1:]
-        correction_factors = []
-        for row in rows:
-            rowDict = {name: elem for elem, name in zip(row, header)}
-            rowDict['start_date'] = parseDatetimeString(rowDict['start_date'])
-            rowDict['end_date']   = parseDatetimeString(rowDict['end_date'])
-            rowDict['3003_slope'] = float(rowDict['3003_slope'])
-            rowDict['3003_intercept'] = float(rowDict['3003_intercept'])
-            correction_factors.append(rowDict)
-        return correction_factors
-
-
-def applyCorrectionFactor(factors, data_timestamp, data):
-    for factor in factors:
-        factor_start = factor['start_date']
-        factor_end = factor['end_date']
-        if factor_start <= data_timestamp and factor_end > data_timestamp:
-            return max(0, data * factor['3003_slope'] + factor['3003_intercept'])
-    print('\nNo correction factor found for ', data_timestamp)
-    return data
-
-
-def applyCorrectionFactorsToList(data_list, pm25_key=None):
-    """Apply correction factors (in place) to PM2.5 data in data_list"""
-    
-    # Open the file and get correction factors
-    with open(getenv("CORRECTION_FACTORS_FILENAME")) as csv_file:
-        read_csv = csv_reader(csv_file, delimiter=',')
-        rows = [row for row in read_csv]
-        header = rows[0]
-        rows = rows[1:]
-        correction_factors = []
+class CorrectionFactors:
+    """
+    PM2.5 correction factors compiled into sorted NumPy arrays. The factor
+    periods [start_date, end_date) are cut into non-overlapping intervals
+    on every period boundary. Interval i is [bounds[i-1], bounds[i]) and
+    holds the slope/intercept of the first factor (in file order) that
+    covers it, or NaN if none does (as do the ends before the first
+    and after the last boundary).
+    """
+
+    def __init__(self, factors):
+        """`factors`: list of (start epoch s, end epoch s, slope, intercept)"""
+        self.bounds = np.unique([t for f in factors for t in f[:2]]).astype(np.float64)
+        self.slopes = np.full(len(self.bounds) + 1, np.nan)
+        self.intercepts = np.full(len(self.bounds) + 1, np.nan)
+        for i, lo in enumerate(self.bounds[:-1], start=1):
+            for f_start, f_end, slope, intercept in factors:
+                if f_start <= lo < f_end:
+                    self.slopes[i], self.intercepts[i] = slope, intercept
+                    break
+
+    @classmethod
+    def fromCSV(cls, filename):
+        with open(filename) as csv_file:
+            rows = list(csv_reader(csv_file, delimiter=','))
+        header, rows = rows[0], rows[1:]
+        factors = []
         for row in rows:
             rowDict = {name: elem for elem, name in zip(row, header)}
-            rowDict['start_date'] = parseDatetimeString(rowDict['start_date'])
-            rowDict['end_date'] = parseDatetimeString(rowDict['end_date'])
-            rowDict['3003_slope'] = float(rowDict['3003_slope'])
-            rowDict['3003_intercept'] = float(rowDict['3003_intercept'])
-            correction_factors.append(rowDict)
-        
-    # Apply the correction factors to the PM2.5 data
-    for datum in data_list:
-        try:
-            datum[pm25_key] = applyCorrectionFactor(correction_factors, datum['Timestamp'], datum[pm25_key])
-        except: # Only try once. We just assume it isn't there if the first row doesn't have it
-            return data_list
-        # found = False
-        # for factor in correction_factors:
-        #     factor_start = factor['start_date']
-        #     factor_end = factor['end_date']
-        #     if factor_start <= datum['Timestamp'] < factor_end:
-        #         datum['PM2_5'] = datum['PM2_5'] * factor['3003_slope'] + factor['3003_intercept']
-        #         found = True
-        #         break
-        # if not found:
-        #     print('\nNo correction factor found for ', datum['Timestamp'])
-    return data_list
-
-
-def _tuneData(data:list, pm25_key=None, temp_key=None, hum_key=None, removeNulls=False):
-    """ Clean data and apply correction factors """
-    # Open the file and get correction factors
-    if pm25_key:
-        with open(getenv("CORRECTION_FACTORS_FILENAME")) as csv_file:
-            read_csv = csv_reader(csv_file, delimiter=',')
-            rows = [row for row in read_csv]
-            header = rows[0]
-            rows = rows[1:]
-            correction_factors = []
-            for row in rows:
-                rowDict = {name: elem for elem, name in zip(row, header)}
-                rowDict['start_date'] = parseDatetimeString(rowDict['start_date'])
-                rowDict['end_date'] = parseDatetimeString(rowDict['end_date'])
-                rowDict['3003_slope'] = float(rowDict['3003_slope'])
-                rowDict['3003_intercept'] = float(rowDict['3003_intercept'])
-                correction_factors.append(rowDict)
-        
-    goodPM, goodTemp, goodHum = True, True, True
-    for datum in data:
-        if pm25_key and goodPM:
-            try:
-                if (datum[pm25_key] == getenv("PM_BAD_FLAG")) or (datum[pm25_key] >= getenv("PM_BAD_THRESH")):
-                    datum[pm25_key] = None
-                else:
-                    datum[pm25_key] = applyCorrectionFactor(correction_factors, datum['Timestamp'], datum[pm25_key])
-            except:
-                goodPM = False
-
-        if temp_key and goodTemp:
-            try:
-                if datum[temp_key] == getenv("TEMP_BAD_FLAG"):
-                    datum[temp_key] = None 
-            except:
-                goodTemp = False
-
-        if hum_key and goodHum:
-            try:
-                if datum[hum_key] == getenv("HUM_BAD_FLAG"):
-                    datum[hum_key] = None 
-            except:
-                goodHum = False
-    
-    if removeNulls:
-
-        # If True, remove all rows with Null data
-        if isinstance(removeNulls, bool):
-            len_before = len(data)
-            data = [datum for datum in data if all(datum.values())]
-            len_after = len(data)
-            print(f"removeNulls=True. Removed {len_before - len_after} rows. [{len_before} -> {len_after}]")
-        
-        # If it's a list, remove the rows missing data listed in removeNulls list        
-        elif isinstance(removeNulls, list):
-            if verifyFields(removeNulls):
-                # Make sure each of the fields specified by removeNulls is in the row. 
-                data = [datum for datum in data if all([datum[field] for field in removeNulls])]
-            else:
-                raise ArgumentError(f"(Internal error): removeNulls bad field name: {removeNulls}", 500)
-        
-        else:
-            raise ArgumentError(f"(Internal error): removeNulls must be bool or list, but was: {type(removeNulls)}", 500)
+            factors.append((
+                parseDatetimeString(rowDict['start_date']).timestamp(),
+                parseDatetimeString(rowDict['end_date']).timestamp(),
+                float(rowDict['3003_slope']),
+                float(rowDict['3003_intercept']),
+            ))
+        return cls(factors)
+
+    def apply(self, epochs, values):
+        """
+        Corrected copy of `values` (float array, NaN for null) at
+        `epochs` (seconds): max(0, slope * value + intercept). Values
+        with no factor are returned unchanged.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        idx = np.searchsorted(self.bounds, np.asarray(epochs, dtype=np.float64), side='right')
+        slopes, intercepts = self.slopes[idx], self.intercepts[idx]
+        missing = np.isnan(slopes)
+        n_missing = np.count_nonzero(missing & ~np.isnan(values))
+        if n_missing:
+            logging.warning(f"No correction factor found for {n_missing} of {len(values)} values")
+        return np.where(missing, values, np.maximum(0, values * slopes + intercepts))
+
+
+def loadCorrectionFactors(version=None):
+    """
+    Registry loader for CORRECTION_FACTORS_FILENAME: (mtime, CorrectionFactors), 
+    or None if the file is still at mtime `version`
+    """
+    filename = getenv("CORRECTION_FACTORS_FILENAME")
+    mtime = stat(filename).st_mtime_ns
+    if mtime == version:
+        return None
+    return mtime, CorrectionFactors.fromCSV(filename)
+
+
+def epochSeconds(timestamps):
+    """Epoch seconds (float64 array) for a list of aware datetimes, or a datetime64 array"""
+    if isinstance(timestamps, np.ndarray):
+        return timestamps.astype('datetime64[us]').astype(np.int64) / 1e6
+    one_s = timedelta(seconds=1)
+    return np.fromiter(((t - EPOCH) / one_s for t in timestamps), dtype=np.float64, count=len(timestamps))
+
+
+# Correction factors and region info, loaded on first use and reloaded
+# in the background when the CSV or the GCS blob changes. Region info 
+# starts from the bundled snapshot, so cold starts don't wait on GCS.
+REGISTRY = Registry(
+    {
+        'correction_factors': loadCorrectionFactors,
+        'regions':            loadRegionInfo,
+    },
+    seeds={'regions': loadRegionSnapshot},
+)
+
+
+# Field -> (bad flag, bad threshold or None)
+CLEANING_RULES = {
+    "PM2_5":       (PM_BAD_FLAG, PM_BAD_THRESH),
+    "TEMPERATURE": (TEMP_BAD_FLAG, None),
+    "HUMIDITY":    (HUM_BAD_FLAG, None),
+}
+
+
+def isNull(col):
+    """Boolean mask of the nulls in a column (list with None, float array with NaN, datetime64 with NaT)"""
+    if isinstance(col, np.ndarray) and col.dtype.kind == 'f':
+        return np.isnan(col)
+    if isinstance(col, np.ndarray) and col.dtype.kind == 'M':
+        return np.isnat(col)
+    return np.fromiter((v is None for v in col), dtype=bool, count=len(col))
+
+
+def listColumn(col):
+    """A column as a list: NaN in float arrays -> None, datetime64 -> aware datetimes"""
+    if isinstance(col, np.ndarray):
+        if col.dtype.kind == 'f':
+            return np.where(np.isnan(col), None, col).tolist()
+        if col.dtype.kind == 'M':
+            return [t.replace(tzinfo=utc) for t in col.astype('datetime64[us]').tolist()]
+        return col.tolist()
+    return list(col)
+
+
+def columnsToDicts(columns):
+    """{name: column} -> [{name: value}] with None for nulls"""
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*(listColumn(columns[n]) for n in names))]
+
+
+def cleanColumns(columns, fields, correct=True, removeNulls=False, mask=True):
+    """
+    Clean a result held as {name: column} (lists, or NumPy arrays), 
+    one vectorized pass per field:
+      - bad flags and values over the threshold in CLEANING_RULES -> NaN
+        (if `mask`; aggregates were already masked in SQL)
+      - PM2.5 corrected with the current correction factors (if `correct`)
+      - removeNulls: True drops rows with a null in any column, a list 
+        of fields drops rows with a null in any of those
+    Cleaned fields become float64 arrays with NaN for null. 
+    Returns the (new) columns.
+    """
+    for field in fields:
+        name = FIELD_MAP.get(field)
+        if field not in CLEANING_RULES or name not in columns:
+            continue
+
+        values = np.array(columns[name], dtype=np.float64)
+        if mask:
+            _maskBadValues(values, field)
+        if field == "PM2_5" and correct and len(values):
+            values = _correctPM(values, columns[FIELD_MAP["TIMESTAMP"]])
+        columns[name] = values
 
-    return data
-        
+    if removeNulls:
+        columns = _dropNullRows(columns, removeNulls)
+    return columns
+
+
+def _maskBadValues(values, field):
+    """Bad flags and values over the threshold in CLEANING_RULES -> NaN, in place"""
+    flag, thresh = CLEANING_RULES[field]
+    bad = values == flag
+    if thresh is not None:
+        bad |= values >= thresh
+    values[bad] = np.nan
+
+
+def _correctPM(values, timestamps):
+    """PM2.5 values corrected with the current correction factors"""
+    factors = REGISTRY.current.data.get('correction_factors')
+    if factors is None:
+        logging.warning("No correction factors loaded; PM2.5 left uncorrected")
+        return values
+    return factors.apply(epochSeconds(timestamps), values)
+
+
+def _dropNullRows(columns, removeNulls):
+    """Rows without a null in any column (removeNulls True), or in any of the fields listed in removeNulls"""
+    # If True, remove all rows with Null data
+    if isinstance(removeNulls, bool):
+        names = list(columns)
+    # If it's a list, remove the rows missing data listed in removeNulls list
+    elif isinstance(removeNulls, list):
+        if not verifyFields(removeNulls):
+            raise ArgumentError(f"(Internal error): removeNulls bad field name: {removeNulls}", 500)
+        names = [FIELD_MAP[field] for field in removeNulls]
+    else:
+        raise ArgumentError(f"(Internal error): removeNulls must be bool or list, but was: {type(removeNulls)}", 500)
 
-def tuneAllFields(data, fields, removeNulls=False):
-    return _tuneData(
-            data,
-            pm25_key=(FIELD_MAP["PM2_5"] if "PM2_5" in fields else None),
-            temp_key=(FIELD_MAP["TEMPERATURE"] if "TEMPERATURE" in fields else None),
-            hum_key=(FIELD_MAP["HUMIDITY"] if "HUMIDITY" in fields else None),
-            removeNulls=removeNulls,
-    )
+    keep = np.ones(len(next(iter(columns.values()), ())), dtype=bool)
+    for name in names:
+        keep &= ~isNull(columns[name])
+    return {
+        name: col[keep] if isinstance(col, np.ndarray) else list(compress(col, keep))
+        for name, col in columns.items()
+    }
 
 
 # def loadLengthScales():
@@ -293,35 +372,52 @@ def tuneAllFields(data, fields, removeNulls=False):
 #     return boundingBox.contains_point((query_lon, query_lat))
 
 
+# removeInvalidSensors: days run from midnight Mountain Standard Time (UTC-7)
+INVALID_SENSOR_DAY_OFFSET = 7 * 3600
+INVALID_SENSOR_DAILY_PM = 350
+
+
+def invalidSensorDays(seconds, device_codes, pm25, limit=INVALID_SENSOR_DAILY_PM):
+    """
+    Mask of the readings on any (device, day) whose average PM2.5 
+    exceeds `limit`, or on the day before or after such a day.
+    seconds:      epoch seconds per reading
+    device_codes: integer device code per reading
+    pm25:         float per reading, NaN for null (left out of the average)
+    """
+    days = np.floor_divide(np.asarray(seconds) - INVALID_SENSOR_DAY_OFFSET, 86400).astype(np.int64)
+    days -= days.min()
+
+    # One key per (device, day). Each device gets an empty day on either
+    # side, so shifting a key by one day never reaches the next device.
+    stride = days.max() + 3
+    keys = np.asarray(device_codes, dtype=np.int64) * stride + days + 1
+
+    groups, inverse = np.unique(keys, return_inverse=True)
+    valid = ~np.isnan(pm25)
+    sums = np.bincount(inverse, weights=np.where(valid, pm25, 0), minlength=len(groups))
+    counts = np.bincount(inverse, weights=valid, minlength=len(groups))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bad = groups[sums / counts > limit]
+
+    return np.isin(keys, np.concatenate([bad - 1, bad, bad + 1]))
+
+
 def removeInvalidSensors(sensor_data):
     # sensor is invalid if its average reading for any day exceeds 350 ug/m3
-    epoch = datetime(1970, 1, 1)
-    epoch = timezone('US/Mountain').localize(epoch)
-    dayCounts = {}
-    dayReadings = {}
-
-    # Accumulate total PM and # entries for each sensor and each day
-    for datum in sensor_data:
-        pm25 = datum['PM2_5']
-        datum['daysSinceEpoch'] = (datum['Timestamp'] - epoch).days
-        key = (datum['daysSinceEpoch'], datum['DeviceID'])
-        if key in dayCounts:
-            dayCounts[key] += 1
-            dayReadings[key] += pm25
-        else:
-            dayCounts[key] = 1
-            dayReadings[key] = pm25
-
-    # get days that had higher than 350 avg reading
-    keysToRemove = [key for key in dayCounts if (dayReadings[key] / dayCounts[key]) > 350]
-    keysToRemoveSet = set()
-    for key in keysToRemove:
-        keysToRemoveSet.add(key)
-        keysToRemoveSet.add((key[0] + 1, key[1]))
-        keysToRemoveSet.add((key[0] - 1, key[1]))
+    if not sensor_data:
+        return sensor_data
+
+    codes = {}
+    drop = invalidSensorDays(
+        epochSeconds([datum[FIELD_MAP["TIMESTAMP"]] for datum in sensor_data]),
+        np.fromiter((codes.setdefault(datum[FIELD_MAP["DEVICEID"]], len(codes)) for datum in sensor_data), 
+                    dtype=np.int64, count=len(sensor_data)),
+        np.array([datum[FIELD_MAP["PM2_5"]] for datum in sensor_data], dtype=np.float64),
+    )
 
-    print(f'Removing these days from data due to exceeding 350 ug/m3 avg: {keysToRemoveSet}')
-    sensor_data = [datum for datum in sensor_data if (datum['daysSinceEpoch'], datum['DeviceID']) not in keysToRemoveSet]
+    logging.info(f'Removing {np.count_nonzero(drop)} readings on days exceeding {INVALID_SENSOR_DAILY_PM} ug/m3 avg')
+    sensor_data = list(compress(sensor_data, ~drop))
 
     # TODO NEEDS TESTING!
     # 5003 sensors are invalid if Raw 24-hour average PM2.5 levels are > 5 ug/m3
@@ -413,48 +509,105 @@ def convertRadiusToBBox(r, c):
     return [N, S, E, W]
 
 
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+
+
+def localMeters(lats, lons, origin):
+    """
+    Equirectangular projection of lat/lon (scalars or arrays) to (x, y) 
+    meters east and north of `origin` {'lat', 'lon'}. Close to UTM over 
+    a region the size of a city, and without zone boundaries.
+    """
+    meters_per_degree = KM_PER_DEGREE * 1000
+    x = (np.asarray(lons, dtype=np.float64) - origin['lon']) * meters_per_degree * math.cos(math.radians(origin['lat']))
+    y = (np.asarray(lats, dtype=np.float64) - origin['lat']) * meters_per_degree
+    return x, y
+
+
 # https://www.movable-type.co.uk/scripts/latlong.html
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Great Circle Distance in kilometers between coordinates in degrees.
+    Takes scalars or NumPy arrays (broadcast against each other).
+    """
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    del1 = np.radians(np.subtract(lat2, lat1))
+    del2 = np.radians(np.subtract(lon2, lon1))
+
+    a = np.sin(del1 / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(del2 / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def unitVectors(lats, lons):
+    """
+    Points on the unit sphere (n x 3) for coordinates in degrees. Straight-line
+    (chord) distance between them orders pairs the same as great-circle distance.
+    """
+    phi, lam = np.radians(lats), np.radians(lons)
+    return np.column_stack((np.cos(phi) * np.cos(lam), np.cos(phi) * np.sin(lam), np.sin(phi)))
+
+
+def chordToKm(chord):
+    """Great-circle distance in kilometers for a chord between unit vectors"""
+    return EARTH_RADIUS_KM * 2 * np.arcsin(np.minimum(np.asarray(chord) / 2, 1))
+
+
 def distBetweenCoords(p1, p2):
     """
     Get the Great Circle Distance between two
     GPS coordinates, in kilometers
     """
-    R = 6371
-    phi1 = p1[0] * (math.pi / 180)
-    phi2 = p2[0] * (math.pi / 180)
-    del1 = (p2[0] - p1[0]) * (math.pi / 180)
-    del2 = (p2[1] - p1[1]) * (math.pi / 180)
-    
-    a = math.sin(del1 / 2) * math.sin(del1 / 2) +   \
-        math.cos(phi1) * math.cos(phi2) *           \
-        math.sin(del2 / 2) * math.sin(del2 / 2)
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    d = R * c 
-    return d
+    return float(haversine(p1[0], p1[1], p2[0], p2[1]))
+
 
 def coordsInCircle(coords, radius, center):
     return distBetweenCoords(coords, center) <= radius
 
 
-def bboxDataToRadiusData(data, radius, center):
-    inRad = []
-    for datum in data:
-        lat = datum[FIELD_MAP["LATITUDE"]]
-        lon = datum[FIELD_MAP["LONGITUDE"]]
-        if coordsInCircle((lat, lon), radius, center):
-            inRad.append(datum)
-    return inRad
+def radiusBounds(radius, center):
+    """
+    Half-widths (dlat, dlon) in degrees of a box that contains the circle
+    of `radius` km around `center`. dlon is None when the circle reaches
+    a pole, where every longitude is in range.
+    """
+    dlat = radius / KM_PER_DEGREE
+    if abs(center['lat']) + dlat >= 90:
+        return dlat, None
+    return dlat, dlat / math.cos(math.radians(abs(center['lat']) + dlat))
 
 
-def idsToWHEREClause(ids, id_field_name):
+def radiusMask(lats, lons, radius, center):
     """
-    Return string that looks like:
-    (<id_field_name> = <id[0]> OR ... OR <id_field_name> = <id[n-1]>)
+    Mask of the coordinates within `radius` km of `center` ({'lat', 'lon'}).
+    A bounding box around the circle rules out most points before the
+    haversine runs on the rest. Null (NaN) coordinates are outside.
     """
-    if isinstance(ids, str):
-        ids = [ids]
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    dlat, dlon = radiusBounds(radius, center)
+
+    with np.errstate(invalid='ignore'):
+        candidates = np.abs(lats - center['lat']) <= dlat
+        if dlon is not None:
+            # Longitude difference wrapped to [-180, 180) for the antimeridian
+            candidates &= np.abs((lons - center['lon'] + 180) % 360 - 180) <= dlon
+
+    mask = np.zeros(len(lats), dtype=bool)
+    mask[candidates] = haversine(lats[candidates], lons[candidates], center['lat'], center['lon']) <= radius
+    return mask
+
 
-    return """({})""".format(' OR '.join([f'{id_field_name} = "{ID}"' for ID in ids]))
+def bboxDataToRadiusData(data, radius, center):
+    """Rows (dicts or bigquery Rows) of `data` within `radius` km of `center` ({'lat', 'lon'})"""
+    if not data:
+        return list(data)
+    mask = radiusMask(
+        np.array([datum['Latitude'] for datum in data], dtype=np.float64),
+        np.array([datum['Longitude'] for datum in data], dtype=np.float64),
+        radius, center
+    )
+    return list(compress(data, mask))
 
 
 def verifyDateString(dateString:str) -> bool:
@@ -505,7 +658,7 @@ def verifyDeviceList(devices:[str]) -> bool:
 
 
 def verifySources(srcs:list):
-    return set(srcs).issubset(ALL_LABELS)
+    return set(srcs).issubset(regions()['all_labels'])
 
 
 def verifyFields(fields:list):
@@ -562,7 +715,7 @@ def argParseSources(srcs, single_source=False, canBeNone=False):
     if ',' in srcs:
         
         if single_source:
-            raise ArgumentError(f"Argument 'src' must be one included from: {', '.join(ALL_LABELS + ['all'])}", 400)
+            raise ArgumentError(f"Argument 'src' must be one included from: {', '.join(regions()['all_labels'] + ['all'])}", 400)
 
         # All the labels are lowercase 
         srcs = [s.lower() for s in srcs.split(',')]
@@ -584,7 +737,7 @@ def argParseSources(srcs, single_source=False, canBeNone=False):
 
     # Check src[s] for validity
     if not verifySources(srcs):
-        raise ArgumentError(f"Argument 'src' must be included from one or more of {', '.join(ALL_LABELS + ['all'])}", 400)
+        raise ArgumentError(f"Argument 'src' must be included from one or more of {', '.join(regions()['all_labels'] + ['all'])}", 400)
     
     if single_source:
         return srcs[0]
@@ -688,11 +841,46 @@ def argParseRadiusArgs(r:float, c:str):
         raise
 
 
-def queryOR(field, values):
-    '''{field} = "{value[0]}" OR {field} = "{value[1]}" OR ...'''
-    conds = [f'{field} = "{value}"' for value in values]
-    combined = "(" + " OR ".join(conds) + ")"
-    return combined
+def argParseFormat(fmt:str, formats):
+    """Parse a 'format' argument. Defaults to the first of `formats`"""
+    if fmt is None:
+        return formats[0]
+
+    fmt = fmt.lower()
+    if fmt not in formats:
+        raise ArgumentError(f"Argument 'format' must be one of: {', '.join(formats)}", status_code=400)
+    return fmt
+
+
+def argParseAgg(agg:str, fn:str):
+    """
+    Parse the 'agg' and 'fn' arguments. Returns None for raw rows, 
+    otherwise (interval seconds, fn). 'fn' defaults to mean.
+    """
+    if agg is None:
+        if fn is not None:
+            raise ArgumentError("Argument 'fn' requires 'agg'", status_code=400)
+        return None
+
+    agg = agg.lower()
+    if agg not in AGG_INTERVALS:
+        raise ArgumentError(f"Argument 'agg' must be one of: {', '.join(AGG_INTERVALS)}", status_code=400)
+
+    fn = (fn or AGG_FUNCTIONS[0]).lower()
+    if fn not in AGG_FUNCTIONS:
+        raise ArgumentError(f"Argument 'fn' must be one of: {', '.join(AGG_FUNCTIONS)}", status_code=400)
+    return AGG_INTERVALS[agg], fn
+
+
+def argParseBool(b:str, name:str):
+    """Parse a 'true'/'false' argument. Absent means False"""
+    if b is None:
+        return False
+
+    b = b.lower()
+    if b not in ('true', 'false'):
+        raise ArgumentError(f"Argument '{name}' must be 'true' or 'false'", status_code=400)
+    return b == 'true'
 
 
 def queryBuildFields(fields):
@@ -723,24 +911,41 @@ def queryBuildFields(fields):
 #     return tbl_union
 
 
-def queryBuildLabels(labels):
+def labelFilter(labels):
     """
-    Special cases for "all" and "allgps"
-    TODO: Add special cases for "tetrad", "aqandu", "purpleair" as well
+    In-memory counterpart of the label clause in 
+    query_builder.telemetryTemplate: returns a
+    predicate that is True for rows the query would select.
+    Rows must carry Source, Label, Latitude and Longitude.
     """
     if "all" in labels:
-        return "True"
+        return lambda row: True
     elif "allgps" in labels:
-        regions = [k for k in REGION_INFO.values() if k['enabled']]
-        return f'(Source != "PurpleAir") AND (IFNULL(Label, "") != "badgps" AND {queryBuildMultipleRegions(regions)}) OR (Label = "global" AND Source != "PurpleAir")'
+        region_list = [r for r in regions()['info'].values() if r['enabled']]
+
+        def inRegions(row):
+            lat, lon = row['Latitude'], row['Longitude']
+            if lat is None or lon is None:
+                return False
+            return any(
+                (r['lat_lo'] <= lat <= r['lat_hi']) and (r['lon_lo'] <= lon <= r['lon_hi']) 
+                for r in region_list
+            )
+
+        return lambda row: (
+            (row[FIELD_MAP["SOURCE"]] != "PurpleAir") 
+                and (row[FIELD_MAP["LABEL"]] or "") != "badgps" 
+                and inRegions(row)
+        ) or (row[FIELD_MAP["LABEL"]] == "global" and row[FIELD_MAP["SOURCE"]] != "PurpleAir")
     elif "tetrad" in labels:
-        return 'Source = "Tetrad"'
+        return lambda row: row[FIELD_MAP["SOURCE"]] == "Tetrad"
     elif "purpleair" in labels:
-        return 'Source = "PurpleAir"'
+        return lambda row: row[FIELD_MAP["SOURCE"]] == "PurpleAir"
     elif "aqandu" in labels:
-        return 'Source = "AQ&U"'
+        return lambda row: row[FIELD_MAP["SOURCE"]] == "AQ&U"
     else:
-        return queryOR("Label", labels)
+        labels = set(labels)
+        return lambda row: row[FIELD_MAP["LABEL"]] in labels
 
 
 def queryBuildMultipleRegions(region_list):
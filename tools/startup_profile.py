@@ -0,0 +1,92 @@
+"""
+Where an instance's startup time goes: imports `main` in a fresh
+interpreter under `python -X importtime`, then creates each shared
+client in tetrad.clients in turn. Reports the packages and tetrad
+modules that took longest to import, and how long each client took.
+
+Run from the repo root in the development environment (see README),
+with credentials and the app.yaml env_variables set or loaded from
+app.yaml:
+
+    python tools/startup_profile.py [top]
+"""
+from collections import defaultdict
+import json
+from os import environ
+import subprocess
+import sys
+import yaml
+
+with open('app.yaml') as f:
+    for k, v in yaml.safe_load(f)['env_variables'].items():
+        environ.setdefault(k, str(v))
+
+
+CHILD = """
+import json, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+from tetrad import clients
+for name in ['cloudLogging', 'bigquery', 'bigqueryRead', 'storage', 'firestore', 'secretManager', 'firebaseApp']:
+    try:
+        getattr(clients, name)()
+    except Exception as e:
+        clients.TIMINGS[name] = repr(e)
+print(json.dumps({'import': t1 - t0, 'clients': clients.TIMINGS}))
+"""
+
+# Namespace packages: group by the package below them instead
+NAMESPACES = {'google', 'google.cloud'}
+
+
+def packageOf(module):
+    parts = module.split('.')
+    n = 1
+    while n < len(parts) and '.'.join(parts[:n]) in NAMESPACES:
+        n += 1
+    return '.'.join(parts[:n])
+
+
+def parseImportTime(stderr):
+    """{module: (self us, cumulative us)} from -X importtime output"""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        times[module.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main(top):
+    # Create the clients here, one at a time, instead of in the background
+    env = dict(environ, STARTUP_WARM_CLIENTS="")
+    child = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD], capture_output=True, text=True, env=env)
+    if child.returncode != 0:
+        sys.exit(child.stderr)
+    result = json.loads(child.stdout.strip().splitlines()[-1])
+    times = parseImportTime(child.stderr)
+
+    packages = defaultdict(int)
+    for module, (self_us, _) in times.items():
+        packages[packageOf(module)] += self_us
+
+    print(f"import main: {result['import'] * 1e3:.0f} ms")
+
+    print("\nPackages by import time (self time of all their modules):")
+    for package, us in sorted(packages.items(), key=lambda kv: -kv[1])[:top]:
+        print(f"  {us / 1e3:8.1f} ms  {package}")
+
+    print("\ntetrad modules by cumulative import time (includes what they import first):")
+    tetrad = [(m, cum) for m, (_, cum) in times.items() if m == 'main' or m.split('.')[0] == 'tetrad']
+    for module, us in sorted(tetrad, key=lambda kv: -kv[1])[:top]:
+        print(f"  {us / 1e3:8.1f} ms  {module}")
+
+    print("\nClients (tetrad.clients), created on first use:")
+    for name, seconds in sorted(result['clients'].items(), key=lambda kv: -kv[1] if isinstance(kv[1], float) else 0):
+        print(f"  {seconds * 1e3:8.1f} ms  {name}" if isinstance(seconds, float) else f"    failed  {name}: {seconds}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 15)